@@ -3,7 +3,7 @@ import numbers
 from collections import defaultdict, deque
 from dataclasses import dataclass, field
 
-from opendbc.car.carlog import carlog
+from opendbc.car.carlog import WARNING, eventlog
 from opendbc.can.dbc import DBC, Signal
 
 
@@ -45,9 +45,11 @@ class MessageState:
   first_seen_nanos: int = 0
   last_warning_log_nanos: int = 0
 
-  def rate_limited_log(self, last_update_nanos: int, msg: str) -> None:
+  def rate_limited_log(self, last_update_nanos: int, name: str, **fields) -> None:
+    # every occurrence is counted, the event is only built once a second
+    eventlog.count("can_parser", name)
     if (last_update_nanos - self.last_warning_log_nanos) >= 1_000_000_000:
-      carlog.warning(f"CANParser: {hex(self.address)} {self.name} {msg}")
+      eventlog.event(WARNING, "can_parser", name, addr=self.address, msg=self.name, **fields)
       self.last_warning_log_nanos = last_update_nanos
 
   def parse(self, nanos: int, dat: bytes) -> bool:
@@ -67,7 +69,7 @@ class MessageState:
         expected_checksum = sig.calc_checksum(self.address, sig, bytearray(dat))
         if tmp != expected_checksum:
           checksum_failed = True
-          self.rate_limited_log(nanos, f"checksum failed: received {hex(tmp)}, calculated {hex(expected_checksum)}")
+          self.rate_limited_log(nanos, "checksum_failed", received=tmp, calculated=expected_checksum)
 
       if not self.ignore_counter and sig.type == 1:  # COUNTER
         if not self.update_counter(tmp, sig.size):
@@ -96,6 +98,10 @@ class MessageState:
         self.timeout_threshold = (1_000_000_000 / self.frequency) * 10
     return True
 
+  def set_frequency(self, frequency: float) -> None:
+    self.frequency = frequency
+    self.timeout_threshold = (1_000_000_000 / frequency) * 10
+
   def update_counter(self, cur_count: int, cnt_size: int) -> bool:
     if ((self.counter + 1) & ((1 << cnt_size) - 1)) != cur_count:
       self.counter_fail = min(self.counter_fail + 1, MAX_BAD_COUNTER)
@@ -118,8 +124,12 @@ class VLDict(dict):
   def __init__(self, parser):
     super().__init__()
     self.parser = parser
+    # messages read by name or address, only recorded when set
+    self.reads: set[int | str] | None = None
 
   def __getitem__(self, key):
+    if self.reads is not None:
+      self.reads.add(key)
     if key not in self:
       self.parser._add_message(key)
     return super().__getitem__(key)
@@ -204,10 +214,10 @@ class CANParser:
     for state in self.message_states.values():
       if state.counter_fail >= MAX_BAD_COUNTER:
         counters_valid = False
-        state.rate_limited_log(self._last_update_nanos, f"counter invalid, {state.counter_fail=} {MAX_BAD_COUNTER=}")
+        state.rate_limited_log(self._last_update_nanos, "counter_invalid", counter_fail=state.counter_fail)
       if not state.valid(self._last_update_nanos, bus_timeout):
         valid = False
-        state.rate_limited_log(self._last_update_nanos, "not valid (timeout or missing)")
+        state.rate_limited_log(self._last_update_nanos, "timeout_or_missing")
 
     # TODO: probably only want to increment this once per update() call
     self.can_invalid_cnt = 0 if valid else min(self.can_invalid_cnt + 1, CAN_INVALID_CNT)
@@ -236,7 +246,7 @@ class CANParser:
         if state.parse(t, dat):
           updated_addrs.add(address)
 
-          vl_addr = self.vl[address]
+          vl_addr = dict.__getitem__(self.vl, address)
           vl_all_addr = self.vl_all[address]
           ts_addr = self.ts_nanos[address]
 
@@ -0,0 +1,178 @@
+import math
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from opendbc.can.dbc import DBC, Signal, SignalType
+from opendbc.can.parser import CANParser, get_raw_value
+
+CAN_BITRATE = 500_000
+CAN_FD_DATA_BITRATE = 2_000_000
+
+
+def frame_bits(address: int, length: int) -> tuple[int, int]:
+  """Bits of a frame sent at the nominal and at the data bitrate, without stuff bits.
+  Frames over 8 bytes are CAN FD with bit rate switching, the rest classic CAN"""
+  extended = address > 0x7FF
+  if length <= 8:
+    # SOF, arbitration, control, CRC, ACK, EOF and interframe space
+    return (67 if extended else 47) + 8 * length, 0
+  # ESI, DLC, stuff count and CRC are sent at the data bitrate, along with the data
+  return (49 if extended else 30), 9 + 8 * length + (17 if length <= 16 else 21)
+
+
+@dataclass
+class MessageStats:
+  address: int
+  name: str | None = None
+  count: int = 0
+  first_nanos: int = 0
+  last_nanos: int = 0
+  # running mean and variance of the time between frames
+  dt_mean: float = 0.
+  dt_m2: float = 0.
+  dt_max: float = 0.
+  min_len: int = 64
+  max_len: int = 0
+  checksum_fails: int = 0
+  counter_fails: int = 0
+  last_counter: int | None = None
+
+  @property
+  def frequency(self) -> float:
+    return 1 / self.dt_mean if self.dt_mean > 0 else 0.
+
+  @property
+  def jitter(self) -> float:
+    """Standard deviation of the time between frames, in seconds"""
+    return math.sqrt(self.dt_m2 / (self.count - 2)) if self.count > 2 else 0.
+
+  @property
+  def checksum_fail_rate(self) -> float:
+    return self.checksum_fails / self.count if self.count else 0.
+
+  @property
+  def counter_fail_rate(self) -> float:
+    return self.counter_fails / self.count if self.count else 0.
+
+
+@dataclass
+class BusStats:
+  bus: int
+  messages: dict[int, MessageStats] = field(default_factory=dict)
+  frames: int = 0
+  first_nanos: int = 0
+  last_nanos: int = 0
+  nominal_bits: int = 0
+  data_bits: int = 0
+
+  def load(self, bitrate: int = CAN_BITRATE, data_bitrate: int = CAN_FD_DATA_BITRATE) -> float:
+    """Fraction of the time the bus was busy"""
+    duration = (self.last_nanos - self.first_nanos) * 1e-9
+    return (self.nominal_bits / bitrate + self.data_bits / data_bitrate) / duration if duration > 0 else 0.
+
+
+@dataclass
+class ParserCoverage:
+  consumed: set[int]
+  ignored: set[int]
+  missing: set[int]
+
+
+class CanTrafficStats:
+  """Streaming statistics of the CAN traffic on each bus: frequency, jitter and length of every address, bus load,
+  and with a DBC for the bus, checksum and counter failures. Each frame takes constant time, and memory is constant
+  for each address seen, so it can run inline next to the parsers or over whole logs"""
+
+  def __init__(self, dbc_names: dict[int, str] | None = None):
+    self.buses: dict[int, BusStats] = {}
+    self.dbcs: dict[int, DBC] = {bus: DBC(dbc_name) for bus, dbc_name in (dbc_names or {}).items()}
+    # checksum and counter signals of every message, looked up once for each address seen
+    self._checks: dict[tuple[int, int], tuple[Signal | None, Signal | None]] = {}
+
+  @classmethod
+  def from_parsers(cls, parsers: Iterable[CANParser]) -> 'CanTrafficStats':
+    return cls({cp.bus: cp.dbc_name for cp in parsers})
+
+  def update(self, can_packets) -> None:
+    """Takes frames like CANParser.update: (nanos, [(address, dat, src), ...]) or a list of them"""
+    if can_packets and not isinstance(can_packets[0], list | tuple):
+      can_packets = [can_packets]
+
+    for nanos, frames in can_packets:
+      for address, dat, src in frames:
+        self.update_frame(nanos, address, dat, src)
+
+  def update_frame(self, nanos: int, address: int, dat: bytes, bus: int) -> None:
+    bus_stats = self.buses.get(bus)
+    if bus_stats is None:
+      bus_stats = self.buses[bus] = BusStats(bus, first_nanos=nanos)
+    bus_stats.frames += 1
+    bus_stats.last_nanos = nanos
+    nominal_bits, data_bits = frame_bits(address, len(dat))
+    bus_stats.nominal_bits += nominal_bits
+    bus_stats.data_bits += data_bits
+
+    msg = bus_stats.messages.get(address)
+    if msg is None:
+      msg = bus_stats.messages[address] = self._new_message(bus, address)
+      msg.first_nanos = nanos
+    else:
+      # Welford's algorithm, the mean and variance of the intervals so far
+      dt = (nanos - msg.last_nanos) * 1e-9
+      n = msg.count
+      delta = dt - msg.dt_mean
+      msg.dt_mean += delta / n
+      msg.dt_m2 += delta * (dt - msg.dt_mean)
+      msg.dt_max = max(msg.dt_max, dt)
+    msg.count += 1
+    msg.last_nanos = nanos
+    msg.min_len = min(msg.min_len, len(dat))
+    msg.max_len = max(msg.max_len, len(dat))
+
+    checksum_sig, counter_sig = self._checks.get((bus, address), (None, None))
+    if checksum_sig is not None and checksum_sig.calc_checksum is not None:
+      if get_raw_value(dat, checksum_sig) != checksum_sig.calc_checksum(address, checksum_sig, bytearray(dat)):
+        msg.checksum_fails += 1
+    if counter_sig is not None:
+      counter = get_raw_value(dat, counter_sig)
+      if msg.last_counter is not None and counter != (msg.last_counter + 1) & ((1 << counter_sig.size) - 1):
+        msg.counter_fails += 1
+      msg.last_counter = counter
+
+  def _new_message(self, bus: int, address: int) -> MessageStats:
+    dbc = self.dbcs.get(bus)
+    dbc_msg = dbc.addr_to_msg.get(address) if dbc is not None else None
+    if dbc_msg is None:
+      return MessageStats(address)
+
+    checksum_sig = next((s for s in dbc_msg.sigs.values() if s.calc_checksum is not None), None)
+    counter_sig = next((s for s in dbc_msg.sigs.values() if s.type == SignalType.COUNTER), None)
+    self._checks[(bus, address)] = (checksum_sig, counter_sig)
+    return MessageStats(address, dbc_msg.name)
+
+  def coverage(self, parsers: Iterable[CANParser]) -> dict[int, ParserCoverage]:
+    """Addresses seen that the parsers of each bus consume or ignore, and the ones they parse that weren't seen"""
+    parsed: dict[int, set[int]] = {}
+    for cp in parsers:
+      parsed.setdefault(cp.bus, set()).update(cp.addresses)
+
+    ret = {}
+    for bus, addresses in parsed.items():
+      seen = set(self.buses[bus].messages) if bus in self.buses else set()
+      ret[bus] = ParserCoverage(seen & addresses, seen - addresses, addresses - seen)
+    return ret
+
+  def report(self, parsers: Iterable[CANParser] = ()) -> str:
+    coverage = self.coverage(parsers)
+    lines = []
+    for bus, bus_stats in sorted(self.buses.items()):
+      lines.append(f"bus {bus}: {bus_stats.frames} frames, {len(bus_stats.messages)} addresses, {bus_stats.load():.1%} load")
+      lines.append(f"  {'address':>10} {'name':<32} {'count':>7} {'freq Hz':>8} {'jitter ms':>9} {'len':>5} {'chk fail':>8} {'cnt fail':>8}")
+      for address, msg in sorted(bus_stats.messages.items()):
+        length = str(msg.max_len) if msg.min_len == msg.max_len else f"{msg.min_len}-{msg.max_len}"
+        name = (msg.name or '') + (' (ignored)' if bus in coverage and address in coverage[bus].ignored else '')
+        lines.append(f"  {hex(address):>10} {name:<32} {msg.count:>7} {msg.frequency:>8.1f} {msg.jitter * 1e3:>9.2f} {length:>5} " +
+                     f"{msg.checksum_fail_rate:>8.1%} {msg.counter_fail_rate:>8.1%}")
+      if bus in coverage and coverage[bus].missing:
+        lines.append(f"  parsed but not seen: {', '.join(hex(address) for address in sorted(coverage[bus].missing))}")
+    return "\n".join(lines)
@@ -0,0 +1,59 @@
+import random
+import unittest
+
+from opendbc.can import CANPacker, CANParser
+from opendbc.can.stats import CanTrafficStats, frame_bits
+
+DBC = "honda_civic_touring_2016_can_generated"
+
+
+class TestCanTrafficStats(unittest.TestCase):
+  def test_timing(self):
+    # 100 Hz with 1 ms of jitter on bus 0, a CAN FD message every 20 ms on bus 1
+    rng = random.Random(0)
+    stats = CanTrafficStats()
+    for i in range(2000):
+      nanos = i * 10_000_000 + int(rng.gauss(0, 1e6))
+      stats.update((nanos, [(0x100, bytes(8), 0)] + ([(0x200, bytes(64), 1)] if i % 2 == 0 else [])))
+
+    msg = stats.buses[0].messages[0x100]
+    self.assertEqual((msg.count, msg.min_len, msg.max_len), (2000, 8, 8))
+    self.assertAlmostEqual(msg.frequency, 100, delta=0.1)
+    # the jitter of the interval between two frames adds up the jitter of both
+    self.assertAlmostEqual(msg.jitter, 2 ** 0.5 * 1e-3, delta=1e-4)
+    self.assertAlmostEqual(stats.buses[1].messages[0x200].frequency, 50, delta=0.1)
+
+    # 111 bits every 10 ms at 500 kbit/s
+    self.assertAlmostEqual(stats.buses[0].load(), 111 / 500_000 / 0.01, delta=1e-3)
+    self.assertEqual(frame_bits(0x200, 64), (30, 9 + 512 + 21))
+    self.assertEqual(frame_bits(0x18DAF100, 8), (67 + 64, 0))
+
+  def test_checksum_counter(self):
+    packer = CANPacker(DBC)
+    stats = CanTrafficStats({0: DBC})
+    for i in range(100):
+      addr, dat, bus = packer.make_can_msg("ENGINE_DATA", 0, {"COUNTER": i % 4 if i != 50 else 0})
+      if i % 10 == 0:
+        dat = bytes([dat[0] ^ 1]) + dat[1:]
+      stats.update((i * 10_000_000, [(addr, dat, bus)]))
+
+    msg = stats.buses[0].messages[0x158]
+    self.assertEqual(msg.name, "ENGINE_DATA")
+    self.assertEqual(msg.checksum_fails, 10)
+    # a skipped counter breaks the sequence twice, going to and coming back from the wrong value
+    self.assertEqual(msg.counter_fails, 2)
+
+  def test_coverage(self):
+    parser = CANParser(DBC, [("ENGINE_DATA", 100), ("POWERTRAIN_DATA", 100)], 0)
+    stats = CanTrafficStats.from_parsers([parser])
+    stats.update([(i * 10_000_000, [(0x158, bytes(8), 0), (0x123, bytes(8), 0)]) for i in range(10)])
+
+    coverage = stats.coverage([parser])[0]
+    self.assertEqual((coverage.consumed, coverage.ignored, coverage.missing), ({0x158}, {0x123}, {0x17c}))
+    report = stats.report([parser])
+    self.assertIn("ENGINE_DATA", report)
+    self.assertIn("parsed but not seen: 0x17c", report)
+
+
+if __name__ == "__main__":
+  unittest.main()
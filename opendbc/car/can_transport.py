@@ -0,0 +1,150 @@
+import asyncio
+import sys
+import time
+from collections import deque
+from collections.abc import Callable, Collection, Generator
+from contextlib import contextmanager
+
+from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallable
+from opendbc.car.carlog import carlog
+
+
+class CanTransport:
+  """Sends frames to one ECU, and buffers the frames it sends back, over the can_send/can_recv callables.
+  Frames from other addresses and buses are dropped, nothing is cleared between requests."""
+
+  def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, tx_addr: int, rx_addrs: Collection[int], bus: int = 0, debug: bool = False):
+    self.can_send = can_send
+    self.can_recv = can_recv
+    self.tx_addr = tx_addr
+    self.rx_addrs = frozenset(rx_addrs)
+    self.bus = bus
+    self.debug = debug
+    self.rx_buff: deque[CanData] = deque()
+
+  def send(self, dats: list[bytes]) -> None:
+    if self.debug:
+      for dat in dats:
+        print(f"CAN-TX: {hex(self.tx_addr)} - 0x{bytes.hex(dat)}")
+    self.can_send([CanData(self.tx_addr, dat, self.bus) for dat in dats])
+
+  def _recv_buffer(self, wait_for_one: bool) -> None:
+    for packet in self.can_recv(wait_for_one=wait_for_one):
+      for msg in packet:
+        if msg.src == self.bus and msg.address in self.rx_addrs:
+          if self.debug:
+            print(f"CAN-RX: {hex(msg.address)} - 0x{bytes.hex(msg.dat)}")
+          self.rx_buff.append(CanData(msg.address, bytes(msg.dat), msg.src))
+
+  def recv(self, timeout: float) -> CanData | None:
+    """Next frame from the ECU, or None if none arrives within timeout"""
+    deadline = time.monotonic() + timeout
+    while not self.rx_buff:
+      if time.monotonic() > deadline:
+        return None
+      self._recv_buffer(wait_for_one=True)
+    return self.rx_buff.popleft()
+
+  def drain(self) -> None:
+    """Drops anything the ECU sent so far, like late responses to an earlier request"""
+    self.can_recv()
+    self.rx_buff.clear()
+
+
+class CanListener:
+  """Frames accepted for one coroutine, buffered by the reader task of an AsyncCanTransport"""
+
+  def __init__(self, accept: Callable[[CanData], bool]):
+    self.accept = accept
+    self.rx_buff: deque[CanData] = deque()
+    self._received = asyncio.Event()
+
+  def put(self, msg: CanData) -> None:
+    self.rx_buff.append(msg)
+    self._received.set()
+
+  def get(self) -> list[CanData]:
+    """Frames received since the last call, without waiting"""
+    msgs = list(self.rx_buff)
+    self.rx_buff.clear()
+    self._received.clear()
+    return msgs
+
+  async def wait(self, timeout: float) -> bool:
+    """Waits up to timeout for a frame, returns whether any are buffered"""
+    if not self.rx_buff:
+      try:
+        await asyncio.wait_for(self._received.wait(), timeout)
+      except TimeoutError:
+        pass
+    # let the reader and other coroutines run between frames
+    await asyncio.sleep(0)
+    return len(self.rx_buff) > 0
+
+  async def recv(self, timeout: float) -> list[CanData]:
+    """Like can_recv(wait_for_one=True): frames received so far, or the first ones to arrive within timeout"""
+    await self.wait(timeout)
+    return self.get()
+
+
+class AsyncCanTransport:
+  """Shares the can_send/can_recv callables between the coroutines of one event loop. While anyone listens, a reader
+  task polls can_recv without blocking and hands each frame to every listener that accepts it, so concurrent queries
+  don't take each other's frames. Queries to the same ECU still see each other's responses."""
+
+  def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, poll_interval: float = 0.001):
+    self.can_send = can_send
+    self.can_recv = can_recv
+    self.poll_interval = poll_interval
+    self._listeners: list[CanListener] = []
+    self._reader: asyncio.Task | None = None
+
+  def send(self, msgs: list[CanData]) -> None:
+    self.can_send(msgs)
+
+  @contextmanager
+  def listen(self, accept: Callable[[CanData], bool] = lambda msg: True) -> Generator[CanListener, None, None]:
+    """Buffers the accepted frames received until the block exits. Listen before sending a request, anything
+    received earlier is not passed on"""
+    listener = CanListener(accept)
+    if self._reader is None or self._reader.done():
+      # nobody read the socket since the last listener left, drop what queued up in the meantime
+      self.can_recv()
+      self._reader = asyncio.get_running_loop().create_task(self._read())
+    self._listeners.append(listener)
+    try:
+      yield listener
+    finally:
+      self._listeners.remove(listener)
+
+  async def _read(self) -> None:
+    while self._listeners:
+      received = False
+      try:
+        for packet in self.can_recv():
+          for msg in packet:
+            received = True
+            for listener in self._listeners:
+              if listener.accept(msg):
+                listener.put(msg)
+      except Exception:
+        carlog.exception("CAN receive exception")
+      await asyncio.sleep(0 if received else self.poll_interval)
+
+
+def panda_can_send(panda) -> CanSendCallable:
+  def can_send(msgs: list[CanData]) -> None:
+    panda.can_send_many([(msg.address, msg.dat, msg.src) for msg in msgs])
+  return can_send
+
+
+def panda_can_recv(panda) -> CanRecvCallable:
+  def can_recv(wait_for_one: bool = False) -> list[list[CanData]]:
+    msgs = panda.can_recv() or []
+    if len(msgs) >= 256:
+      print("CAN RX buffer overflow!!!", file=sys.stderr)
+    if not msgs and wait_for_one:
+      # the panda has no blocking receive
+      time.sleep(0.0005)
+    return [[CanData(addr, bytes(dat), bus) for addr, dat, bus in msgs]]
+  return can_recv
@@ -1,5 +1,12 @@
 import os
 import logging
+import pickle
+import struct
+import time
+from collections import Counter, deque
+from collections.abc import Callable, Iterator
+from logging import DEBUG, INFO, WARNING, ERROR  # noqa: F401
+from typing import BinaryIO, NamedTuple
 
 # set up logging
 LOGPRINT = os.environ.get('LOGPRINT', 'INFO').upper()
@@ -10,3 +17,105 @@ carlog.propagate = False
 handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter('%(message)s'))
 carlog.addHandler(handler)
+
+
+def _format_field(key: str, value) -> str:
+  if isinstance(value, bytes | bytearray):
+    return '0x' + value.hex()
+  if isinstance(value, int) and key.endswith('addr'):
+    return hex(value)
+  return str(value)
+
+
+class CarlogEvent(NamedTuple):
+  """A structured event, only formatted to text when a sink asks for it"""
+  nanos: int
+  level: int
+  subsystem: str
+  name: str
+  fields: dict[str, object]
+
+  def __str__(self) -> str:
+    return ' '.join([f'{self.subsystem}: {self.name}', *(f'{key}={_format_field(key, value)}' for key, value in self.fields.items())])
+
+
+EventSink = Callable[[CarlogEvent], None]
+
+
+class LoggerSink:
+  """Passes events on to a stdlib logger, formatted only if one of its handlers emits them"""
+
+  def __init__(self, logger: logging.Logger = carlog):
+    self.logger = logger
+
+  def __call__(self, event: CarlogEvent) -> None:
+    self.logger.log(event.level, '%s', event)
+
+
+class RingBufferSink:
+  """Keeps the last maxlen events in memory"""
+
+  def __init__(self, maxlen: int = 1000):
+    self.events: deque[CarlogEvent] = deque(maxlen=maxlen)
+
+  def __call__(self, event: CarlogEvent) -> None:
+    self.events.append(event)
+
+
+class BinaryFileSink:
+  """Appends events to a file as length-prefixed pickles, read them back with read_events"""
+
+  def __init__(self, f: BinaryIO):
+    self.f = f
+
+  def __call__(self, event: CarlogEvent) -> None:
+    dat = pickle.dumps(tuple(event), protocol=pickle.HIGHEST_PROTOCOL)
+    self.f.write(struct.pack('<I', len(dat)) + dat)
+
+
+def read_events(f: BinaryIO) -> Iterator[CarlogEvent]:
+  while header := f.read(4):
+    size, = struct.unpack('<I', header)
+    yield CarlogEvent(*pickle.loads(f.read(size)))
+
+
+class EventLog:
+  """Structured events and counters of the car subsystems. Events below the level are dropped, the rest go to every sink.
+  Without a level of its own, the log follows the level of the logger, so carlog.setLevel applies to both.
+  Hot paths check the debug flag before building an event, so disabled debug logging never formats anything"""
+
+  def __init__(self, level: int | None = None, sinks: list[EventSink] | None = None, logger: logging.Logger = carlog):
+    self.sinks: list[EventSink] = sinks if sinks is not None else [LoggerSink(logger)]
+    self.counters: Counter[tuple[str, str]] = Counter()
+    self.logger = logger
+    self.level = level
+
+  @property
+  def level(self) -> int:
+    return self._level if self._level is not None else self.logger.getEffectiveLevel()
+
+  @level.setter
+  def level(self, level: int | None) -> None:
+    self._level = level
+
+  @property
+  def debug(self) -> bool:
+    return self.enabled(DEBUG)
+
+  def enabled(self, level: int) -> bool:
+    # isEnabledFor is cached by the logging module until a level changes
+    return level >= self._level if self._level is not None else self.logger.isEnabledFor(level)
+
+  def event(self, level: int, subsystem: str, name: str, **fields) -> None:
+    if not self.enabled(level):
+      return
+    event = CarlogEvent(time.monotonic_ns(), level, subsystem, name, fields)
+    for sink in self.sinks:
+      sink(event)
+
+  def count(self, subsystem: str, name: str, n: int = 1) -> None:
+    """Counts occurrences without building an event, e.g. checksum failures"""
+    self.counters[(subsystem, name)] += n
+
+
+eventlog = EventLog()
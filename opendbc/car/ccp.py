@@ -1,9 +1,12 @@
-import sys
 import time
 import struct
+from collections.abc import Callable
 from enum import IntEnum, Enum
 from dataclasses import dataclass
 
+from opendbc.car.can_definitions import CanRecvCallable, CanSendCallable
+from opendbc.car.can_transport import CanTransport, panda_can_recv, panda_can_send
+
 
 @dataclass
 class ExchangeStationIdsReturn:
@@ -25,6 +28,13 @@ class GetSessionStatusReturn:
   info: int | None
 
 
+@dataclass
+class DaqEntry:
+  addr: int
+  size: int
+  addr_ext: int = 0
+
+
 @dataclass
 class DiagnosticServiceReturn:
   length: int
@@ -90,6 +100,24 @@ COMMAND_RETURN_CODES = {
 }
 
 
+class START_STOP_MODE(IntEnum):
+  STOP = 0x00
+  START = 0x01
+  PREPARE = 0x02
+
+
+# called with the DAQ list number and the data of each of its entries, once all of its ODTs of a sample arrived
+DaqCallback = Callable[[int, list[bytes]], None]
+
+# packet identifiers of the command return and event messages, anything below is a DAQ message with an absolute ODT number
+PID_CRM = 0xFF
+PID_EVENT = 0xFE
+
+# a DAQ message holds 7 bytes, made of ODT elements of these sizes
+DAQ_ODT_SIZE = 7
+DAQ_ELEMENT_SIZES = (1, 2, 4)
+
+
 class BYTE_ORDER(Enum):
   LITTLE_ENDIAN = '<'
   BIG_ENDIAN = '>'
@@ -114,68 +142,80 @@ class CommandResponseError(Exception):
 
 
 class CcpClient:
-  def __init__(self, panda, tx_addr: int, rx_addr: int, bus: int=0, byte_order: BYTE_ORDER=BYTE_ORDER.BIG_ENDIAN, debug=False):
+  def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, tx_addr: int, rx_addr: int, bus: int=0,
+               byte_order: BYTE_ORDER=BYTE_ORDER.BIG_ENDIAN, debug=False):
     self.tx_addr = tx_addr
     self.rx_addr = rx_addr
     self.can_bus = bus
     self.byte_order = byte_order
     self.debug = debug
-    self._panda = panda
+    self._transport = CanTransport(can_send, can_recv, tx_addr, [rx_addr], bus, debug)
     self._command_counter = -1
+    # set when a command timed out, its response may still arrive and is dropped before the next command
+    self._resync = False
+
+    # absolute ODT number -> (DAQ list, ODT), and the byte layout of the configured DAQ lists
+    self._daq_odts: dict[int, tuple[int, int]] = {}
+    self._daq_odt_sizes: dict[int, list[int]] = {}
+    self._daq_entry_sizes: dict[int, list[int]] = {}
+    self._daq_samples: dict[int, list[bytes]] = {}
+    self._daq_callback: DaqCallback | None = None
+
+  @classmethod
+  def from_panda(cls, panda, tx_addr: int, rx_addr: int, bus: int=0, **kwargs) -> 'CcpClient':
+    return cls(panda_can_send(panda), panda_can_recv(panda), tx_addr, rx_addr, bus, **kwargs)
 
   def _send_cro(self, cmd: int, dat: bytes = b"") -> None:
     self._command_counter = (self._command_counter + 1) & 0xFF
     tx_data = (bytes([cmd, self._command_counter]) + dat).ljust(8, b"\x00")
-    if self.debug:
-      print(f"CAN-TX: {hex(self.tx_addr)} - 0x{bytes.hex(tx_data)}")
     assert len(tx_data) == 8, "data is not 8 bytes"
-    self._panda.can_clear(self.can_bus)
-    self._panda.can_clear(0xFFFF)
-    self._panda.can_send(self.tx_addr, tx_data, self.can_bus)
+    if self._resync:
+      self._transport.drain()
+      self._resync = False
+    self._transport.send([tx_data])
 
   def _recv_dto(self, timeout: float) -> bytes:
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-      msgs = self._panda.can_recv() or []
-      if len(msgs) >= 256:
-        print("CAN RX buffer overflow!!!", file=sys.stderr)
-      for rx_addr, rx_data_bytearray, rx_bus in msgs:
-        if rx_bus == self.can_bus and rx_addr == self.rx_addr:
-          rx_data = bytes(rx_data_bytearray)
+    deadline = time.monotonic() + timeout
+    while (msg := self._transport.recv(deadline - time.monotonic())) is not None:
+      rx_data = msg.dat
+      assert len(rx_data) == 8, f"message length not 8: {len(rx_data)}"
+
+      pid = rx_data[0]
+      if pid == PID_CRM or pid == PID_EVENT:
+        err = rx_data[1]
+        err_desc = COMMAND_RETURN_CODES.get(err, "unknown error")
+        ctr = rx_data[2]
+        dat = rx_data[3:]
+
+        if pid == PID_CRM and self._command_counter != ctr:
+          raise CommandCounterError(f"counter invalid: {ctr} != {self._command_counter}")
+
+        if err >= 0x10 and err <= 0x12:
           if self.debug:
-            print(f"CAN-RX: {hex(rx_addr)} - 0x{bytes.hex(rx_data)}")
-          assert len(rx_data) == 8, f"message length not 8: {len(rx_data)}"
+            print(f"CCP-WAIT: {hex(err)} - {err_desc}")
+          deadline = time.monotonic() + timeout
+          continue
 
-          pid = rx_data[0]
-          if pid == 0xFF or pid == 0xFE:
-            err = rx_data[1]
-            err_desc = COMMAND_RETURN_CODES.get(err, "unknown error")
-            ctr = rx_data[2]
-            dat = rx_data[3:]
+        if err >= 0x30:
+          raise CommandResponseError(f"{hex(err)} - {err_desc}", err)
+      elif pid in self._daq_odts:
+        self._handle_daq(rx_data)
+        continue
+      else:
+        dat = rx_data[1:]
 
-            if pid == 0xFF and self._command_counter != ctr:
-              raise CommandCounterError(f"counter invalid: {ctr} != {self._command_counter}")
-
-            if err >= 0x10 and err <= 0x12:
-              if self.debug:
-                print(f"CCP-WAIT: {hex(err)} - {err_desc}")
-              start_time = time.time()
-              continue
-
-            if err >= 0x30:
-              raise CommandResponseError(f"{hex(err)} - {err_desc}", err)
-          else:
-            dat = rx_data[1:]
-
-          return dat
-      time.sleep(0.001)
+      return dat
 
+    self._resync = True
     raise CommandTimeoutError("timeout waiting for response")
 
   # commands
   def connect(self, station_addr: int) -> None:
     if station_addr > 65535:
       raise ValueError("station address must be less than 65536")
+    # anything the ECU sent before is stale
+    self._transport.drain()
+    self._resync = False
     # NOTE: station address is always little endian
     self._send_cro(COMMAND_CODE.CONNECT, struct.pack("<H", station_addr))
     self._recv_dto(0.025)
@@ -383,3 +423,94 @@ class CcpClient:
     self._send_cro(COMMAND_CODE.GET_CCP_VERSION, bytes([major, minor]))
     resp = self._recv_dto(0.025)
     return float(f"{resp[0]}.{resp[1]}")
+
+  def read_memory(self, addr: int, length: int, addr_ext: int = 0) -> bytes:
+    """Reads length bytes starting at addr, in uploads of 5 bytes from the auto-incrementing MTA0"""
+    self.set_memory_transfer_address(0, addr_ext, addr)
+    dat = b""
+    while len(dat) < length:
+      dat += self.upload(min(5, length - len(dat)))
+    return dat
+
+  def write_memory(self, addr: int, data: bytes, addr_ext: int = 0) -> None:
+    """Writes data starting at addr, in downloads of 6 bytes through MTA0"""
+    self.set_memory_transfer_address(0, addr_ext, addr)
+    for i in range(0, len(data) - len(data) % 6, 6):
+      self.download_6_bytes(data[i:i + 6])
+    for i in range(len(data) - len(data) % 6, len(data), 5):
+      self.download(data[i:i + 5])
+
+  @staticmethod
+  def _daq_layout(entries: list[DaqEntry]) -> list[list[DaqEntry]]:
+    # fills the ODTs in order, elements don't cross an ODT boundary
+    odts: list[list[DaqEntry]] = [[]]
+    used = 0
+    for entry in entries:
+      if entry.size not in DAQ_ELEMENT_SIZES:
+        raise ValueError(f"DAQ element size must be one of {DAQ_ELEMENT_SIZES}")
+      if used + entry.size > DAQ_ODT_SIZE:
+        odts.append([])
+        used = 0
+      odts[-1].append(entry)
+      used += entry.size
+    return odts
+
+  def configure_daq(self, list_num: int, entries: list[DaqEntry], callback: DaqCallback, event_channel: int = 0, rate_prescaler: int = 1) -> None:
+    """Writes the entries to a DAQ list and prepares it for start_daq.
+    The callback gets the data of each entry of the list, once all of the list's ODTs of a sample arrived."""
+    odts = self._daq_layout(entries)
+    daq_size = self.get_daq_list_size(list_num, self.rx_addr)
+    if len(odts) > daq_size.list_size:
+      raise ValueError(f"entries need {len(odts)} ODTs, DAQ list {list_num} has {daq_size.list_size}")
+
+    for odt, odt_entries in enumerate(odts):
+      for element, entry in enumerate(odt_entries):
+        self.set_daq_list_pointer(list_num, odt, element)
+        self.write_daq_list_entry(entry.size, entry.addr_ext, entry.addr)
+    self.start_stop_transmission(START_STOP_MODE.PREPARE, list_num, len(odts) - 1, event_channel, rate_prescaler)
+
+    self._daq_odts = {pid: v for pid, v in self._daq_odts.items() if v[0] != list_num}
+    self._daq_odts.update({daq_size.first_pid + odt: (list_num, odt) for odt in range(len(odts))})
+    self._daq_odt_sizes[list_num] = [sum(e.size for e in odt_entries) for odt_entries in odts]
+    self._daq_entry_sizes[list_num] = [e.size for e in entries]
+    self._daq_samples.pop(list_num, None)
+    self._daq_callback = callback
+
+  def start_daq(self) -> None:
+    self.start_stop_synchronised_transmission(START_STOP_MODE.START)
+
+  def stop_daq(self) -> None:
+    self.start_stop_synchronised_transmission(START_STOP_MODE.STOP)
+
+  def poll_daq(self, timeout: float) -> None:
+    """Passes the DAQ messages received within timeout to the callback"""
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+      msg = self._transport.recv(remaining)
+      if msg is None:
+        break
+      if msg.dat[0] in self._daq_odts:
+        self._handle_daq(msg.dat)
+
+  def _handle_daq(self, dat: bytes) -> None:
+    list_num, odt = self._daq_odts[dat[0]]
+    sample = self._daq_samples.setdefault(list_num, [])
+    if odt == 0:
+      sample.clear()
+    elif odt != len(sample):
+      # an ODT of this sample was lost, wait for the next one
+      sample.clear()
+      return
+
+    odt_sizes = self._daq_odt_sizes[list_num]
+    sample.append(dat[1:1 + odt_sizes[odt]])
+    if len(sample) == len(odt_sizes):
+      data = b"".join(sample)
+      sample.clear()
+      values = []
+      offset = 0
+      for size in self._daq_entry_sizes[list_num]:
+        values.append(data[offset:offset + size])
+        offset += size
+      if self._daq_callback is not None:
+        self._daq_callback(list_num, values)
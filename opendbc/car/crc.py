@@ -1,3 +1,5 @@
+import numpy as np
+
 
 def _gen_crc8_table(poly: int) -> list[int]:
   table = []
@@ -40,3 +42,42 @@ def mk_crc8_fun(table: list[int], init_crc: int = 0x00, xor_out: int = 0x00):
       crc = table[crc ^ b]
     return crc ^ xor_out
   return crc
+
+
+def mk_crc16_fun(table: list[int], init_crc: int = 0x0000, xor_out: int = 0x0000):
+  def crc(data: bytes) -> int:
+    crc = init_crc
+    for b in data:
+      crc = ((crc << 8) ^ table[(crc >> 8) ^ b]) & 0xFFFF
+    return crc ^ xor_out
+  return crc
+
+
+class BulkCrc:
+  """CRC of every row of a uint8 matrix, for the tables above and the same init_crc and xor_out as the scalar functions.
+
+  A CRC is linear, so the CRC of a message is the XOR of one lookup per byte into the slicing-by-N table
+  for the number of bytes that follow it. The lookups of all rows and bytes are one gather."""
+
+  def __init__(self, table: list[int], width: int, init_crc: int = 0, xor_out: int = 0, max_len: int = 64):
+    assert width in (8, 16)
+    self.scalar = mk_crc8_fun(table, init_crc, xor_out) if width == 8 else mk_crc16_fun(table, init_crc, xor_out)
+
+    # row k: CRC of a byte followed by k zero bytes
+    dtype = np.uint8 if width == 8 else np.uint16
+    self.tables = np.zeros((max_len, 256), dtype=dtype)
+    self.tables[0] = table
+    t0 = self.tables[0].astype(np.int64)
+    for k in range(1, max_len):
+      prev = self.tables[k - 1].astype(np.int64)
+      self.tables[k] = t0[prev] if width == 8 else ((prev << 8) & 0xFFFF) ^ t0[prev >> 8]
+
+    # with a cleared register and no xor_out, the CRC of n zero bytes is 0, so a message's CRC is the
+    # lookups of its bytes xor the CRC of as many zero bytes, which carries init_crc and xor_out
+    self.zeros_crc = [self.scalar(bytes(n)) for n in range(max_len + 1)]
+
+  def __call__(self, data: np.ndarray) -> np.ndarray:
+    data = np.asarray(data, dtype=np.uint8)
+    n = data.shape[1]
+    crc = np.bitwise_xor.reduce(self.tables[np.arange(n - 1, -1, -1), data], axis=1)
+    return crc ^ self.tables.dtype.type(self.zeros_crc[n])
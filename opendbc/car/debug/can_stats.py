@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import argparse
+
+from opendbc.can.stats import CanTrafficStats
+from opendbc.car import gen_empty_fingerprint
+from opendbc.car.car_helpers import interfaces
+from opendbc.car.logreader import LogReader
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Frequency, jitter, length, checksum and counter failures of the CAN traffic in a log, " +
+                                               "along with bus load and the messages a platform's parsers consume or ignore")
+  parser.add_argument("log", help="rlog, local path or URL")
+  parser.add_argument("--platform", help="platform whose parsers are checked against the traffic")
+  args = parser.parse_args()
+
+  can_parsers = []
+  if args.platform is not None:
+    CarInterface = interfaces[args.platform]
+    fingerprint = gen_empty_fingerprint()
+    CP = CarInterface.get_params(args.platform, fingerprint, [], False, False, False)
+    CP_SP = CarInterface.get_params_sp(CP, args.platform, fingerprint, [], False, False, False)
+    can_parsers = list(CarInterface.CarState.get_can_parsers(CP, CP_SP).values())
+
+  stats = CanTrafficStats.from_parsers(can_parsers)
+  for event in LogReader(args.log, only_union_types=True, sort_by_time=True):
+    if event.which() == "can":
+      stats.update((event.logMonoTime, [(can.address, can.dat, can.src) for can in event.can]))
+
+  print(stats.report(can_parsers))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import argparse
+import os
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from opendbc.can.stats import CanTrafficStats
+from opendbc.car.can_definitions import CanData
+from opendbc.car.car_helpers import can_fingerprint, interfaces
+from opendbc.car.interfaces import CarInterfaceBase
+from opendbc.car.logreader import LogReader
+from opendbc.car.parser_messages import PARSER_MESSAGES_PATH, dump_parser_messages, load_parser_messages, nominal_frequency
+
+
+class DerivedParserMessages(NamedTuple):
+  # key of the parser -> (message name, nominal frequency) of the messages CarState.update read
+  messages: dict[str, tuple[tuple[str, float], ...]]
+  # key of the parser -> messages listed in get_can_parsers that were never read
+  unused: dict[str, list[str]]
+
+
+def derive_parser_messages(CI: CarInterfaceBase, can_packets: Iterable[tuple[int, list[CanData]]]) -> DerivedParserMessages:
+  """Runs the interface over the frames, tracking the messages CarState.update reads and their frequencies on the bus"""
+  parsers = {str(bus): cp for bus, cp in CI.can_parsers.items() if cp is not None}
+  listed = {bus: set(cp.addresses) for bus, cp in parsers.items()}
+  for cp in parsers.values():
+    cp.vl.reads = set()
+
+  stats = CanTrafficStats()
+  for can_packet in can_packets:
+    stats.update(can_packet)
+    CI.update([can_packet])
+
+  messages, unused = {}, {}
+  for bus, cp in parsers.items():
+    read = set()
+    for key in cp.vl.reads:
+      msg = cp.dbc.addr_to_msg.get(key) if isinstance(key, int) else cp.dbc.name_to_msg.get(key)
+      if msg is not None:
+        read.add(msg.address)
+
+    seen = stats.buses[cp.bus].messages if cp.bus in stats.buses else {}
+    messages[bus] = tuple(sorted((cp.dbc.addr_to_msg[address].name, nominal_frequency(seen[address].frequency))
+                                 for address in read if address in seen and seen[address].frequency > 0))
+    unused[bus] = sorted(cp.dbc.addr_to_msg[address].name for address in listed[bus] - read)
+    cp.vl.reads = None
+  return DerivedParserMessages(messages, unused)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Derives the messages a platform's parsers read and their nominal frequencies from logs, " +
+                                               "and writes them to the parser messages table")
+  parser.add_argument("platform")
+  parser.add_argument("logs", nargs="+", help="rlogs, local paths or URLs, ideally from cars with different options")
+  args = parser.parse_args()
+
+  # start from the message lists in get_can_parsers, not the current table
+  os.environ["DISABLE_PARSER_MESSAGES"] = "1"
+  CarInterface = interfaces[args.platform]
+
+  derived: dict[str, dict[str, float]] | None = None
+  for log in args.logs:
+    can_packets = [(event.logMonoTime, [CanData(can.address, can.dat, can.src) for can in event.can])
+                   for event in LogReader(log, only_union_types=True, sort_by_time=True) if event.which() == "can"]
+    _can_packets = (frames for _, frames in can_packets)
+    _, fingerprint = can_fingerprint(lambda wait_for_one=False, _can_packets=_can_packets: [next(_can_packets, [])])
+
+    CP = CarInterface.get_params(args.platform, fingerprint, [], False, False, False)
+    CP_SP = CarInterface.get_params_sp(CP, args.platform, fingerprint, [], False, False, False)
+    CP_IC = CarInterface.get_params_ic(CP, args.platform, fingerprint, [], False, False, False)
+    result = derive_parser_messages(CarInterface(CP, CP_SP, CP_IC), can_packets)
+
+    # only keep messages read in every log, reads gated by CP flags or options would otherwise become required
+    # on cars that never send them. Frequencies are the lowest seen, so timeouts stay loose
+    read = {bus: dict(messages) for bus, messages in result.messages.items()}
+    if derived is None:
+      derived = read
+    else:
+      derived = {bus: {name: min(freq, read[bus][name]) for name, freq in messages.items() if name in read.get(bus, {})}
+                 for bus, messages in derived.items()}
+    for bus, names in result.unused.items():
+      if names:
+        print(f"{log}: {bus} parser lists messages that were never read: {', '.join(names)}")
+
+  table = dict(load_parser_messages())
+  table[args.platform] = {bus: tuple(sorted(messages.items())) for bus, messages in (derived or {}).items()}
+  with open(PARSER_MESSAGES_PATH, "w") as f:
+    f.write(dump_parser_messages(table))
+
+
+if __name__ == "__main__":
+  main()
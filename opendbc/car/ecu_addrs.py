@@ -2,7 +2,8 @@ import time
 
 from opendbc.car import make_tester_present_msg, uds
 from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallable
-from opendbc.car.carlog import carlog
+from opendbc.car.can_transport import AsyncCanTransport
+from opendbc.car.carlog import DEBUG, carlog, eventlog
 from opendbc.car.fw_query_definitions import EcuAddrBusType
 
 
@@ -21,13 +22,34 @@ def _is_tester_present_response(msg: CanData, subaddr: int | None = None) -> boo
   return False
 
 
-def get_all_ecu_addrs(can_recv: CanRecvCallable, can_send: CanSendCallable, bus: int, timeout: float = 1) -> set[EcuAddrBusType]:
+def _add_ecu_response(ecu_responses: set[EcuAddrBusType], msg: CanData, responses: set[EcuAddrBusType]) -> None:
+  if not len(msg.dat):
+    carlog.warning("ECU addr scan: skipping empty remote frame")
+    return
+
+  subaddr = None if (msg.address, None, msg.src) in responses else msg.dat[0]
+  if (msg.address, subaddr, msg.src) in responses and _is_tester_present_response(msg, subaddr):
+    if eventlog.debug:
+      eventlog.event(DEBUG, "ecu_addrs", "response", addr=msg.address, dat=msg.dat, duplicate=(msg.address, subaddr, msg.src) in ecu_responses)
+    ecu_responses.add((msg.address, subaddr, msg.src))
+
+
+def _all_ecu_addrs(bus: int) -> set[EcuAddrBusType]:
   addr_list = [0x700 + i for i in range(256)] + [0x18da00f1 + (i << 8) for i in range(256)]
-  queries: set[EcuAddrBusType] = {(addr, None, bus) for addr in addr_list}
+  return {(addr, None, bus) for addr in addr_list}
+
+
+def get_all_ecu_addrs(can_recv: CanRecvCallable, can_send: CanSendCallable, bus: int, timeout: float = 1) -> set[EcuAddrBusType]:
+  queries = _all_ecu_addrs(bus)
   responses = queries
   return get_ecu_addrs(can_recv, can_send, queries, responses, timeout=timeout)
 
 
+async def get_all_ecu_addrs_async(transport: AsyncCanTransport, bus: int, timeout: float = 1) -> set[EcuAddrBusType]:
+  queries = _all_ecu_addrs(bus)
+  return await get_ecu_addrs_async(transport, queries, queries, timeout=timeout)
+
+
 def get_ecu_addrs(can_recv: CanRecvCallable, can_send: CanSendCallable, queries: set[EcuAddrBusType],
                   responses: set[EcuAddrBusType], timeout: float = 1) -> set[EcuAddrBusType]:
   ecu_responses: set[EcuAddrBusType] = set()  # set((addr, subaddr, bus),)
@@ -41,16 +63,25 @@ def get_ecu_addrs(can_recv: CanRecvCallable, can_send: CanSendCallable, queries:
       can_packets = can_recv(wait_for_one=True)
       for packet in can_packets:
         for msg in packet:
-          if not len(msg.dat):
-            carlog.warning("ECU addr scan: skipping empty remote frame")
-            continue
-
-          subaddr = None if (msg.address, None, msg.src) in responses else msg.dat[0]
-          if (msg.address, subaddr, msg.src) in responses and _is_tester_present_response(msg, subaddr):
-            carlog.debug(f"CAN-RX: {hex(msg.address)} - 0x{bytes.hex(msg.dat)}")
-            if (msg.address, subaddr, msg.src) in ecu_responses:
-              carlog.debug(f"Duplicate ECU address: {hex(msg.address)}")
-            ecu_responses.add((msg.address, subaddr, msg.src))
+          _add_ecu_response(ecu_responses, msg, responses)
+  except Exception:
+    carlog.exception("ECU addr scan exception")
+  return ecu_responses
+
+
+async def get_ecu_addrs_async(transport: AsyncCanTransport, queries: set[EcuAddrBusType], responses: set[EcuAddrBusType],
+                              timeout: float = 1) -> set[EcuAddrBusType]:
+  ecu_responses: set[EcuAddrBusType] = set()  # set((addr, subaddr, bus),)
+  try:
+    msgs = [make_tester_present_msg(addr, bus, subaddr) for addr, subaddr, bus in queries]
+    rx_addrs = {(addr, bus) for addr, _, bus in responses}
+
+    with transport.listen(lambda msg: (msg.address, msg.src) in rx_addrs) as listener:
+      transport.send(msgs)
+      start_time = time.monotonic()
+      while (time_left := start_time + timeout - time.monotonic()) > 0:
+        for msg in await listener.recv(time_left):
+          _add_ecu_response(ecu_responses, msg, responses)
   except Exception:
     carlog.exception("ECU addr scan exception")
   return ecu_responses
@@ -0,0 +1,91 @@
+import json
+import os
+from typing import NamedTuple
+
+from opendbc.car.can_definitions import CanRecvCallable
+from opendbc.car.carlog import carlog
+from opendbc.car.fw_query_definitions import EcuAddrBusType
+from opendbc.car.structs import CarParams
+
+MAX_ENTRIES = 8
+
+
+def is_diagnostic_addr(addr: int) -> bool:
+  # diagnostic traffic depends on what is queried, not on the car
+  return 0x700 <= addr < 0x800 or addr >= 0x18DA0000
+
+
+class FwCacheEntry(NamedTuple):
+  fingerprint: dict[int, int]
+  ecu_rx_addrs: set[EcuAddrBusType]
+  car_fw: list[CarParams.CarFw]
+  platform: str
+
+
+def observe_can(can_recv: CanRecvCallable, observed: dict[int, int]) -> CanRecvCallable:
+  """Wraps can_recv, recording the length of every non-diagnostic message on bus 0"""
+  def observing_can_recv(wait_for_one: bool = False):
+    can_packets = can_recv(wait_for_one=wait_for_one)
+    for can_packet in can_packets:
+      for can in can_packet:
+        if can.src == 0 and not is_diagnostic_addr(can.address):
+          observed[can.address] = len(can.dat)
+    return can_packets
+  return observing_can_recv
+
+
+class FwCache:
+  """Present ECUs, FW versions and platform of the last cars fingerprinted, persisted as JSON to path.
+  Entries are looked up by VIN, and only used if the bus 0 addresses and lengths seen match the ones stored"""
+
+  def __init__(self, path: str, max_entries: int = MAX_ENTRIES):
+    self.path = path
+    self.max_entries = max_entries
+    self.entries: dict[str, dict] = {}
+    try:
+      with open(path) as f:
+        self.entries = json.load(f)
+    except FileNotFoundError:
+      pass
+    except (OSError, ValueError):
+      carlog.exception("Failed to load FW cache")
+
+  def lookup(self, vin: str, observed: dict[int, int]) -> FwCacheEntry | None:
+    entry = self.entries.get(vin)
+    # without any traffic seen, another car with the same VIN can't be told apart
+    if entry is None or len(observed) == 0:
+      return None
+
+    fingerprint = dict(entry['fingerprint'])
+    if any(fingerprint.get(addr) != length for addr, length in observed.items()):
+      return None
+
+    with CarParams.from_bytes(bytes.fromhex(entry['car_fw'])) as CP:
+      car_fw = list(CP.as_builder().carFw)
+    return FwCacheEntry(fingerprint, {tuple(ecu) for ecu in entry['ecu_rx_addrs']}, car_fw, entry['platform'])
+
+  def store(self, vin: str, fingerprint: dict[int, int], ecu_rx_addrs: set[EcuAddrBusType], car_fw: list[CarParams.CarFw], platform: str) -> None:
+    # most recently stored last, the oldest entries are dropped
+    self.entries.pop(vin, None)
+    self.entries[vin] = {
+      'fingerprint': sorted((addr, length) for addr, length in fingerprint.items() if not is_diagnostic_addr(addr)),
+      'ecu_rx_addrs': sorted(ecu_rx_addrs, key=lambda ecu: (ecu[0], ecu[1] or 0, ecu[2])),
+      'car_fw': CarParams.new_message(carFw=car_fw).to_bytes().hex(),
+      'platform': platform,
+    }
+    while len(self.entries) > self.max_entries:
+      self.entries.pop(next(iter(self.entries)))
+    self.save()
+
+  def invalidate(self, vin: str) -> None:
+    if self.entries.pop(vin, None) is not None:
+      self.save()
+
+  def save(self) -> None:
+    try:
+      tmp_path = self.path + '.tmp'
+      with open(tmp_path, 'w') as f:
+        json.dump(self.entries, f)
+      os.replace(tmp_path, self.path)
+    except OSError:
+      carlog.exception("Failed to save FW cache")
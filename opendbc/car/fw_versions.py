@@ -6,13 +6,14 @@ from tqdm import tqdm
 
 from opendbc.car import uds
 from opendbc.car.can_definitions import CanRecvCallable, CanSendCallable
+from opendbc.car.can_transport import AsyncCanTransport
 from opendbc.car.carlog import carlog
 from opendbc.car.structs import CarParams
-from opendbc.car.ecu_addrs import get_ecu_addrs
+from opendbc.car.ecu_addrs import get_ecu_addrs, get_ecu_addrs_async
 from opendbc.car.fingerprints import FW_VERSIONS
 from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions, Mask
 from opendbc.car.interfaces import get_interface_attr
-from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
+from opendbc.car.isotp_parallel_query import QueryGenerator, QueryParams, run_queries, run_queries_async
 
 Ecu = CarParams.Ecu
 FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
@@ -179,7 +180,7 @@ def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: b
   return True, set()
 
 
-def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback) -> set[EcuAddrBusType]:
+def _present_ecu_queries() -> tuple[dict[bool, list[list[EcuAddrBusType]]], set[EcuAddrBusType]]:
   # queries are split by OBD multiplexing mode
   queries: dict[bool, list[list[EcuAddrBusType]]] = {True: [], False: []}
   parallel_queries: dict[bool, list[EcuAddrBusType]] = {True: [], False: []}
@@ -205,6 +206,11 @@ def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_o
   for obd_multiplexing in queries:
     queries[obd_multiplexing].insert(0, parallel_queries[obd_multiplexing])
 
+  return queries, responses
+
+
+def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback) -> set[EcuAddrBusType]:
+  queries, responses = _present_ecu_queries()
   ecu_responses = set()
   for obd_multiplexing in queries:
     set_obd_multiplexing(obd_multiplexing)
@@ -213,6 +219,16 @@ def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_o
   return ecu_responses
 
 
+async def get_present_ecus_async(transport: AsyncCanTransport, set_obd_multiplexing: ObdCallback) -> set[EcuAddrBusType]:
+  queries, responses = _present_ecu_queries()
+  ecu_responses = set()
+  for obd_multiplexing in queries:
+    set_obd_multiplexing(obd_multiplexing)
+    for query in queries[obd_multiplexing]:
+      ecu_responses.update(await get_ecu_addrs_async(transport, set(query), responses, timeout=0.1))
+  return ecu_responses
+
+
 def get_brand_ecu_matches(ecu_rx_addrs: set[EcuAddrBusType]) -> dict[str, list[bool]]:
   """Returns dictionary of brands and matches with ECUs in their FW versions"""
 
@@ -233,20 +249,22 @@ def get_brand_ecu_matches(ecu_rx_addrs: set[EcuAddrBusType]) -> dict[str, list[b
   return brand_matches
 
 
-def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, vin: str,
-                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, progress: bool = False) -> list[CarParams.CarFw]:
-  """Queries for FW versions ordering brands by likelihood, breaks when exact match is found"""
-
-  all_car_fw = []
+def _brands_by_likelihood(ecu_rx_addrs: set[EcuAddrBusType]) -> list[str]:
   brand_matches = get_brand_ecu_matches(ecu_rx_addrs)
 
   # Sort brands by number of matching ECUs first, then percentage of matching ECUs in the database
   # This allows brands with only one ECU to be queried first (e.g. Tesla)
-  for brand in sorted(brand_matches, key=lambda b: (brand_matches[b].count(True), brand_matches[b].count(True) / len(brand_matches[b])), reverse=True):
-    # Skip this brand if there are no matching present ECUs
-    if True not in brand_matches[brand]:
-      continue
+  brands = sorted(brand_matches, key=lambda b: (brand_matches[b].count(True), brand_matches[b].count(True) / len(brand_matches[b])), reverse=True)
+  # Skip brands if there are no matching present ECUs
+  return [brand for brand in brands if True in brand_matches[brand]]
+
 
+def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, vin: str,
+                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, progress: bool = False) -> list[CarParams.CarFw]:
+  """Queries for FW versions ordering brands by likelihood, breaks when exact match is found"""
+
+  all_car_fw = []
+  for brand in _brands_by_likelihood(ecu_rx_addrs):
     car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, progress=progress)
     all_car_fw.extend(car_fw)
 
@@ -258,8 +276,38 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
   return all_car_fw
 
 
+async def get_fw_versions_ordered_async(transport: AsyncCanTransport, set_obd_multiplexing: ObdCallback, vin: str,
+                                        ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1) -> list[CarParams.CarFw]:
+  all_car_fw = []
+  for brand in _brands_by_likelihood(ecu_rx_addrs):
+    car_fw = await get_fw_versions_async(transport, set_obd_multiplexing, query_brand=brand, timeout=timeout)
+    all_car_fw.extend(car_fw)
+
+    _, matches = match_fw_to_car(car_fw, vin, log=False)
+    if len(matches) == 1:
+      break
+
+  return all_car_fw
+
+
 def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, query_brand: str | None = None,
                     extra: OfflineFwVersions | None = None, timeout: float = 0.1, progress: bool = False) -> list[CarParams.CarFw]:
+  car_fw: list[CarParams.CarFw] = []
+  run_queries(_fw_queries(car_fw, set_obd_multiplexing, query_brand, extra, progress), can_send, can_recv, timeout)
+  return car_fw
+
+
+async def get_fw_versions_async(transport: AsyncCanTransport, set_obd_multiplexing: ObdCallback, query_brand: str | None = None,
+                                extra: OfflineFwVersions | None = None, timeout: float = 0.1) -> list[CarParams.CarFw]:
+  """get_fw_versions on an AsyncCanTransport. OBD multiplexing is switched for the whole bus, so don't run FW or
+  ECU queries of another brand at the same time"""
+  car_fw: list[CarParams.CarFw] = []
+  await run_queries_async(_fw_queries(car_fw, set_obd_multiplexing, query_brand, extra, False), transport, timeout)
+  return car_fw
+
+
+def _fw_queries(car_fw: list[CarParams.CarFw], set_obd_multiplexing: ObdCallback, query_brand: str | None, extra: OfflineFwVersions | None,
+                progress: bool) -> QueryGenerator:
   versions = VERSIONS.copy()
 
   if query_brand is not None:
@@ -291,7 +339,6 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
   addrs.insert(0, parallel_addrs)
 
   # Get versions and build capnp list to put into CarParams
-  car_fw = []
   requests = [(brand, config, r) for brand, config, r in REQUESTS if is_brand(brand, query_brand)]
   for addr_group in tqdm(addrs, disable=not progress):  # split by subaddr, if any
     for addr_chunk in chunks(addr_group):
@@ -305,8 +352,8 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
                          (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
 
           if query_addrs:
-            query = IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset)
-            for (tx_addr, sub_addr), version in query.get_data(timeout).items():
+            results = yield QueryParams(r.bus, query_addrs, r.request, r.response, r.rx_offset)
+            for (tx_addr, sub_addr), version in results.items():
               f = CarParams.CarFw()
 
               f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
@@ -326,4 +373,41 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
         except Exception:
           carlog.exception("FW query exception")
 
-  return car_fw
+
+def confirm_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback,
+                        car_fw: list[CarParams.CarFw], timeout: float = 0.1) -> list[CarParams.CarFw]:
+  """Queries only the ECUs of known FW versions, with the request each one answered.
+  Returns the versions that aren't answered the same, stopping at the first request with one"""
+  mismatches: list[CarParams.CarFw] = []
+  run_queries(_confirm_queries(car_fw, set_obd_multiplexing, mismatches), can_send, can_recv, timeout)
+  return mismatches
+
+
+def _confirm_queries(car_fw: list[CarParams.CarFw], set_obd_multiplexing: ObdCallback, mismatches: list[CarParams.CarFw]) -> QueryGenerator:
+  # group by request, ECUs using a subaddress need be queried one by one
+  groups: defaultdict[tuple[int, int | None], list[CarParams.CarFw]] = defaultdict(list)
+  for fw in car_fw:
+    # some brands have requests only differing in rx_offset, the response address tells them apart
+    request_idx = next((i for i, (brand, _, r) in enumerate(REQUESTS) if brand == fw.brand and r.request == list(fw.request) and
+                        r.bus == fw.bus and r.obd_multiplexing == fw.obdMultiplexing and
+                        uds.get_rx_addr_for_tx_addr(fw.address, r.rx_offset) == fw.responseAddress), None)
+    if request_idx is None:
+      mismatches.append(fw)
+      return
+    groups[(request_idx, fw.subAddress if fw.subAddress != 0 else None)].append(fw)
+
+  for (request_idx, sub_addr), fws in groups.items():
+    r = REQUESTS[request_idx][2]
+    if r.bus % 4 == 1:
+      set_obd_multiplexing(r.obd_multiplexing)
+
+    try:
+      query_addrs = list(dict.fromkeys((fw.address, sub_addr) for fw in fws))
+      results = yield QueryParams(r.bus, query_addrs, r.request, r.response, r.rx_offset)
+    except Exception:
+      carlog.exception("FW confirmation exception")
+      results = {}
+
+    mismatches.extend(fw for fw in fws if results.get((fw.address, sub_addr)) != fw.fwVersion)
+    if mismatches:
+      return
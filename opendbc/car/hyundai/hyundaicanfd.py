@@ -1,6 +1,6 @@
 import numpy as np
 from opendbc.car import CanBusBase
-from opendbc.car.crc import CRC16_XMODEM
+from opendbc.car.crc import CRC16_XMODEM, BulkCrc
 from opendbc.car.hyundai.values import HyundaiFlags
 from opendbc.sunnypilot.car.hyundai.lead_data_ext import CanFdLeadData
 
@@ -236,18 +236,21 @@ def create_adrv_messages(packer, CAN, frame):
   return ret
 
 
+HKG_CAN_FD_CHECKSUM_XOR = {8: 0x5F29, 16: 0x041D, 24: 0x819D, 32: 0x9F5B}
+HKG_CAN_FD_CRC = BulkCrc(CRC16_XMODEM, 16)
+
+
 def hkg_can_fd_checksum(address: int, sig, d: bytearray) -> int:
   crc = 0
   for i in range(2, len(d)):
     crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ d[i]]) & 0xFFFF
   crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ ((address >> 0) & 0xFF)]) & 0xFFFF
   crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ ((address >> 8) & 0xFF)]) & 0xFFFF
-  if len(d) == 8:
-    crc ^= 0x5F29
-  elif len(d) == 16:
-    crc ^= 0x041D
-  elif len(d) == 24:
-    crc ^= 0x819D
-  elif len(d) == 32:
-    crc ^= 0x9F5B
-  return crc
+  return crc ^ HKG_CAN_FD_CHECKSUM_XOR.get(len(d), 0)
+
+
+def hkg_can_fd_checksums(address: int, d: np.ndarray) -> np.ndarray:
+  """hkg_can_fd_checksum of every row of a uint8 matrix of messages with one address"""
+  d = np.asarray(d, dtype=np.uint8)
+  address_bytes = np.broadcast_to(np.array([address & 0xFF, (address >> 8) & 0xFF], dtype=np.uint8), (len(d), 2))
+  return HKG_CAN_FD_CRC(np.hstack([d[:, 2:], address_bytes])) ^ np.uint16(HKG_CAN_FD_CHECKSUM_XOR.get(d.shape[1], 0))
@@ -1,7 +1,6 @@
 import os
 import numpy as np
 import time
-import tomllib
 from abc import abstractmethod, ABC
 from enum import StrEnum
 from typing import Any
@@ -14,6 +13,8 @@ from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallabl
 from opendbc.car.common.basedir import BASEDIR
 from opendbc.car.common.conversions import Conversions as CV
 from opendbc.car.common.simple_kalman import KF1D, get_kalman_gain
+from opendbc.car.parser_messages import apply_parser_messages, load_parser_messages
+from opendbc.car.torque_params import TORQUE_PARAMS_PATH, TORQUE_OVERRIDE_PATH, TORQUE_SUBSTITUTE_PATH, load_torque_table  # noqa: F401
 from opendbc.car.values import PLATFORMS
 from opendbc.can import CANParser
 from opendbc.car.carlog import carlog
@@ -28,10 +29,6 @@ MAX_CTRL_SPEED = (V_CRUISE_MAX + 4) * CV.KPH_TO_MS
 ACCEL_MAX = 2.0
 ACCEL_MIN = -3.5
 
-TORQUE_PARAMS_PATH = os.path.join(BASEDIR, 'torque_data/params.toml')
-TORQUE_OVERRIDE_PATH = os.path.join(BASEDIR, 'torque_data/override.toml')
-TORQUE_SUBSTITUTE_PATH = os.path.join(BASEDIR, 'torque_data/substitute.toml')
-
 GEAR_SHIFTER_MAP: dict[str, structs.CarState.GearShifter] = {
   'P': GearShifter.park, 'PARK': GearShifter.park,
   'R': GearShifter.reverse, 'REVERSE': GearShifter.reverse,
@@ -50,31 +47,12 @@ LateralAccelFromTorqueCallbackType = Callable[[float, structs.CarParams.LateralT
 
 @cache
 def get_torque_params():
-  with open(TORQUE_SUBSTITUTE_PATH, 'rb') as f:
-    sub = tomllib.load(f)
-  with open(TORQUE_PARAMS_PATH, 'rb') as f:
-    params = tomllib.load(f)
-  with open(TORQUE_OVERRIDE_PATH, 'rb') as f:
-    override = tomllib.load(f)
-
-  torque_params = {}
-  for candidate in (sub.keys() | params.keys() | override.keys()) - {'legend'}:
-    if sum([candidate in x for x in [sub, params, override]]) > 1:
-      raise RuntimeError(f'{candidate} is defined twice in torque config')
-
-    sub_candidate = sub.get(candidate, candidate)
-
-    if sub_candidate in override:
-      out = override[sub_candidate]
-    elif sub_candidate in params:
-      out = params[sub_candidate]
-    else:
-      raise NotImplementedError(f"Did not find torque params for {sub_candidate}")
-
-    torque_params[sub_candidate] = {key: out[i] for i, key in enumerate(params['legend'])}
-    if candidate in sub:
-      torque_params[candidate] = torque_params[sub_candidate]
+  table = load_torque_table()
 
+  # substitutes share the params dict of the platform they use
+  torque_params = {platform: params._asdict() for platform, params in table.params.items() if platform not in table.substitutes}
+  for candidate, sub_candidate in table.substitutes.items():
+    torque_params[candidate] = torque_params[sub_candidate]
   return torque_params
 
 # generic car and radar interfaces
@@ -113,6 +91,8 @@ class CarInterfaceBase(ABC, CarInterfaceBaseSP):
 
     self.CS: CarStateBase = self.CarState(CP, CP_SP, CP_IC)
     self.can_parsers: dict[StrEnum, CANParser] = self.CS.get_can_parsers(CP, CP_SP)
+    if not os.environ.get('DISABLE_PARSER_MESSAGES'):
+      apply_parser_messages(self.can_parsers, load_parser_messages().get(CP.carFingerprint, {}))
 
     dbc_names = {bus: cp.dbc_name for bus, cp in self.can_parsers.items()}
     self.CC: CarControllerBase = self.CarController(dbc_names, CP, CP_SP, CP_IC)
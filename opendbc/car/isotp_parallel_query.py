@@ -1,9 +1,12 @@
 import time
 from collections import defaultdict
+from collections.abc import Generator
 from functools import partial
+from typing import NamedTuple
 
 from opendbc.car import uds
 from opendbc.car.can_definitions import CanData, CanRecvCallable, CanSendCallable
+from opendbc.car.can_transport import AsyncCanTransport
 from opendbc.car.carlog import carlog
 from opendbc.car.fw_query_definitions import AddrType
 
@@ -11,7 +14,7 @@ from opendbc.car.fw_query_definitions import AddrType
 class IsoTpParallelQuery:
   def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int, addrs: list[int] | list[AddrType],
                request: list[bytes], response: list[bytes], response_offset: int = 0x8,
-               functional_addrs: list[int] | None = None, response_pending_timeout: float = 10) -> None:
+               functional_addrs: list[int] | None = None, response_pending_timeout: float = 10, tx_dl: int = 8) -> None:
     self.can_send = can_send
     self.can_recv = can_recv
     self.bus = bus
@@ -19,6 +22,8 @@ class IsoTpParallelQuery:
     self.response = response
     self.functional_addrs = functional_addrs or []
     self.response_pending_timeout = response_pending_timeout
+    # frame length of the requests, more than 8 to send CAN FD frames. Responses are read up to 64 bytes per frame either way
+    self.tx_dl = tx_dl
 
     real_addrs = [a if isinstance(a, tuple) else (a, None) for a in addrs]
     for tx_addr, _ in real_addrs:
@@ -71,11 +76,18 @@ class IsoTpParallelQuery:
     # uses iso-tp frame separation time of 10 ms
     # TODO: use single_frame_mode so ECUs can send as fast as they want,
     # as well as reduces chances we process messages from previous queries
-    return uds.IsoTpMessage(can_client, timeout=0, separation_time=0.01)
+    return uds.IsoTpMessage(can_client, timeout=0, separation_time=0.01, tx_dl=self.tx_dl)
 
   def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
     self._drain_rx()
+    results: dict[AddrType, bytes] = {}
+    for _ in self._query(results, timeout, total_timeout):
+      self.rx()
+    return results
 
+  def _query(self, results: dict[AddrType, bytes], timeout: float, total_timeout: float) -> Generator[float, None, None]:
+    """Sends the requests and handles the responses, yields the time left until the next timeout whenever
+    it needs the frames received since in msg_buffer"""
     # Create message objects
     msgs = {}
     request_counter = {}
@@ -95,12 +107,12 @@ class IsoTpParallelQuery:
     for msg in msgs.values():
       msg.send(self.request[0], setup_only=len(self.functional_addrs) > 0)
 
-    results = {}
     start_time = time.monotonic()
     addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
     response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.msg_addrs}
     while True:
-      self.rx()
+      pending = [response_timeouts[tx_addr] for tx_addr in response_timeouts if not request_done[tx_addr]]
+      yield min([*pending, start_time + total_timeout]) - time.monotonic()
 
       for tx_addr, msg in msgs.items():
         try:
@@ -167,4 +179,63 @@ class IsoTpParallelQuery:
         carlog.error("iso-tp query timeout while receiving data")
         break
 
+
+class AsyncIsoTpParallelQuery(IsoTpParallelQuery):
+  """IsoTpParallelQuery over an AsyncCanTransport, other queries can run on the same event loop while it waits"""
+
+  def __init__(self, transport: AsyncCanTransport, bus: int, addrs: list[int] | list[AddrType], request: list[bytes], response: list[bytes],
+               response_offset: int = 0x8, functional_addrs: list[int] | None = None, response_pending_timeout: float = 10, tx_dl: int = 8) -> None:
+    super().__init__(transport.send, transport.can_recv, bus, addrs, request, response, response_offset, functional_addrs, response_pending_timeout, tx_dl)
+    self.transport = transport
+
+  async def get_data_async(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
+    rx_addrs = set(self.msg_addrs.values())
+    with self.transport.listen(lambda msg: msg.src == self.bus and msg.address in rx_addrs) as listener:
+      self.msg_buffer = defaultdict(list)
+      results: dict[AddrType, bytes] = {}
+      for time_left in self._query(results, timeout, total_timeout):
+        for msg in await listener.recv(time_left):
+          self.msg_buffer[msg.address].append(CanData(msg.address, msg.dat, msg.src))
     return results
+
+
+class QueryParams(NamedTuple):
+  bus: int
+  addrs: list[int] | list[AddrType]
+  request: list[bytes]
+  response: list[bytes]
+  response_offset: int = 0x8
+  functional_addrs: list[int] | None = None
+
+
+QueryGenerator = Generator[QueryParams, dict[AddrType, bytes], None]
+
+
+def run_queries(queries: QueryGenerator, can_send: CanSendCallable, can_recv: CanRecvCallable, timeout: float) -> None:
+  """Runs the queries a generator yields one after another, sending it each result, or throwing in what the query raised"""
+  try:
+    params = next(queries)
+    while True:
+      try:
+        results = IsoTpParallelQuery(can_send, can_recv, *params).get_data(timeout)
+      except Exception as e:
+        params = queries.throw(e)
+      else:
+        params = queries.send(results)
+  except StopIteration:
+    pass
+
+
+async def run_queries_async(queries: QueryGenerator, transport: AsyncCanTransport, timeout: float) -> None:
+  """run_queries on an AsyncCanTransport"""
+  try:
+    params = next(queries)
+    while True:
+      try:
+        results = await AsyncIsoTpParallelQuery(transport, *params).get_data_async(timeout)
+      except Exception as e:
+        params = queries.throw(e)
+      else:
+        params = queries.send(results)
+  except StopIteration:
+    pass
@@ -39,6 +39,13 @@ class AngleSteeringLimitsVM:
   MAX_ANGLE_RATE: float = math.inf
 
 
+def _broadcast_trajectory(values, *args) -> list[np.ndarray]:
+  # commands are a 1D trajectory, other arguments may be scalars
+  values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+  assert values.ndim == 1, "expected a 1D command trajectory"
+  return [values, *(np.broadcast_to(arg, values.shape) for arg in args)]
+
+
 @dataclass
 class CurvatureSteeringLimits:
   # Max accepted by the EPS
@@ -66,6 +73,27 @@ class CurvatureSteeringLimits:
     # prevent fault
     return float(np.clip(new_apply_curvature, -self.CURVATURE_MAX, self.CURVATURE_MAX))
 
+  def apply_limits_batch(self, apply_curvature: np.ndarray, apply_curvature_last: float, v_ego: np.ndarray, curvature: np.ndarray,
+                         lat_active: np.ndarray, steer_step: int) -> np.ndarray:
+    """Trajectory version of apply_limits, each output is the apply_curvature_last of the next step."""
+    apply_curvature, v_ego, curvature, lat_active = _broadcast_trajectory(apply_curvature, v_ego, curvature, lat_active)
+    v_ego = np.maximum(v_ego, 1)
+
+    # *** max lateral accel limit ***
+    max_curvature = self.MAX_LATERAL_ACCEL / (v_ego ** 2)
+    new_apply_curvature = np.clip(apply_curvature, -max_curvature, max_curvature)
+
+    # *** max lateral jerk limit ***, the only limit that depends on the previous output
+    max_jerk = (self.MAX_LATERAL_JERK / (v_ego ** 2)) * (steer_step * DT_CTRL)
+
+    out = np.empty(len(new_apply_curvature))
+    last = apply_curvature_last
+    for i, (new, jerk, active, curv) in enumerate(zip(new_apply_curvature.tolist(), max_jerk.tolist(), lat_active.tolist(),
+                                                      curvature.tolist(), strict=True)):
+      new = min(max(new, last - jerk), last + jerk) if active else curv
+      out[i] = last = min(max(new, -self.CURVATURE_MAX), self.CURVATURE_MAX)
+    return out
+
 
 def apply_driver_steer_torque_limits(apply_torque: int, apply_torque_last: int, driver_torque: float, LIMITS, steer_max: int | None = None):
   # some safety modes utilize a dynamic max steer
@@ -134,6 +162,27 @@ def apply_std_steer_angle_limits(apply_angle: float, apply_angle_last: float, v_
   return float(np.clip(new_apply_angle, -limits.STEER_ANGLE_MAX, limits.STEER_ANGLE_MAX))
 
 
+def apply_std_steer_angle_limits_batch(apply_angle: np.ndarray, apply_angle_last: float, v_ego: np.ndarray, steering_angle: np.ndarray,
+                                       lat_active: np.ndarray, limits: AngleSteeringLimits) -> np.ndarray:
+  """Trajectory version of apply_std_steer_angle_limits, each output is the apply_angle_last of the next step."""
+  apply_angle, v_ego, steering_angle, lat_active = _broadcast_trajectory(apply_angle, v_ego, steering_angle, lat_active)
+  rate_lim_up = np.interp(v_ego, limits.ANGLE_RATE_LIMIT_UP[0], limits.ANGLE_RATE_LIMIT_UP[1])
+  rate_lim_down = np.interp(v_ego, limits.ANGLE_RATE_LIMIT_DOWN[0], limits.ANGLE_RATE_LIMIT_DOWN[1])
+
+  out = np.empty(len(apply_angle))
+  last = apply_angle_last
+  for i, (angle, lim_up, lim_down, active, steer) in enumerate(zip(apply_angle.tolist(), rate_lim_up.tolist(), rate_lim_down.tolist(),
+                                                                   lat_active.tolist(), steering_angle.tolist(), strict=True)):
+    if active:
+      # pick angle rate limits based on wind up/down
+      angle_rate_lim = lim_up if last * angle >= 0. and abs(angle) > abs(last) else lim_down
+      new_apply_angle = min(max(angle, last - angle_rate_lim), last + angle_rate_lim)
+    else:
+      new_apply_angle = steer
+    out[i] = last = min(max(new_apply_angle, -limits.STEER_ANGLE_MAX), limits.STEER_ANGLE_MAX)
+  return out
+
+
 def get_max_angle_delta_vm(v_ego_raw: float, VM: VehicleModel, limits):
   """Calculate the maximum steering angle rate based on lateral jerk limits."""
   max_curvature_rate_sec = limits.ANGLE_LIMITS.MAX_LATERAL_JERK / (v_ego_raw ** 2)  # (1/m)/s
@@ -171,6 +220,34 @@ def apply_steer_angle_limits_vm(apply_angle: float, apply_angle_last: float, v_e
   return float(np.clip(new_apply_angle, -limits.ANGLE_LIMITS.STEER_ANGLE_MAX, limits.ANGLE_LIMITS.STEER_ANGLE_MAX))
 
 
+def apply_steer_angle_limits_vm_batch(apply_angle: np.ndarray, apply_angle_last: float, v_ego_raw: np.ndarray, steering_angle: np.ndarray,
+                                      lat_active: np.ndarray, limits, VM: VehicleModel) -> np.ndarray:
+  """Trajectory version of apply_steer_angle_limits_vm, each output is the apply_angle_last of the next step."""
+  apply_angle, v_ego_raw, steering_angle, lat_active = _broadcast_trajectory(apply_angle, v_ego_raw, steering_angle, lat_active)
+  v_ego_raw = np.maximum(v_ego_raw, 1)
+
+  # *** max lateral jerk limit ***, see get_max_angle_delta_vm
+  max_curvature_rate_sec = limits.ANGLE_LIMITS.MAX_LATERAL_JERK / (v_ego_raw ** 2)
+  max_angle_delta = np.degrees(VM.get_steer_from_curvature_batch(max_curvature_rate_sec, v_ego_raw, 0)) * (DT_CTRL * limits.STEER_STEP)
+  max_angle_delta = np.minimum(max_angle_delta, limits.ANGLE_LIMITS.MAX_ANGLE_RATE)
+
+  # *** max lateral accel limit ***, see get_max_angle_vm
+  max_curvature = limits.ANGLE_LIMITS.MAX_LATERAL_ACCEL / (v_ego_raw ** 2)
+  max_angle = np.degrees(VM.get_steer_from_curvature_batch(max_curvature, v_ego_raw, 0))
+
+  out = np.empty(len(apply_angle))
+  last = apply_angle_last
+  for i, (angle, delta, max_ang, active, steer) in enumerate(zip(apply_angle.tolist(), max_angle_delta.tolist(), max_angle.tolist(),
+                                                                 lat_active.tolist(), steering_angle.tolist(), strict=True)):
+    if active:
+      new_apply_angle = min(max(angle, last - delta), last + delta)
+      new_apply_angle = min(max(new_apply_angle, -max_ang), max_ang)
+    else:
+      new_apply_angle = steer
+    out[i] = last = min(max(new_apply_angle, -limits.ANGLE_LIMITS.STEER_ANGLE_MAX), limits.ANGLE_LIMITS.STEER_ANGLE_MAX)
+  return out
+
+
 def common_fault_avoidance(fault_condition: bool, request: bool, above_limit_frames: int,
                            max_above_limit_frames: int, max_mismatching_frames: int = 1):
   """
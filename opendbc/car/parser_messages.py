@@ -0,0 +1,62 @@
+"""
+Frozen table of the messages each platform's parsers read, with their nominal frequencies.
+
+debug/derive_parser_messages.py derives it from logs, tracking which messages CarState.update reads. Parsers get
+these messages at construction, so their timeouts are right from the first frame instead of learned.
+"""
+import json
+import math
+import os
+from collections.abc import Mapping
+from functools import cache
+from types import MappingProxyType
+
+from opendbc.can import CANParser
+from opendbc.car.common.basedir import BASEDIR
+
+PARSER_MESSAGES_PATH = os.path.join(BASEDIR, 'parser_data/parser_messages.json')
+NOMINAL_FREQUENCIES = (1, 2, 5, 10, 20, 25, 33, 50, 100)
+
+# key of the parser in get_can_parsers -> (message name, frequency)
+ParserMessages = Mapping[str, tuple[tuple[str, float], ...]]
+
+
+def nominal_frequency(frequency: float) -> float:
+  """Closest of the common CAN message frequencies, by ratio"""
+  return min(NOMINAL_FREQUENCIES, key=lambda f: abs(math.log(frequency / f)))
+
+
+@cache
+def load_parser_messages() -> Mapping[str, ParserMessages]:
+  with open(PARSER_MESSAGES_PATH) as f:
+    table = json.load(f)
+  return MappingProxyType({platform: MappingProxyType({bus: tuple((name, freq) for name, freq in messages) for bus, messages in parsers.items()})
+                           for platform, parsers in table.items()})
+
+
+def dump_parser_messages(table: Mapping[str, ParserMessages]) -> str:
+  # one parser per line
+  platforms = []
+  for platform, parsers in sorted(table.items()):
+    lines = ',\n'.join(f'    {json.dumps(bus)}: {json.dumps([list(m) for m in sorted(messages)])}' for bus, messages in sorted(parsers.items()))
+    platforms.append(f'  {json.dumps(platform)}: {{\n{lines}\n  }}')
+  return '{\n' + ',\n'.join(platforms) + '\n}\n' if platforms else '{}\n'
+
+
+def apply_parser_messages(can_parsers: Mapping[str, CANParser | None], parser_messages: ParserMessages) -> None:
+  """Adds the messages to the parsers, and sets the frequency of the listed ones without one.
+  Frequencies given in get_can_parsers are kept"""
+  for bus, messages in parser_messages.items():
+    cp = can_parsers.get(bus)
+    if cp is None:
+      continue
+
+    for name, freq in messages:
+      msg = cp.dbc.name_to_msg.get(name)
+      if msg is None:
+        continue
+      state = cp.message_states.get(msg.address)
+      if state is None:
+        cp._add_message(name, freq)
+      elif state.frequency < 1e-5 and not state.ignore_alive:
+        state.set_frequency(freq)
@@ -1,49 +1,96 @@
-import struct
+from functools import lru_cache
 
-from Crypto.Hash import CMAC
 from Crypto.Cipher import AES
 
+BLOCK_SIZE = 16
+MASK_128 = (1 << 128) - 1
 
-def add_mac(key, trip_cnt, reset_cnt, msg_cnt, msg):
-  # TODO: clean up conversion to and from hex
 
-  addr, payload, bus = msg
-  reset_flag = reset_cnt & 0b11
-  msg_cnt_flag = msg_cnt & 0b11
-  payload = payload[:4]
+class CmacContext:
+  """AES-CMAC of one key, for messages shorter than a block: the key schedule and the K2 subkey are computed once"""
+
+  def __init__(self, key: bytes):
+    self.cipher = AES.new(key, AES.MODE_ECB)
+    # NIST SP 800-38B subkeys, only K2 is needed since the last block is always padded
+    k = int.from_bytes(self.cipher.encrypt(bytes(BLOCK_SIZE)), 'big')
+    for _ in range(2):
+      k = ((k << 1) & MASK_128) ^ (0x87 if k >> 127 else 0)
+    self.k2 = k
+
+  def block(self, msg: bytes) -> bytes:
+    assert len(msg) < BLOCK_SIZE
+    padded = int.from_bytes(msg + b'\x80', 'big') << (8 * (BLOCK_SIZE - 1 - len(msg)))
+    return (padded ^ self.k2).to_bytes(BLOCK_SIZE, 'big')
+
+  def macs_28(self, msgs: list[bytes]) -> list[int]:
+    """First 28 bits of the MAC of every message, with one AES call for all of them"""
+    tags = self.cipher.encrypt(b''.join(self.block(msg) for msg in msgs))
+    return [int.from_bytes(tags[i:i + 4], 'big') >> 4 for i in range(0, len(tags), BLOCK_SIZE)]
+
+
+@lru_cache(maxsize=4)
+def cmac_context(key: bytes) -> CmacContext:
+  return CmacContext(key)
+
 
-  # Step 1: Build Freshness Value (48 bits)
+def freshness_value(trip_cnt: int, reset_cnt: int, msg_cnt: int) -> bytes:
   # [Trip Counter (16 bit)][[Reset Counter (20 bit)][Message Counter (8 bit)][Reset Flag (2 bit)][Padding (2 bit)]
-  freshness_value = struct.pack('>HI', trip_cnt, (reset_cnt << 12) | ((msg_cnt & 0xff) << 4) | (reset_flag << 2))
+  return ((trip_cnt << 32) | (reset_cnt << 12) | ((msg_cnt & 0xff) << 4) | ((reset_cnt & 0b11) << 2)).to_bytes(6, 'big')
 
-  # Step 2: Build data to authenticate (96 bits)
+
+def _auth_data(addr: int, payload: bytes, freshness: bytes) -> bytes:
   # [Message ID (16 bits)][Payload (32 bits)][Freshness Value (48 bits)]
-  to_auth = struct.pack('>H', addr) + payload + freshness_value
+  return addr.to_bytes(2, 'big') + payload[:4] + freshness
 
-  # Step 3: Calculate CMAC (28 bit)
-  cmac = CMAC.new(key, ciphermod=AES)
-  cmac.update(to_auth)
-  mac = cmac.digest().hex()[:7] # truncated MAC
 
-  # Step 4: Build message
+def _secured_payload(payload: bytes, reset_cnt: int, msg_cnt: int, mac: int) -> bytes:
   # [Payload (32 bit)][Message Counter Flag (2 bit)][Reset Flag (2 bit)][Authenticator (28 bit)]
-  msg_cnt_rst_flag = struct.pack('>B', (msg_cnt_flag << 2) | reset_flag).hex()[1]
-  msg = payload.hex() + msg_cnt_rst_flag + mac
-  payload = bytes.fromhex(msg)
+  return payload[:4] + ((((msg_cnt & 0b11) << 2 | (reset_cnt & 0b11)) << 28) | mac).to_bytes(4, 'big')
+
 
-  return (addr, payload, bus)
+def add_mac(key, trip_cnt, reset_cnt, msg_cnt, msg):
+  addr, payload, bus = msg
+  mac, = cmac_context(key).macs_28([_auth_data(addr, payload, freshness_value(trip_cnt, reset_cnt, msg_cnt))])
+  return (addr, _secured_payload(payload, reset_cnt, msg_cnt, mac), bus)
 
 
 def build_sync_mac(key, trip_cnt, reset_cnt, id_=0xf):
-  id_ = struct.pack('>H', id_) # 16
-  trip_cnt = struct.pack('>H', trip_cnt) # 16
-  reset_cnt = struct.pack('>I', reset_cnt << 12)[:-1] # 20 + 4 padding
+  # [Message ID (16 bit)][Trip Counter (16 bit)][Reset Counter (20 bit)][Padding (4 bit)], SecOC 11.4.1.1 page 138
+  to_auth = ((id_ << 40) | (trip_cnt << 24) | (reset_cnt << 4)).to_bytes(7, 'big')
+  mac, = cmac_context(key).macs_28([to_auth])
+  return mac
+
+
+class SecOC:
+  """Signs the secured messages sent in a control cycle, keeping the freshness counters from the
+  synchronization message and a message counter for each address"""
+
+  def __init__(self, key: bytes):
+    self.key = key
+    self.trip_cnt = 0
+    self.reset_cnt = 0
+    self.msg_cnts: dict[int, int] = {}
 
-  to_auth = id_ + trip_cnt + reset_cnt # SecOC 11.4.1.1 page 138
+  def synchronize(self, trip_cnt: int, reset_cnt: int, authenticator: int) -> bool:
+    """Takes the counters of a synchronization message. On a new reset counter the message counters restart,
+    returns whether its authenticator matches the key"""
+    self.trip_cnt = trip_cnt
+    if reset_cnt == self.reset_cnt:
+      return True
+    self.reset_cnt = reset_cnt
+    self.msg_cnts.clear()
+    return authenticator == build_sync_mac(self.key, trip_cnt, reset_cnt)
 
-  cmac = CMAC.new(key, ciphermod=AES)
-  cmac.update(to_auth)
+  def sign(self, msgs: list[tuple[int, bytes, int]]) -> list[tuple[int, bytes, int]]:
+    """Adds the MAC to a batch of messages, counting each one sent"""
+    msg_cnts = []
+    to_auth = []
+    for addr, payload, _ in msgs:
+      msg_cnt = self.msg_cnts.get(addr, 0)
+      self.msg_cnts[addr] = msg_cnt + 1
+      msg_cnts.append(msg_cnt)
+      to_auth.append(_auth_data(addr, payload, freshness_value(self.trip_cnt, self.reset_cnt, msg_cnt)))
 
-  msg = "0" + cmac.digest().hex()[:7]
-  msg = bytes.fromhex(msg)
-  return struct.unpack('>I', msg)[0]
+    macs = cmac_context(self.key).macs_28(to_auth) if msgs else []
+    return [(addr, _secured_payload(payload, self.reset_cnt, msg_cnt, mac), bus)
+            for (addr, payload, bus), msg_cnt, mac in zip(msgs, msg_cnts, macs, strict=True)]
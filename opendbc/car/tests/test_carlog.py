@@ -0,0 +1,103 @@
+import io
+import logging
+import random
+import unittest
+
+from opendbc.can.parser import MessageState
+from opendbc.car.carlog import DEBUG, INFO, WARNING, BinaryFileSink, EventLog, LoggerSink, RingBufferSink, carlog, eventlog, read_events
+from opendbc.car.tests.test_isotp import RX_ADDR, TX_ADDR, IsoTpPeer, LoopbackBus, exchange
+from opendbc.car.uds import IsoTpMessage
+
+
+class Formatted:
+  def __init__(self):
+    self.count = 0
+
+  def __str__(self):
+    self.count += 1
+    return "formatted"
+
+
+class TestCarlog(unittest.TestCase):
+  def setUp(self):
+    self.level, self.sinks = carlog.level, eventlog.sinks
+    eventlog.counters.clear()
+
+  def tearDown(self):
+    carlog.setLevel(self.level)
+    eventlog.sinks = self.sinks
+    eventlog.counters.clear()
+
+  def test_sinks(self):
+    ring = RingBufferSink(maxlen=2)
+    f = io.BytesIO()
+    log = EventLog(INFO, [ring, BinaryFileSink(f)])
+    self.assertFalse(log.debug)
+
+    log.event(DEBUG, "isotp", "dropped")
+    for i in range(3):
+      log.event(WARNING, "isotp", "rx", addr=0x7e8, dat=b"\x01\x02", idx=i)
+    self.assertEqual([event.fields["idx"] for event in ring.events], [1, 2])
+    self.assertEqual(str(ring.events[-1]), "isotp: rx addr=0x7e8 dat=0x0102 idx=2")
+
+    f.seek(0)
+    self.assertEqual(list(read_events(f))[1:], list(ring.events))
+
+    log.level = DEBUG
+    self.assertTrue(log.debug and log.enabled(DEBUG))
+
+  def test_follows_logger(self):
+    logger = logging.getLogger("test_carlog_level")
+    logger.setLevel(INFO)
+    log = EventLog(sinks=[], logger=logger)
+    self.assertFalse(log.debug)
+    logger.setLevel(DEBUG)
+    self.assertTrue(log.debug)
+    self.assertEqual(log.level, DEBUG)
+
+  def test_lazy_logger(self):
+    logger = logging.getLogger("test_carlog")
+    logger.setLevel(WARNING)
+    logger.propagate = False
+    logger.addHandler(handler := logging.StreamHandler(io.StringIO()))
+    log = EventLog(DEBUG, [LoggerSink(logger)])
+
+    value = Formatted()
+    log.event(INFO, "can", "rx", value=value)
+    self.assertEqual(value.count, 0)
+    log.event(WARNING, "can", "rx", value=value)
+    self.assertEqual(value.count, 1)
+    self.assertEqual(handler.stream.getvalue(), "can: rx value=formatted\n")
+
+  def test_isotp_debug(self):
+    ring = RingBufferSink()
+    eventlog.sinks = [ring]
+    bus = LoopbackBus()
+    peer = IsoTpPeer(bus.client(RX_ADDR, TX_ADDR), random.Random(0).randbytes(100), 8)
+    client = IsoTpMessage(bus.client(TX_ADDR, RX_ADDR), timeout=0)
+
+    carlog.setLevel(INFO)
+    exchange(client, peer, b"\x22\xf1\x90")
+    self.assertEqual(len(ring.events), 0)
+
+    # setting the carlog level turns on the ISO-TP debug events
+    carlog.setLevel(DEBUG)
+    exchange(client, peer, b"\x22\xf1\x90")
+    names = {(event.subsystem, event.name) for event in ring.events}
+    self.assertTrue({("isotp", "request"), ("isotp", "rx_first_frame"), ("isotp", "response"), ("can", "rx")} <= names)
+
+  def test_counters(self):
+    ring = RingBufferSink()
+    eventlog.sinks = [ring]
+    state = MessageState(0x100, "STEER", 8, [])
+    for nanos in range(0, 3_000_000_000, 10_000_000):
+      state.rate_limited_log(nanos, "checksum_failed", received=1, calculated=2)
+
+    # every failure is counted, only one event a second is logged
+    self.assertEqual(eventlog.counters[("can_parser", "checksum_failed")], 300)
+    self.assertEqual(len(ring.events), 2)
+    self.assertEqual(str(ring.events[0]), "can_parser: checksum_failed addr=0x100 msg=STEER received=1 calculated=2")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,111 @@
+import random
+import struct
+import unittest
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.ccp import COMMAND_CODE, CcpClient, CommandTimeoutError, DaqEntry
+
+TX_ADDR = 0x7E0
+RX_ADDR = 0x7E8
+BUS = 0
+FIRST_PID = 0x10
+
+
+class SimulatedCcpSlave:
+  """CCP slave answering from a memory image, with one DAQ list of 4 ODTs"""
+
+  def __init__(self, seed=0):
+    self.memory = bytearray(random.Random(seed).randbytes(0x10000))
+    self.mta = 0
+    self.rx: list[CanData] = []
+    self.odts: list[dict[int, tuple[int, int]]] = [{} for _ in range(4)]
+    self.daq_ptr = (0, 0)
+    self.prepared_odts = 0
+    self.running = False
+    self.drop_next = False
+
+  def respond(self, ctr: int, dat: bytes = b"") -> None:
+    if self.drop_next:
+      self.drop_next = False
+      return
+    self.rx.append(CanData(RX_ADDR, bytes([0xFF, 0x00, ctr]) + dat.ljust(5, b"\x00"), BUS))
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    msgs, self.rx = self.rx, []
+    return [msgs]
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    for msg in msgs:
+      cmd, ctr, dat = msg.dat[0], msg.dat[1], msg.dat[2:]
+      if cmd == COMMAND_CODE.SET_MTA:
+        self.mta = struct.unpack(">I", dat[2:6])[0]
+        self.respond(ctr)
+      elif cmd == COMMAND_CODE.UPLOAD:
+        self.respond(ctr, self.memory[self.mta:self.mta + dat[0]])
+        self.mta += dat[0]
+      elif cmd in (COMMAND_CODE.DNLOAD, COMMAND_CODE.DNLOAD_6):
+        data = dat[1:1 + dat[0]] if cmd == COMMAND_CODE.DNLOAD else dat[:6]
+        self.memory[self.mta:self.mta + len(data)] = data
+        self.mta += len(data)
+        self.respond(ctr, b"\x00" + struct.pack(">I", self.mta))
+      elif cmd == COMMAND_CODE.GET_DAQ_SIZE:
+        self.respond(ctr, bytes([len(self.odts), FIRST_PID]))
+      elif cmd == COMMAND_CODE.SET_DAQ_PTR:
+        self.daq_ptr = (dat[1], dat[2])
+        self.respond(ctr)
+      elif cmd == COMMAND_CODE.WRITE_DAQ:
+        odt, element = self.daq_ptr
+        self.odts[odt][element] = (struct.unpack(">I", dat[2:6])[0], dat[0])
+        self.respond(ctr)
+      elif cmd == COMMAND_CODE.START_STOP:
+        self.prepared_odts = dat[2] + 1
+        self.respond(ctr)
+      elif cmd == COMMAND_CODE.START_STOP_ALL:
+        self.running = dat[0] == 1
+        self.respond(ctr)
+      else:
+        self.rx.append(CanData(RX_ADDR, bytes([0xFF, 0x30, ctr]).ljust(8, b"\x00"), BUS))
+
+  def sample_daq(self) -> None:
+    for odt in range(self.prepared_odts):
+      elements = [self.memory[a:a + s] for _, (a, s) in sorted(self.odts[odt].items())]
+      self.rx.append(CanData(RX_ADDR, (bytes([FIRST_PID + odt]) + b"".join(elements)).ljust(8, b"\x00"), BUS))
+
+
+class TestCcpClient(unittest.TestCase):
+  def setUp(self):
+    self.slave = SimulatedCcpSlave()
+    self.client = CcpClient(self.slave.can_send, self.slave.can_recv, TX_ADDR, RX_ADDR, BUS)
+
+  def test_read_write_memory(self):
+    self.assertEqual(self.client.read_memory(0x1000, 1001), self.slave.memory[0x1000:0x1000 + 1001])
+    data = random.Random(1).randbytes(100)
+    self.client.write_memory(0x2000, data)
+    self.assertEqual(self.slave.memory[0x2000:0x2000 + len(data)], data)
+
+  def test_timeout_resync(self):
+    self.slave.drop_next = True
+    with self.assertRaises(CommandTimeoutError):
+      self.client.set_memory_transfer_address(0, 0, 0x100)
+    # the late response has the counter of the command that timed out
+    self.slave.respond(self.client._command_counter)
+    self.assertEqual(self.client.read_memory(0x300, 10), self.slave.memory[0x300:0x30A])
+
+  def test_daq(self):
+    entries = [DaqEntry(0x100, 4), DaqEntry(0x200, 2), DaqEntry(0x300, 4), DaqEntry(0x400, 1), DaqEntry(0x500, 4)]
+    samples = []
+    self.client.configure_daq(0, entries, lambda daq, values: samples.append((daq, values)))
+    self.assertEqual(self.slave.prepared_odts, 3)
+    self.client.start_daq()
+    self.assertTrue(self.slave.running)
+
+    self.slave.sample_daq()
+    self.client.poll_daq(0.01)
+    self.assertEqual(samples, [(0, [self.slave.memory[e.addr:e.addr + e.size] for e in entries])])
+
+    with self.assertRaises(ValueError):
+      self.client.configure_daq(0, [DaqEntry(0x100, 3)], lambda daq, values: None)
+
+
+if __name__ == "__main__":
+  unittest.main()
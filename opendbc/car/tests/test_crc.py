@@ -0,0 +1,35 @@
+import random
+import unittest
+
+import numpy as np
+
+from opendbc.car.crc import CRC8BODY, CRC8H2F, CRC8J1850, CRC16_XMODEM, BulkCrc
+from opendbc.car.hyundai.hyundaicanfd import hkg_can_fd_checksum, hkg_can_fd_checksums
+from opendbc.car.uds import CANFD_FRAME_LENGTHS
+from opendbc.testing import parameterized
+
+
+def random_rows(rows: int, length: int) -> np.ndarray:
+  return np.frombuffer(random.Random(length).randbytes(rows * length), dtype=np.uint8).reshape(rows, length)
+
+
+class TestCrc(unittest.TestCase):
+  @parameterized("table, width", [(CRC8H2F, 8), (CRC8J1850, 8), (CRC8BODY, 8), (CRC16_XMODEM, 16)])
+  def test_bulk(self, table, width):
+    for init_crc, xor_out in ((0, 0), (0xFF, 0xFF), (0x00, 0xFF), (0x1D, 0x00)):
+      crc = BulkCrc(table, width, init_crc, xor_out)
+      for length in (0, 1, 2, 7, 8, 33, 64):
+        rows = random_rows(20, length)
+        with self.subTest(init_crc=init_crc, xor_out=xor_out, length=length):
+          self.assertEqual(crc(rows).tolist(), [crc.scalar(bytes(row)) for row in rows])
+
+  def test_hkg_can_fd_checksums(self):
+    for length in CANFD_FRAME_LENGTHS:
+      rows = random_rows(20, length)
+      for address in (0x50, 0x1CF, 0x2A4):
+        with self.subTest(length=length, address=address):
+          self.assertEqual(hkg_can_fd_checksums(address, rows).tolist(), [hkg_can_fd_checksum(address, None, bytearray(row)) for row in rows])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import unittest
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.car_helpers import fingerprint
+from opendbc.car.fw_cache import FwCache
+from opendbc.car.fw_versions import FW_VERSIONS, confirm_fw_versions, get_fw_versions
+from opendbc.car.hyundai.values import HYUNDAI_VERSION_REQUEST_LONG
+from opendbc.car.structs import CarParams
+from opendbc.car.volkswagen.values import VOLKSWAGEN_RX_OFFSET, VOLKSWAGEN_VERSION_REQUEST_MULTI
+from opendbc.car.tests.test_fw_query_async import PLATFORM, VIN, VIN_RESPONSE, SimulatedEcu, SimulatedEcuNetwork, hyundai_ecus
+
+Ecu = CarParams.Ecu
+
+# bus 0 traffic of the car, one message each time it's read
+TRAFFIC = [CanData(0x260, bytes(8), 0), CanData(0x38d, bytes(8), 0), CanData(0x2b0, bytes(6), 0)]
+
+
+class SimulatedCar(SimulatedEcuNetwork):
+  def __init__(self, traffic: list[CanData] = TRAFFIC):
+    super().__init__([SimulatedEcu(0x7E0, 0, {b"\x22\xf1\x90": VIN_RESPONSE}), *hyundai_ecus(1)])
+    self.traffic = traffic
+    self.frame = 0
+    self.sent = 0
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    self.sent += len(msgs)
+    super().can_send(msgs)
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    self.frame += 1
+    packets = super().can_recv(wait_for_one)
+    return [[self.traffic[self.frame % len(self.traffic)], *(packets[0] if packets else [])]]
+
+  def set_version(self, version: bytes) -> None:
+    self.ecus[-1].responses[HYUNDAI_VERSION_REQUEST_LONG] = b"\x62" + version
+
+  def update_fw(self) -> None:
+    # another known version, as after a software update
+    versions = next(versions for (_, addr, _), versions in FW_VERSIONS[PLATFORM].items() if addr == self.ecus[-1].tx_addr)
+    self.set_version(versions[1])
+
+
+class TestFwCache(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp_dir.name, "fw_cache.json")
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_store_lookup(self):
+    car = SimulatedCar()
+    car_fw = get_fw_versions(car.can_recv, car.can_send, lambda obd: None, "hyundai")
+    ecu_rx_addrs = {(ecu.rx_addr, None, ecu.bus) for ecu in car.ecus}
+    fingerprint = {0x260: 8, 0x38d: 8, 0x2b0: 6, 0x7e8: 8}
+    FwCache(self.path).store(VIN, fingerprint, ecu_rx_addrs, car_fw, PLATFORM)
+
+    cache = FwCache(self.path)
+    entry = cache.lookup(VIN, {0x260: 8, 0x2b0: 6})
+    self.assertIsNotNone(entry)
+    self.assertEqual(entry.ecu_rx_addrs, ecu_rx_addrs)
+    self.assertEqual([fw.to_dict() for fw in entry.car_fw], [fw.to_dict() for fw in car_fw])
+    self.assertEqual(entry.platform, PLATFORM)
+    # diagnostic responses aren't part of the fingerprint
+    self.assertNotIn(0x7e8, entry.fingerprint)
+
+    # another car: different VIN, traffic or none at all
+    self.assertIsNone(cache.lookup("1" * 17, {0x260: 8}))
+    self.assertIsNone(cache.lookup(VIN, {0x260: 8, 0x2b0: 8}))
+    self.assertIsNone(cache.lookup(VIN, {0x260: 8, 0x100: 8}))
+    self.assertIsNone(cache.lookup(VIN, {}))
+
+    cache.invalidate(VIN)
+    self.assertIsNone(FwCache(self.path).lookup(VIN, {0x260: 8}))
+
+  def test_max_entries(self):
+    cache = FwCache(self.path, max_entries=2)
+    vins = [str(i) * 17 for i in range(3)]
+    for vin in (*vins, vins[1]):
+      cache.store(vin, {0x260: 8}, set(), [], PLATFORM)
+    self.assertEqual(list(FwCache(self.path).entries), [vins[2], vins[1]])
+
+  def test_confirm(self):
+    car = SimulatedCar()
+    car_fw = get_fw_versions(car.can_recv, car.can_send, lambda obd: None, "hyundai")
+    full_sent = car.sent
+
+    car.sent = 0
+    self.assertEqual(confirm_fw_versions(car.can_recv, car.can_send, lambda obd: None, car_fw), [])
+    self.assertLess(car.sent, full_sent)
+
+    car.set_version(b"\xf1\x00NEW VERSION")
+    mismatches = confirm_fw_versions(car.can_recv, car.can_send, lambda obd: None, car_fw)
+    self.assertEqual([fw.address for fw in mismatches], [car.ecus[-1].tx_addr])
+
+  def test_confirm_rx_offset(self):
+    # Volkswagen requests only differ in rx_offset: the engine answers at the usual 0x8, the EPS at 0x6a
+    engine = SimulatedEcu(0x7e0, 1, {VOLKSWAGEN_VERSION_REQUEST_MULTI: b"\x62" + b"\xf1\x878V0906259K \xf1\x890002"})
+    eps = SimulatedEcu(0x712, 1, {VOLKSWAGEN_VERSION_REQUEST_MULTI: b"\x62" + b"\xf1\x875Q0909144AB\xf1\x891082"})
+    eps.rx_addr = 0x712 + VOLKSWAGEN_RX_OFFSET
+    car = SimulatedEcuNetwork([engine, eps])
+
+    car_fw = []
+    for ecu, ecu_type in ((engine, Ecu.engine), (eps, Ecu.eps)):
+      car_fw.append(CarParams.CarFw(ecu=ecu_type, fwVersion=ecu.responses[VOLKSWAGEN_VERSION_REQUEST_MULTI][1:], address=ecu.tx_addr,
+                                    responseAddress=ecu.rx_addr, request=[VOLKSWAGEN_VERSION_REQUEST_MULTI], brand="volkswagen", bus=1,
+                                    obdMultiplexing=True))
+    self.assertEqual(confirm_fw_versions(car.can_recv, car.can_send, lambda obd: None, car_fw), [])
+
+  def test_fingerprint(self):
+    cache = FwCache(self.path)
+    sent = {}
+    for run in ("miss", "hit", "changed", "hit_changed"):
+      car = SimulatedCar()
+      if run in ("changed", "hit_changed"):
+        car.update_fw()
+
+      candidate, _, vin, car_fw, _, _ = fingerprint(car.can_recv, car.can_send, lambda obd: None, None, None, cache)
+      sent[run] = car.sent
+      self.assertEqual((candidate, vin), (PLATFORM, VIN))
+      self.assertEqual({fw.address: fw.fwVersion for fw in car_fw if fw.brand == "hyundai"},
+                       {ecu.tx_addr: ecu.responses[HYUNDAI_VERSION_REQUEST_LONG][1:] for ecu in car.ecus[1:]})
+      self.assertIn(VIN, FwCache(self.path).entries)
+
+    # a hit only sends the confirmation, a changed version queries all ECUs again
+    self.assertLess(sent["hit"] * 5, sent["miss"])
+    self.assertGreater(sent["changed"], sent["hit"] * 5)
+    self.assertLess(sent["hit_changed"] * 5, sent["changed"])
+
+
+if __name__ == "__main__":
+  unittest.main()
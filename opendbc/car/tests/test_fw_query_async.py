@@ -0,0 +1,160 @@
+import asyncio
+import time
+import unittest
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.can_transport import AsyncCanTransport
+from opendbc.car.ecu_addrs import get_all_ecu_addrs, get_all_ecu_addrs_async
+from opendbc.car.fw_versions import FW_VERSIONS, get_fw_versions, get_fw_versions_async, get_present_ecus, get_present_ecus_async
+from opendbc.car.hyundai.values import CAR as HYUNDAI, HYUNDAI_VERSION_REQUEST_LONG
+from opendbc.car.uds import AsyncUdsClient, DATA_IDENTIFIER_TYPE, NegativeResponseError, SERVICE_TYPE, SESSION_TYPE
+from opendbc.car.vin import get_vin, get_vin_async
+
+VIN = "5NPE34AF4FH012345"
+VIN_RESPONSE = b"\x62\xf1\x90" + VIN.encode()
+PLATFORM = HYUNDAI.HYUNDAI_SONATA
+
+
+class SimulatedEcu:
+  """ISO-TP server on one bus, answering requests to its physical address and the 11-bit functional address"""
+
+  def __init__(self, tx_addr: int, bus: int, responses: dict[bytes, bytes], delay: float = 0., response_pending: bool = False):
+    self.tx_addr = tx_addr
+    self.rx_addr = tx_addr + 8
+    self.bus = bus
+    self.responses = responses
+    self.delay = delay
+    self.response_pending = response_pending
+    self.tx_rest = b""
+
+  def receive(self, msg: CanData) -> list[bytes]:
+    if msg.src != self.bus or msg.address not in (self.tx_addr, 0x7DF):
+      return []
+    frame_type = msg.dat[0] >> 4
+    if frame_type == 0:
+      req = msg.dat[1:1 + msg.dat[0]]
+      if req == b"\x3e\x00":
+        return [b"\x02\x7e\x00".ljust(8, b"\x00")]
+      resp = self.responses.get(req, bytes([0x7F, req[0], 0x31]))
+      frames = [b"\x03\x7f" + bytes([req[0]]) + b"\x78"] if self.response_pending else []
+      if len(resp) <= 7:
+        return frames + [bytes([len(resp)]) + resp]
+      self.tx_rest = resp[6:]
+      return frames + [bytes([0x10 | len(resp) >> 8, len(resp) & 0xFF]) + resp[:6]]
+    elif frame_type == 3 and msg.address == self.tx_addr and self.tx_rest:
+      frames = [bytes([0x20 | (i + 1) & 0xF]) + self.tx_rest[i * 7:i * 7 + 7] for i in range(-(-len(self.tx_rest) // 7))]
+      self.tx_rest = b""
+      return frames
+    return []
+
+
+class SimulatedEcuNetwork:
+  """Buses of ECUs behind the can_send/can_recv callables, responses arrive after each ECU's delay"""
+
+  def __init__(self, ecus: list[SimulatedEcu]):
+    self.ecus = ecus
+    self.rx: list[tuple[float, CanData]] = []
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    for msg in msgs:
+      for ecu in self.ecus:
+        release = time.monotonic() + ecu.delay
+        self.rx.extend((release, CanData(ecu.rx_addr, dat.ljust(8, b"\x00"), ecu.bus)) for dat in ecu.receive(msg))
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    now = time.monotonic()
+    msgs = [msg for release, msg in self.rx if release <= now]
+    self.rx = [(release, msg) for release, msg in self.rx if release > now]
+    return [msgs] if msgs else []
+
+
+def hyundai_ecus(bus: int) -> list[SimulatedEcu]:
+  # one ECU for each address the platform has FW versions for, answering with its first version
+  return [SimulatedEcu(addr, bus, {HYUNDAI_VERSION_REQUEST_LONG: b"\x62" + versions[0]})
+          for (_, addr, sub_addr), versions in FW_VERSIONS[PLATFORM].items() if sub_addr is None]
+
+
+class TestFwQueryAsync(unittest.TestCase):
+  def test_vin(self):
+    for bus in (0, 1):
+      with self.subTest(bus=bus):
+        network = SimulatedEcuNetwork([SimulatedEcu(0x7E0, bus, {b"\x22\xf1\x90": VIN_RESPONSE})])
+        sync_vin = get_vin(network.can_recv, network.can_send, (0, 1))
+        async_vin = asyncio.run(get_vin_async(AsyncCanTransport(network.can_send, network.can_recv), (0, 1)))
+        self.assertEqual(sync_vin, (0x7E8, bus, VIN))
+        self.assertEqual(async_vin, sync_vin)
+
+  def test_ecu_addrs(self):
+    network = SimulatedEcuNetwork(hyundai_ecus(1))
+    obd_multiplexing = []
+    expected = {(ecu.rx_addr, None, 1) for ecu in network.ecus}
+
+    self.assertEqual(get_all_ecu_addrs(network.can_recv, network.can_send, 1, timeout=0.05), expected)
+    present = get_present_ecus(network.can_recv, network.can_send, obd_multiplexing.append)
+
+    transport = AsyncCanTransport(network.can_send, network.can_recv)
+    self.assertEqual(asyncio.run(get_all_ecu_addrs_async(transport, 1, timeout=0.05)), expected)
+    self.assertEqual(asyncio.run(get_present_ecus_async(transport, obd_multiplexing.append)), present)
+    self.assertTrue(expected <= present)
+    self.assertEqual(obd_multiplexing, [True, False] * 2)
+
+  def test_fw_versions(self):
+    network = SimulatedEcuNetwork(hyundai_ecus(1))
+    sync_fw = get_fw_versions(network.can_recv, network.can_send, lambda obd: None, "hyundai")
+    async_fw = asyncio.run(get_fw_versions_async(AsyncCanTransport(network.can_send, network.can_recv), lambda obd: None, "hyundai"))
+
+    self.assertEqual([fw.to_dict() for fw in async_fw], [fw.to_dict() for fw in sync_fw])
+    found = {(fw.address, fw.fwVersion) for fw in sync_fw}
+    self.assertEqual(found, {(ecu.tx_addr, ecu.responses[HYUNDAI_VERSION_REQUEST_LONG][1:]) for ecu in network.ecus})
+
+  def test_uds_client(self):
+    network = SimulatedEcuNetwork([
+      SimulatedEcu(0x7E0, 0, {b"\x22\xf1\x90": VIN_RESPONSE}, response_pending=True),
+      SimulatedEcu(0x7D0, 0, {b"\x22\xf1\x90": VIN_RESPONSE, b"\x10\x03": b"\x50\x03\x00\x32\x01\xf4"}),
+    ])
+
+    async def requests():
+      transport = AsyncCanTransport(network.can_send, network.can_recv)
+      engine, eps = AsyncUdsClient(transport, 0x7E0, timeout=0.1), AsyncUdsClient(transport, 0x7D0, timeout=0.1)
+      self.assertEqual(await eps.request(SERVICE_TYPE.DIAGNOSTIC_SESSION_CONTROL, SESSION_TYPE.EXTENDED_DIAGNOSTIC), b"\x00\x32\x01\xf4")
+      await engine.tester_present()
+      # the response pending is followed by a negative response
+      with self.assertRaises(NegativeResponseError):
+        await engine.diagnostic_session_control(SESSION_TYPE.EXTENDED_DIAGNOSTIC)
+      return await asyncio.gather(engine.read_data_by_identifier(DATA_IDENTIFIER_TYPE.VIN), eps.read_data_by_identifier(DATA_IDENTIFIER_TYPE.VIN))
+
+    self.assertEqual(asyncio.run(requests()), [VIN.encode()] * 2)
+
+  def test_concurrent(self):
+    # VIN and FW queries on separate buses along with a request to a slow ECU, all of them take about as long as the longest one
+    network = SimulatedEcuNetwork([SimulatedEcu(0x7E0, 1, {b"\x22\xf1\x90": VIN_RESPONSE}), *hyundai_ecus(0),
+                                   SimulatedEcu(0x740, 2, {b"\x22\xf1\x90": VIN_RESPONSE}, delay=0.2)])
+    transport = AsyncCanTransport(network.can_send, network.can_recv)
+
+    def startup():
+      return (get_vin_async(transport, (1,), retry=1), get_fw_versions_async(transport, lambda obd: None, "hyundai"),
+              AsyncUdsClient(transport, 0x740, bus=2).read_data_by_identifier(DATA_IDENTIFIER_TYPE.VIN))
+
+    async def run_sequential():
+      return [await coro for coro in startup()]
+
+    async def run_concurrent():
+      return await asyncio.gather(*startup())
+
+    results = {}
+    times = {}
+    for name, run in (("sequential", run_sequential), ("concurrent", run_concurrent)):
+      t = time.monotonic()
+      results[name] = asyncio.run(run())
+      times[name] = time.monotonic() - t
+
+    vin, car_fw, slow_vin = results["concurrent"]
+    self.assertEqual(vin, (0x7E8, 1, VIN))
+    self.assertEqual(slow_vin, VIN.encode())
+    self.assertEqual({fw.address for fw in car_fw}, {ecu.tx_addr for ecu in network.ecus if ecu.bus == 0})
+    self.assertEqual([fw.to_dict() for fw in car_fw], [fw.to_dict() for fw in results["sequential"][1]])
+    self.assertLess(times["concurrent"], times["sequential"] * 0.8)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+from opendbc.car import DT_CTRL
+from opendbc.car.lateral import apply_std_steer_angle_limits, apply_std_steer_angle_limits_batch, apply_steer_angle_limits_vm, \
+                                apply_steer_angle_limits_vm_batch
+from opendbc.car.ford.values import CarControllerParams as FordCarControllerParams
+from opendbc.car.tesla.carcontroller import get_safety_CP
+from opendbc.car.tesla.values import CarControllerParams as TeslaCarControllerParams
+from opendbc.car.toyota.values import CarControllerParams as ToyotaCarControllerParams
+from opendbc.car.vehicle_model import VehicleModel
+
+
+class TestLateralLimitsBatch(unittest.TestCase):
+  """The batch limit functions must match stepping the scalar versions exactly"""
+
+  def setUp(self):
+    rng = np.random.default_rng(0)
+    n = 2000
+    t = np.arange(n) * DT_CTRL
+    self.v_ego = np.clip(15 + 15 * np.sin(t / 7) + rng.normal(0, 1, n), 0, 40)
+    self.lat_active = (t % 6) < 5
+    self.rng = rng
+    self.n = n
+
+  def test_curvature_limits(self):
+    limits = FordCarControllerParams.CURVATURE_LIMITS
+    apply_curvature = self.rng.normal(0, 0.01, self.n)
+    curvature = self.rng.normal(0, 0.01, self.n)
+
+    batch = limits.apply_limits_batch(apply_curvature, 0.001, self.v_ego, curvature, self.lat_active, FordCarControllerParams.STEER_STEP)
+
+    last = 0.001
+    for i in range(self.n):
+      last = limits.apply_limits(apply_curvature[i], last, self.v_ego[i], curvature[i], self.lat_active[i], FordCarControllerParams.STEER_STEP)
+      self.assertEqual(batch[i], last)
+
+  def test_std_steer_angle_limits(self):
+    limits = ToyotaCarControllerParams.ANGLE_LIMITS
+    apply_angle = self.rng.normal(0, 60, self.n)
+    steering_angle = self.rng.normal(0, 60, self.n)
+
+    batch = apply_std_steer_angle_limits_batch(apply_angle, 5., self.v_ego, steering_angle, self.lat_active, limits)
+
+    last = 5.
+    for i in range(self.n):
+      last = apply_std_steer_angle_limits(apply_angle[i], last, self.v_ego[i], steering_angle[i], self.lat_active[i], limits)
+      self.assertEqual(batch[i], last)
+
+  def test_steer_angle_limits_vm(self):
+    VM = VehicleModel(get_safety_CP())
+    apply_angle = self.rng.normal(0, 90, self.n)
+    steering_angle = self.rng.normal(0, 90, self.n)
+
+    batch = apply_steer_angle_limits_vm_batch(apply_angle, -5., self.v_ego, steering_angle, self.lat_active, TeslaCarControllerParams, VM)
+
+    last = -5.
+    for i in range(self.n):
+      last = apply_steer_angle_limits_vm(apply_angle[i], last, self.v_ego[i], steering_angle[i], self.lat_active[i], TeslaCarControllerParams, VM)
+      self.assertEqual(batch[i], last)
+
+  def test_scalar_inputs(self):
+    limits = FordCarControllerParams.CURVATURE_LIMITS
+    batch = limits.apply_limits_batch(np.full(100, 0.02), 0., 20., 0., True, FordCarControllerParams.STEER_STEP)
+    self.assertTrue(np.all(np.diff(batch) >= 0))
+    self.assertEqual(batch[-1], limits.MAX_LATERAL_ACCEL / 20. ** 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+
+from opendbc.can import CANParser
+from opendbc.car import gen_empty_fingerprint
+from opendbc.car.car_helpers import interfaces
+from opendbc.car.debug.derive_parser_messages import derive_parser_messages
+from opendbc.car.parser_messages import apply_parser_messages, dump_parser_messages, load_parser_messages, nominal_frequency
+from opendbc.car.toyota.values import CAR as TOYOTA
+
+DBC = "honda_civic_touring_2016_can_generated"
+
+
+class TestParserMessages(unittest.TestCase):
+  def test_nominal_frequency(self):
+    self.assertEqual([nominal_frequency(f) for f in (0.3, 1.4, 9.2, 23, 31, 47.5, 120)], [1, 1, 10, 25, 33, 50, 100])
+
+  def test_table(self):
+    table = load_parser_messages()
+    for platform, parsers in table.items():
+      self.assertIn(platform, interfaces)
+      for messages in parsers.values():
+        for _, freq in messages:
+          self.assertIn(freq, (1, 2, 5, 10, 20, 25, 33, 50, 100))
+    self.assertEqual(json.loads(dump_parser_messages(table)), json.loads(dump_parser_messages({k: dict(v) for k, v in table.items()})))
+
+  def test_read_tracking(self):
+    cp = CANParser(DBC, [("ENGINE_DATA", 100)], 0)
+    _ = cp.vl["ENGINE_DATA"]
+    self.assertIsNone(cp.vl.reads)
+
+    cp.vl.reads = set()
+    _ = cp.vl["ENGINE_DATA"]["XMISSION_SPEED"]
+    _ = cp.vl[0x17c]
+    self.assertEqual(cp.vl.reads, {"ENGINE_DATA", 0x17c})
+
+  def test_apply(self):
+    cp = CANParser(DBC, [("ENGINE_DATA", 100), ("POWERTRAIN_DATA", None)], 0)
+    apply_parser_messages({"pt": cp, "cam": None}, {"pt": (("ENGINE_DATA", 50), ("POWERTRAIN_DATA", 50), ("CAR_SPEED", 10), ("NOT_IN_DBC", 10)),
+                                                    "cam": (("ENGINE_DATA", 50),)})
+
+    # frequencies from get_can_parsers are kept, the rest are known before the first frame
+    self.assertEqual(cp.message_states[0x158].frequency, 100)
+    self.assertEqual(cp.message_states[0x17c].frequency, 50)
+    self.assertEqual(cp.message_states[0x17c].timeout_threshold, 200_000_000)
+    self.assertEqual(cp.message_states[cp.dbc.name_to_msg["CAR_SPEED"].address].frequency, 10)
+
+  def test_derive(self):
+    CarInterface = interfaces[TOYOTA.TOYOTA_RAV4_TSS2]
+    fingerprint = gen_empty_fingerprint()
+    CP = CarInterface.get_params(TOYOTA.TOYOTA_RAV4_TSS2, fingerprint, [], False, False, False)
+    CP_SP = CarInterface.get_params_sp(CP, TOYOTA.TOYOTA_RAV4_TSS2, fingerprint, [], False, False, False)
+    CP_IC = CarInterface.get_params_ic(CP, TOYOTA.TOYOTA_RAV4_TSS2, fingerprint, [], False, False, False)
+    CI = CarInterface(CP, CP_SP, CP_IC)
+
+    # most Toyota messages aren't listed in get_can_parsers, send every message in the DBC at 50 Hz
+    frames = [(address, bytes(msg.size), cp.bus) for cp in CI.can_parsers.values() for address, msg in cp.dbc.addr_to_msg.items()]
+    result = derive_parser_messages(CI, [(i * 20_000_000, frames) for i in range(50)])
+
+    pt = CI.can_parsers["pt"]
+    self.assertIn(("STEER_TORQUE_SENSOR", 50), result.messages["pt"])
+    self.assertTrue(all(freq == 50 for messages in result.messages.values() for _, freq in messages))
+    for bus, messages in result.messages.items():
+      self.assertFalse({name for name, _ in messages} & set(result.unused[bus]))
+    # listed on the camera bus, but not read by this platform
+    self.assertEqual(result.unused["cam"], ["RSA1", "RSA2"])
+    self.assertIsNone(pt.vl.reads)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,56 @@
+import random
+import struct
+import unittest
+
+from Crypto.Cipher import AES
+from Crypto.Hash import CMAC
+
+from opendbc.car.secoc import SecOC, add_mac, build_sync_mac
+
+
+def reference_mac(key: bytes, to_auth: bytes) -> int:
+  # first 28 bits of the full AES-CMAC
+  return struct.unpack('>I', CMAC.new(key, to_auth, ciphermod=AES).digest()[:4])[0] >> 4
+
+
+def reference_add_mac(key, trip_cnt, reset_cnt, msg_cnt, msg):
+  addr, payload, bus = msg
+  freshness_value = struct.pack('>HI', trip_cnt, (reset_cnt << 12) | ((msg_cnt & 0xff) << 4) | ((reset_cnt & 0b11) << 2))
+  mac = reference_mac(key, struct.pack('>H', addr) + payload[:4] + freshness_value)
+  return addr, payload[:4] + struct.pack('>I', ((msg_cnt & 0b11) << 30) | ((reset_cnt & 0b11) << 28) | mac), bus
+
+
+class TestSecOC(unittest.TestCase):
+  def test_against_cmac(self):
+    rng = random.Random(0)
+    for _ in range(2000):
+      key = rng.choice([b"00" * 16, rng.randbytes(16), rng.randbytes(32)])
+      trip_cnt, reset_cnt, msg_cnt = rng.randrange(1 << 16), rng.randrange(1 << 20), rng.randrange(1000)
+      msg = (rng.randrange(0x800), rng.randbytes(8), rng.randrange(3))
+      self.assertEqual(add_mac(key, trip_cnt, reset_cnt, msg_cnt, msg), reference_add_mac(key, trip_cnt, reset_cnt, msg_cnt, msg))
+      self.assertEqual(build_sync_mac(key, trip_cnt, reset_cnt), reference_mac(key, struct.pack('>HHI', 0xf, trip_cnt, reset_cnt << 12)[:7]))
+
+  def test_sign_batch(self):
+    key = bytes(range(16))
+    secoc = SecOC(key)
+    self.assertTrue(secoc.synchronize(10, 20, build_sync_mac(key, 10, 20)))
+
+    # the message counter is kept for each address, every 10 ms cycle signs the messages sent in it
+    lka, lta = (0x131, bytes(range(8)), 0), (0x191, bytes(range(8, 16)), 0)
+    for cycle in range(5):
+      msgs = [lka, lta] if cycle % 2 == 0 else [lka]
+      expected = [reference_add_mac(key, 10, 20, cycle if addr == 0x131 else cycle // 2, (addr, dat, bus)) for addr, dat, bus in msgs]
+      self.assertEqual(secoc.sign(msgs), expected)
+    self.assertEqual(secoc.sign([]), [])
+
+    # the counters restart with a new reset counter, the same trip and reset counters change nothing
+    self.assertTrue(secoc.synchronize(10, 20, 0))
+    self.assertFalse(secoc.synchronize(10, 22, 0))
+    self.assertEqual(secoc.sign([lka]), [reference_add_mac(key, 10, 22, 0, lka)])
+
+    secoc.key = b"00" * 16
+    self.assertEqual(secoc.sign([lka]), [reference_add_mac(b"00" * 16, 10, 22, 1, lka)])
+
+
+if __name__ == "__main__":
+  unittest.main()
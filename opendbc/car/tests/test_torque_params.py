@@ -0,0 +1,33 @@
+import math
+import unittest
+
+from opendbc.car.interfaces import get_torque_params
+from opendbc.car.torque_params import TORQUE_TABLE_PATH, build_torque_table, dump_torque_table, load_torque_table
+
+
+class TestTorqueParams(unittest.TestCase):
+  def test_generated_table(self):
+    with open(TORQUE_TABLE_PATH) as f:
+      current_table = f.read()
+
+    assert dump_torque_table(build_torque_table()) == current_table, "Run opendbc/car/torque_params.py to update the torque table"
+
+  def test_load_matches_toml(self):
+    toml_table = build_torque_table()
+    table = load_torque_table()
+
+    self.assertEqual(dict(table.substitutes), dict(toml_table.substitutes))
+    self.assertEqual(list(table.params), list(toml_table.params))
+    for platform, params in toml_table.params.items():
+      for value, expected in zip(table.params[platform], params, strict=True):
+        self.assertTrue(value == expected or (math.isnan(value) and math.isnan(expected)), platform)
+
+  def test_substitutes(self):
+    torque_params = get_torque_params()
+    for candidate, sub_candidate in load_torque_table().substitutes.items():
+      self.assertNotIn(sub_candidate, load_torque_table().substitutes)
+      self.assertIs(torque_params[candidate], torque_params[sub_candidate])
+
+
+if __name__ == "__main__":
+  unittest.main()
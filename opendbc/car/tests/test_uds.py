@@ -0,0 +1,196 @@
+import random
+import struct
+import time
+import unittest
+
+from opendbc.car.uds import UdsClient, get_separation_time
+
+TX_ADDR = 0x7E0
+RX_ADDR = 0x7E8
+
+
+class SimulatedEcu:
+  """ISO-TP and UDS memory transfer services of an ECU, answering a panda-like client right away"""
+
+  def __init__(self, block_size: int = 0, st_min: int = 0, max_num_bytes: int = 0x402, seed: int = 0):
+    self.memory = bytearray(random.Random(seed).randbytes(0x20000))
+    self.block_size = block_size
+    self.st_min = st_min
+    self.max_num_bytes = max_num_bytes
+    self.rx: list[tuple[int, bytes, int]] = []
+
+    self.rx_dat = b""
+    self.rx_len = 0
+    self.rx_idx = 0
+    self.rx_block = 0
+    self.tx_dat = b""
+    # gaps between the consecutive frames of a block, and the shortest one
+    self.last_cf_time = 0.
+    self.min_cf_gap = float('inf')
+
+    self.transfer: str | None = None
+    self.transfer_addr = 0
+    self.block_sequence_count = 1
+
+  def can_send(self, addr: int, dat: bytes, bus: int, timeout: int = 0) -> None:
+    assert (addr, bus) == (TX_ADDR, 0) and len(dat) == 8
+    frame_type = dat[0] >> 4
+    if frame_type == 0:
+      self.process(dat[1:1 + (dat[0] & 0xF)])
+    elif frame_type == 1:
+      self.rx_len = ((dat[0] & 0xF) << 8) | dat[1]
+      self.rx_dat = dat[2:]
+      self.rx_idx = 0
+      self.rx_block = 0
+      self.last_cf_time = 0.
+      self.send([bytes([0x30, self.block_size, self.st_min])])
+    elif frame_type == 2:
+      now = time.monotonic()
+      if self.rx_block > 0:
+        self.min_cf_gap = min(self.min_cf_gap, now - self.last_cf_time)
+      self.last_cf_time = now
+      self.rx_idx += 1
+      assert dat[0] & 0xF == self.rx_idx & 0xF, "invalid consecutive frame index"
+      assert len(self.rx_dat) < self.rx_len, "consecutive frame after the end of the message"
+      self.rx_dat += dat[1:1 + self.rx_len - len(self.rx_dat)]
+      self.rx_block += 1
+      if len(self.rx_dat) == self.rx_len:
+        self.process(self.rx_dat)
+      elif self.block_size and self.rx_block == self.block_size:
+        self.rx_block = 0
+        self.send([bytes([0x30, self.block_size, self.st_min])])
+    elif frame_type == 3:
+      # the client asks for the rest of the response
+      msgs = [bytes([0x20 | (i + 1) & 0xF]) + self.tx_dat[6 + i * 7:13 + i * 7] for i in range(-(-(len(self.tx_dat) - 6) // 7))]
+      self.send(msgs)
+
+  def can_send_many(self, msgs: list[tuple[int, bytes, int]], timeout: int = 0) -> None:
+    for addr, dat, bus in msgs:
+      self.can_send(addr, dat, bus)
+
+  def can_recv(self) -> list[tuple[int, bytes, int]]:
+    msgs, self.rx = self.rx, []
+    return msgs
+
+  def send(self, msgs: list[bytes]) -> None:
+    self.rx.extend((RX_ADDR, msg.ljust(8, b"\x00"), 0) for msg in msgs)
+
+  def respond(self, resp: bytes) -> None:
+    if len(resp) <= 7:
+      self.send([bytes([len(resp)]) + resp])
+    else:
+      self.tx_dat = resp
+      self.send([struct.pack("!H", 0x1000 | len(resp)) + resp[:6]])
+
+  def process(self, req: bytes) -> None:
+    sid = req[0]
+    if sid in (0x34, 0x35):
+      addr_len, size_len = req[2] & 0xF, req[2] >> 4
+      self.transfer = "download" if sid == 0x34 else "upload"
+      self.transfer_addr = int.from_bytes(req[3:3 + addr_len], "big")
+      self.transfer_end = self.transfer_addr + int.from_bytes(req[3 + addr_len:3 + addr_len + size_len], "big")
+      self.block_sequence_count = 1
+      self.respond(bytes([sid + 0x40, 0x20]) + struct.pack("!H", self.max_num_bytes))
+    elif sid == 0x36:
+      if self.transfer is None or req[1] != self.block_sequence_count:
+        self.respond(bytes([0x7F, sid, 0x24 if self.transfer is None else 0x73]))
+        return
+      self.block_sequence_count = (self.block_sequence_count + 1) & 0xFF
+      if self.transfer == "download":
+        assert len(req) <= self.max_num_bytes
+        self.memory[self.transfer_addr:self.transfer_addr + len(req) - 2] = req[2:]
+        self.transfer_addr += len(req) - 2
+        self.respond(bytes([0x76, req[1]]))
+      else:
+        size = min(self.max_num_bytes - 2, self.transfer_end - self.transfer_addr)
+        self.respond(bytes([0x76, req[1]]) + self.memory[self.transfer_addr:self.transfer_addr + size])
+        self.transfer_addr += size
+    elif sid == 0x37:
+      self.transfer = None
+      self.respond(bytes([0x77]))
+    elif sid == 0x23:
+      addr_len, size_len = req[1] & 0xF, req[1] >> 4
+      addr = int.from_bytes(req[2:2 + addr_len], "big")
+      size = int.from_bytes(req[2 + addr_len:2 + addr_len + size_len], "big")
+      self.respond(bytes([0x63]) + self.memory[addr:addr + size])
+    else:
+      self.respond(bytes([0x7F, sid, 0x11]))
+
+
+class TestUdsTransfer(unittest.TestCase):
+  def test_separation_time(self):
+    self.assertEqual(get_separation_time(0), 0)
+    self.assertEqual(get_separation_time(0x7F), 0.127)
+    self.assertAlmostEqual(get_separation_time(0xF1), 0.0001)
+    self.assertAlmostEqual(get_separation_time(0xF9), 0.0009)
+    # reserved values
+    self.assertEqual(get_separation_time(0x80), 0.127)
+    self.assertEqual(get_separation_time(0xFA), 0.127)
+
+  def test_download(self):
+    data = random.Random(1).randbytes(6000)
+    for block_size, max_num_bytes in ((0, 0x402), (8, 0x402), (3, 0x12), (0, 0x2000)):
+      with self.subTest(block_size=block_size, max_num_bytes=max_num_bytes):
+        ecu = SimulatedEcu(block_size=block_size, max_num_bytes=max_num_bytes)
+        client = UdsClient(ecu, TX_ADDR)
+        stats = client.download_data(0x1000, data)
+        self.assertEqual(ecu.memory[0x1000:0x1000 + len(data)], data)
+        self.assertEqual(stats.size, len(data))
+        self.assertEqual(stats.blocks, -(-len(data) // (min(max_num_bytes, 0xFFF) - 2)))
+        self.assertGreater(stats.bytes_per_second, 0)
+
+  def test_download_iterable(self):
+    data = random.Random(2).randbytes(5000)
+    ecu = SimulatedEcu()
+    client = UdsClient(ecu, TX_ADDR)
+    chunks = (data[i:i + 333] for i in range(0, len(data), 333))
+    client.download_data(0x2000, chunks, memory_size=len(data))
+    self.assertEqual(ecu.memory[0x2000:0x2000 + len(data)], data)
+
+    with self.assertRaises(ValueError):
+      client.download_data(0x2000, iter([data]))
+
+    # a size mismatch of an image is caught before the download is requested
+    with self.assertRaises(ValueError):
+      client.download_data(0x2000, data, memory_size=len(data) + 1)
+    self.assertIsNone(ecu.transfer)
+
+    # a short iterable is only noticed at the end, the transfer is exited anyway
+    with self.assertRaises(ValueError):
+      client.download_data(0x2000, iter([data]), memory_size=len(data) + 1)
+    self.assertIsNone(ecu.transfer)
+
+    # a long iterable stops at memory_size, the bytes past it are never sent
+    ecu.memory[0x4000:0x4000 + len(data)] = bytes(len(data))
+    with self.assertRaises(ValueError):
+      client.download_data(0x4000, (data[i:i + 1000] for i in range(0, len(data), 1000)), memory_size=2500)
+    self.assertIsNone(ecu.transfer)
+    self.assertEqual(ecu.memory[0x4000:0x4000 + len(data)], data[:2500] + bytes(len(data) - 2500))
+
+  def test_separation_time_kept(self):
+    ecu = SimulatedEcu(block_size=4, st_min=0xF5)
+    client = UdsClient(ecu, TX_ADDR)
+    data = random.Random(3).randbytes(500)
+    client.download_data(0x3000, data)
+    self.assertEqual(ecu.memory[0x3000:0x3000 + len(data)], data)
+    self.assertGreaterEqual(ecu.min_cf_gap, 0.0005)
+
+  def test_upload(self):
+    for max_num_bytes in (0x402, 0x12):
+      with self.subTest(max_num_bytes=max_num_bytes):
+        ecu = SimulatedEcu(max_num_bytes=max_num_bytes)
+        client = UdsClient(ecu, TX_ADDR)
+        dat, stats = client.upload_data(0x4000, 5000)
+        self.assertEqual(dat, ecu.memory[0x4000:0x4000 + 5000])
+        self.assertEqual(stats.blocks, -(-5000 // (max_num_bytes - 2)))
+
+  def test_read_memory(self):
+    ecu = SimulatedEcu()
+    client = UdsClient(ecu, TX_ADDR)
+    dat, stats = client.read_memory(0x5000, 10000)
+    self.assertEqual(dat, ecu.memory[0x5000:0x5000 + 10000])
+    self.assertEqual(stats.blocks, 3)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -65,3 +65,40 @@ class TestVehicleModel(unittest.TestCase):
           x2 = dyn_ss_sol(sa, u, roll, self.VM)
 
           np.testing.assert_almost_equal(x1, x2, decimal=3)
+
+  def test_dyn_ss_sol_against_solve(self):
+    """Verifies the closed form dyn_ss_sol matches solving the state space model"""
+
+    for roll in np.linspace(math.radians(-20), math.radians(20), num=11):
+      for u in np.linspace(1, 30, num=10):
+        A, B = create_dyn_state_matrices(u, self.VM)
+        for sa in np.linspace(math.radians(-20), math.radians(20), num=11):
+          x1 = -np.linalg.solve(A, B) @ np.array([[sa], [roll]])
+          x2 = dyn_ss_sol(sa, u, roll, self.VM)
+          np.testing.assert_allclose(x1, x2, rtol=1e-12, atol=1e-15)
+
+  def test_batch_against_scalar(self):
+    sa, u, roll = (g.ravel() for g in np.meshgrid(np.linspace(math.radians(-20), math.radians(20), num=11),
+                                                  np.linspace(0, 30, num=13),
+                                                  np.linspace(math.radians(-20), math.radians(20), num=11)))
+
+    for stiffness_factor, steer_ratio in ((1.0, self.VM.sR), (0.8, 14.0)):
+      self.VM.update_params(stiffness_factor, steer_ratio)
+
+      curvatures, yaw_rates = self.VM.calc_curvature_batch(sa, u, roll)
+      steers = self.VM.get_steer_from_curvature_batch(curvatures, u, roll)
+      ss_sols = self.VM.steady_state_sol_batch(sa, u, roll)
+      for i in range(len(sa)):
+        self.assertEqual(curvatures[i], self.VM.calc_curvature(sa[i], u[i], roll[i]))
+        self.assertEqual(yaw_rates[i], self.VM.yaw_rate(sa[i], u[i], roll[i]))
+        self.assertEqual(steers[i], self.VM.get_steer_from_curvature(curvatures[i], u[i], roll[i]))
+        np.testing.assert_allclose(ss_sols[:, i:i + 1], self.VM.steady_state_sol(sa[i], u[i], roll[i]), rtol=1e-12, atol=1e-15)
+
+  def test_update_params(self):
+    curvature = self.VM.calc_curvature(0.1, 20, 0.05)
+    self.VM.update_params(0.5, self.VM.sR)
+    self.assertNotEqual(curvature, self.VM.calc_curvature(0.1, 20, 0.05))
+
+    VM = VehicleModel(CarInterface.get_non_essential_params(CAR.HONDA_CIVIC))
+    VM.update_params(0.5, self.VM.sR)
+    self.assertEqual(VM.calc_curvature(0.1, 20, 0.05), self.VM.calc_curvature(0.1, 20, 0.05))
@@ -0,0 +1,191 @@
+import random
+import struct
+import unittest
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.xcp import COMMAND_CODE, CommandResponseError, CommandTimeoutError, DaqEntry, XcpClient
+
+TX_ADDR = 0x7E0
+RX_ADDR = 0x7E8
+BUS = 1
+
+
+class SimulatedXcpSlave:
+  """XCP on CAN slave answering from a memory image, big endian with byte address granularity"""
+
+  def __init__(self, slave_block_mode=False, master_block_mode=False, max_bs=0, queue_size=0, seed=0):
+    self.memory = bytearray(random.Random(seed).randbytes(0x10000))
+    self.slave_block_mode = slave_block_mode
+    self.master_block_mode = master_block_mode
+    self.max_bs = max_bs
+    self.queue_size = queue_size
+    self.mta = 0
+    self.download_left = 0
+    self.rx: list[CanData] = []
+    # commands sent before the responses to earlier ones were received
+    self.max_in_flight = 0
+    self.in_flight = 0
+    self.daq_lists: list[list[list[tuple[int, int]]]] = []
+    self.daq_ptr = (0, 0, 0)
+    self.selected: dict[int, int] = {}
+    self.running = False
+    self.drop_next = False
+
+  def respond(self, *dats: bytes) -> None:
+    if self.drop_next:
+      self.drop_next = False
+      return
+    self.rx.extend(CanData(RX_ADDR, dat.ljust(8, b"\x00"), BUS) for dat in dats)
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    msgs, self.rx = self.rx, []
+    self.in_flight = 0
+    # traffic of other ECUs and buses
+    return [[CanData(RX_ADDR + 1, b"\xff" * 8, BUS), CanData(RX_ADDR, b"\xff" * 8, BUS + 1), *msgs]]
+
+  def can_send(self, msgs: list[CanData]) -> None:
+    for msg in msgs:
+      assert (msg.address, msg.src) == (TX_ADDR, BUS)
+      self.handle(msg.dat)
+
+  def handle(self, dat: bytes) -> None:
+    cmd = dat[0]
+    if cmd != COMMAND_CODE.DOWNLOAD_NEXT:
+      self.in_flight += 1
+      self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    if cmd == COMMAND_CODE.CONNECT:
+      comm_mode_basic = 0x01 | (0x40 if self.slave_block_mode else 0) | 0x80
+      self.respond(bytes([0xFF, 0x05, comm_mode_basic, 8, 0, 8, 1, 1]))
+    elif cmd == COMMAND_CODE.GET_COMM_MODE_INFO:
+      optional = (0x01 if self.master_block_mode else 0) | (0x02 if self.queue_size else 0)
+      self.respond(bytes([0xFF, 0, optional, 0, self.max_bs, 0, self.queue_size, 1]))
+    elif cmd == COMMAND_CODE.SET_MTA:
+      self.mta = struct.unpack(">I", dat[4:8])[0]
+      self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.UPLOAD:
+      size = dat[1]
+      if size > 7 and not self.slave_block_mode:
+        self.respond(bytes([0xFE, 0x22]))
+        return
+      data = self.memory[self.mta:self.mta + size]
+      self.mta += size
+      self.respond(*[b"\xff" + data[i:i + 7] for i in range(0, size, 7)])
+    elif cmd in (COMMAND_CODE.DOWNLOAD, COMMAND_CODE.DOWNLOAD_NEXT):
+      if cmd == COMMAND_CODE.DOWNLOAD_NEXT and dat[1] != self.download_left:
+        self.respond(bytes([0xFE, 0x29]))
+        return
+      size = min(dat[1], 6)
+      self.memory[self.mta:self.mta + size] = dat[2:2 + size]
+      self.mta += size
+      self.download_left = dat[1] - size
+      if self.download_left == 0:
+        self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.FREE_DAQ:
+      self.daq_lists = []
+      self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.ALLOC_DAQ:
+      self.daq_lists = [[] for _ in range(struct.unpack(">H", dat[2:4])[0])]
+      self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.ALLOC_ODT:
+      daq, count = struct.unpack(">HB", dat[2:5])
+      self.daq_lists[daq] = [[] for _ in range(count)]
+      self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.ALLOC_ODT_ENTRY:
+      daq, odt, count = struct.unpack(">HBB", dat[2:6])
+      self.daq_lists[daq][odt] = [(0, 0)] * count
+      self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.SET_DAQ_PTR:
+      self.daq_ptr = struct.unpack(">HBB", dat[2:6])
+      self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.WRITE_DAQ:
+      daq, odt, entry = self.daq_ptr
+      self.daq_lists[daq][odt][entry] = (struct.unpack(">I", dat[4:8])[0], dat[2])
+      self.daq_ptr = (daq, odt, entry + 1)
+      self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.SET_DAQ_LIST_MODE:
+      self.respond(b"\xff")
+    elif cmd == COMMAND_CODE.START_STOP_DAQ_LIST:
+      daq = struct.unpack(">H", dat[2:4])[0]
+      self.selected[daq] = sum(len(odts) for odts in self.daq_lists[:daq])
+      self.respond(bytes([0xFF, self.selected[daq]]))
+    elif cmd == COMMAND_CODE.START_STOP_SYNCH:
+      self.running = dat[1] == 1
+      self.respond(b"\xff")
+    else:
+      self.respond(bytes([0xFE, 0x20]))
+
+  def sample_daq(self, lose_odt: int | None = None) -> None:
+    for daq, first_pid in self.selected.items():
+      for odt, entries in enumerate(self.daq_lists[daq]):
+        if odt != lose_odt:
+          self.rx.append(CanData(RX_ADDR, bytes([first_pid + odt]) + b"".join(self.memory[a:a + s] for a, s in entries), BUS))
+
+
+class TestXcpClient(unittest.TestCase):
+  def connect(self, **kwargs) -> tuple[SimulatedXcpSlave, XcpClient]:
+    slave = SimulatedXcpSlave(**kwargs)
+    client = XcpClient(slave.can_send, slave.can_recv, TX_ADDR, RX_ADDR, BUS, timeout=0.01)
+    client.connect()
+    client.get_comm_mode_info()
+    return slave, client
+
+  def test_read_memory(self):
+    for kwargs in ({}, {"slave_block_mode": True}, {"slave_block_mode": True, "queue_size": 4}):
+      with self.subTest(**kwargs):
+        slave, client = self.connect(**kwargs)
+        for addr, length in ((0x100, 1), (0x1234, 7), (0x2000, 3000)):
+          self.assertEqual(client.read_memory(addr, length), slave.memory[addr:addr + length])
+        self.assertEqual(slave.max_in_flight, max(kwargs.get("queue_size", 0), 1))
+
+  def test_write_memory(self):
+    for kwargs in ({}, {"master_block_mode": True, "max_bs": 8}):
+      with self.subTest(**kwargs):
+        slave, client = self.connect(**kwargs)
+        data = random.Random(1).randbytes(1000)
+        client.write_memory(0x4000, data)
+        self.assertEqual(slave.memory[0x4000:0x4000 + len(data)], data)
+
+  def test_block_mode_not_supported(self):
+    _, client = self.connect()
+    with self.assertRaises(ValueError):
+      client.upload(8)
+    client.set_mta(0)
+    with self.assertRaises(ValueError):
+      client.download(bytes(7))
+
+  def test_errors(self):
+    slave, client = self.connect()
+    with self.assertRaises(CommandResponseError):
+      client.get_id()
+
+    # a late response to a command that timed out doesn't answer the next command
+    slave.drop_next = True
+    with self.assertRaises(CommandTimeoutError):
+      client.set_mta(0x100)
+    slave.respond(b"\xff")
+    self.assertEqual(client.read_memory(0x200, 16), slave.memory[0x200:0x210])
+
+  def test_daq(self):
+    slave, client = self.connect()
+    daq_lists = [[DaqEntry(0x100, 4), DaqEntry(0x200, 6), DaqEntry(0x300, 9)], [DaqEntry(0x400, 2)]]
+    samples = []
+    client.configure_daq(daq_lists, lambda daq, values: samples.append((daq, values)))
+    client.start_daq()
+    self.assertTrue(slave.running)
+
+    expected = [(daq, [slave.memory[e.addr:e.addr + e.size] for e in entries]) for daq, entries in enumerate(daq_lists)]
+    slave.sample_daq()
+    client.poll_daq(0.01)
+    self.assertEqual(samples, expected)
+
+    # incomplete samples are dropped, DAQ packets received while waiting for a response are passed on
+    samples.clear()
+    slave.sample_daq(lose_odt=1)
+    slave.sample_daq()
+    client.stop_daq()
+    self.assertEqual(samples, [expected[1], *expected])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Frozen torque parameter table, generated from the TOML files in torque_data.
+
+The TOML files are the source of truth, run this file to regenerate the table after editing them.
+"""
+import json
+import os
+import tomllib
+from functools import cache
+from types import MappingProxyType
+from typing import NamedTuple
+from collections.abc import Mapping
+
+from opendbc.car.common.basedir import BASEDIR
+
+TORQUE_PARAMS_PATH = os.path.join(BASEDIR, 'torque_data/params.toml')
+TORQUE_OVERRIDE_PATH = os.path.join(BASEDIR, 'torque_data/override.toml')
+TORQUE_SUBSTITUTE_PATH = os.path.join(BASEDIR, 'torque_data/substitute.toml')
+TORQUE_TABLE_PATH = os.path.join(BASEDIR, 'torque_data/torque_params.json')
+
+
+class TorqueParams(NamedTuple):
+  # field names match the TOML legend
+  LAT_ACCEL_FACTOR: float
+  MAX_LAT_ACCEL_MEASURED: float
+  FRICTION: float
+
+
+class TorqueTable(NamedTuple):
+  # every platform, with substitutes resolved
+  params: Mapping[str, TorqueParams]
+  # platform -> platform whose params it uses
+  substitutes: Mapping[str, str]
+
+
+def build_torque_table() -> TorqueTable:
+  """Parses and reconciles the TOML sources"""
+  with open(TORQUE_SUBSTITUTE_PATH, 'rb') as f:
+    sub = tomllib.load(f)
+  with open(TORQUE_PARAMS_PATH, 'rb') as f:
+    params = tomllib.load(f)
+  with open(TORQUE_OVERRIDE_PATH, 'rb') as f:
+    override = tomllib.load(f)
+
+  for legend in (sub['legend'], params['legend'], override['legend']):
+    if tuple(legend) != TorqueParams._fields:
+      raise RuntimeError(f'Unexpected torque config legend: {legend}')
+
+  torque_params = {}
+  substitutes = {}
+  for candidate in (sub.keys() | params.keys() | override.keys()) - {'legend'}:
+    if sum([candidate in x for x in [sub, params, override]]) > 1:
+      raise RuntimeError(f'{candidate} is defined twice in torque config')
+
+    sub_candidate = sub.get(candidate, candidate)
+
+    if sub_candidate in override:
+      out = override[sub_candidate]
+    elif sub_candidate in params:
+      out = params[sub_candidate]
+    else:
+      raise NotImplementedError(f"Did not find torque params for {sub_candidate}")
+
+    torque_params[sub_candidate] = TorqueParams(*out)
+    if candidate in sub:
+      torque_params[candidate] = torque_params[sub_candidate]
+      substitutes[candidate] = sub_candidate
+
+  return TorqueTable(MappingProxyType(dict(sorted(torque_params.items()))), MappingProxyType(dict(sorted(substitutes.items()))))
+
+
+def dump_torque_table(table: TorqueTable) -> str:
+  # one platform per line, substitutes are stored once as an edge to the platform they use
+  def section(items):
+    return ',\n'.join(f'    {json.dumps(k)}: {json.dumps(v)}' for k, v in items)
+
+  params = [(platform, list(p)) for platform, p in table.params.items() if platform not in table.substitutes]
+  return '\n'.join([
+    '{',
+    f'  "legend": {json.dumps(TorqueParams._fields)},',
+    f'  "params": {{\n{section(params)}\n  }},',
+    f'  "substitutes": {{\n{section(table.substitutes.items())}\n  }}',
+    '}',
+  ]) + '\n'
+
+
+@cache
+def load_torque_table() -> TorqueTable:
+  """Loads the generated table, without parsing the TOML sources"""
+  with open(TORQUE_TABLE_PATH) as f:
+    table = json.load(f)
+
+  params = {platform: TorqueParams(*p) for platform, p in table['params'].items()}
+  for candidate, sub_candidate in table['substitutes'].items():
+    params[candidate] = params[sub_candidate]
+  return TorqueTable(MappingProxyType(dict(sorted(params.items()))), MappingProxyType(table['substitutes']))
+
+
+if __name__ == "__main__":
+  with open(TORQUE_TABLE_PATH, 'w') as f:
+    f.write(dump_torque_table(build_torque_table()))
+  print(f"Generated and written to {TORQUE_TABLE_PATH}")
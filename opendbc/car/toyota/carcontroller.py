@@ -5,7 +5,7 @@ from opendbc.car.lateral import apply_meas_steer_torque_limits, apply_std_steer_
 from opendbc.car.carlog import carlog
 from opendbc.car.common.filter_simple import FirstOrderFilter, HighPassFilter
 from opendbc.car.common.pid import PIDController
-from opendbc.car.secoc import add_mac, build_sync_mac
+from opendbc.car.secoc import SecOC
 from opendbc.car.interfaces import CarControllerBase
 from opendbc.car.toyota import toyotacan
 from opendbc.car.toyota.values import CAR, NO_STOP_TIMER_CAR, TSS2_CAR, \
@@ -77,10 +77,7 @@ class CarController(CarControllerBase, GasInterceptorCarController):
 
     self.packer = CANPacker(dbc_names[Bus.pt])
 
-    self.secoc_lka_message_counter = 0
-    self.secoc_lta_message_counter = 0
-    self.secoc_acc_message_counter = 0
-    self.secoc_prev_reset_counter = 0
+    self.secoc = SecOC(self.secoc_key)
 
   def update(self, CC, CC_SP, CC_IC, CS, now_nanos):
     actuators = CC.actuators
@@ -95,18 +92,15 @@ class CarController(CarControllerBase, GasInterceptorCarController):
 
     # *** control msgs ***
     can_sends = []
+    # indices of the messages in can_sends that get a MAC, all of them are signed together at the end
+    secoc_sends = []
 
     # *** handle secoc reset counter increase ***
     if self.CP.flags & ToyotaFlags.SECOC.value:
-      if CS.secoc_synchronization['RESET_CNT'] != self.secoc_prev_reset_counter:
-        self.secoc_lka_message_counter = 0
-        self.secoc_lta_message_counter = 0
-        self.secoc_acc_message_counter = 0
-        self.secoc_prev_reset_counter = CS.secoc_synchronization['RESET_CNT']
-
-        expected_mac = build_sync_mac(self.secoc_key, int(CS.secoc_synchronization['TRIP_CNT']), int(CS.secoc_synchronization['RESET_CNT']))
-        if int(CS.secoc_synchronization['AUTHENTICATOR']) != expected_mac:
-          carlog.error("SecOC synchronization MAC mismatch, wrong key?")
+      self.secoc.key = self.secoc_key
+      if not self.secoc.synchronize(int(CS.secoc_synchronization['TRIP_CNT']), int(CS.secoc_synchronization['RESET_CNT']),
+                                    int(CS.secoc_synchronization['AUTHENTICATOR'])):
+        carlog.error("SecOC synchronization MAC mismatch, wrong key?")
 
     # *** steer torque ***
     new_torque = int(round(actuators.torque * self.params.STEER_MAX))
@@ -140,13 +134,7 @@ class CarController(CarControllerBase, GasInterceptorCarController):
     # on consecutive messages
     steer_command = toyotacan.create_steer_command(self.packer, apply_torque, apply_steer_req)
     if self.CP.flags & ToyotaFlags.SECOC.value:
-      # TODO: check if this slow and needs to be done by the CANPacker
-      steer_command = add_mac(self.secoc_key,
-                              int(CS.secoc_synchronization['TRIP_CNT']),
-                              int(CS.secoc_synchronization['RESET_CNT']),
-                              self.secoc_lka_message_counter,
-                              steer_command)
-      self.secoc_lka_message_counter += 1
+      secoc_sends.append(len(can_sends))
     can_sends.append(steer_command)
 
     # STEERING_LTA does not seem to allow more rate by sending faster, and may wind up easier
@@ -163,14 +151,8 @@ class CarController(CarControllerBase, GasInterceptorCarController):
                                                           lta_active, self.frame // 2, torque_wind_down))
 
       if self.CP.flags & ToyotaFlags.SECOC.value:
-        lta_steer_2 = toyotacan.create_lta_steer_command_2(self.packer, self.frame // 2)
-        lta_steer_2 = add_mac(self.secoc_key,
-                              int(CS.secoc_synchronization['TRIP_CNT']),
-                              int(CS.secoc_synchronization['RESET_CNT']),
-                              self.secoc_lta_message_counter,
-                              lta_steer_2)
-        self.secoc_lta_message_counter += 1
-        can_sends.append(lta_steer_2)
+        secoc_sends.append(len(can_sends))
+        can_sends.append(toyotacan.create_lta_steer_command_2(self.packer, self.frame // 2))
 
     # *** gas and brake ***
 
@@ -273,14 +255,8 @@ class CarController(CarControllerBase, GasInterceptorCarController):
         can_sends.append(toyotacan.create_accel_command(self.packer, main_accel_cmd, pcm_cancel_cmd, self.permit_braking, self.standstill_req, lead,
                                                         CS.acc_type, fcw_alert, self.distance_button))
         if self.CP.flags & ToyotaFlags.SECOC.value:
-          acc_cmd_2 = toyotacan.create_accel_command_2(self.packer, pcm_accel_cmd)
-          acc_cmd_2 = add_mac(self.secoc_key,
-                              int(CS.secoc_synchronization['TRIP_CNT']),
-                              int(CS.secoc_synchronization['RESET_CNT']),
-                              self.secoc_acc_message_counter,
-                              acc_cmd_2)
-          self.secoc_acc_message_counter += 1
-          can_sends.append(acc_cmd_2)
+          secoc_sends.append(len(can_sends))
+          can_sends.append(toyotacan.create_accel_command_2(self.packer, pcm_accel_cmd))
 
         self.accel = pcm_accel_cmd
 
@@ -320,6 +296,10 @@ class CarController(CarControllerBase, GasInterceptorCarController):
     if self.frame % 20 == 0 and self.CP.flags & ToyotaFlags.DISABLE_RADAR.value:
       can_sends.append(make_tester_present_msg(0x750, 0, 0xF))
 
+    if secoc_sends:
+      for i, msg in zip(secoc_sends, self.secoc.sign([can_sends[i] for i in secoc_sends]), strict=True):
+        can_sends[i] = msg
+
     new_actuators = actuators.as_builder()
     new_actuators.torque = apply_torque / self.params.STEER_MAX
     new_actuators.torqueOutputCan = apply_torque
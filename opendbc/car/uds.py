@@ -1,12 +1,15 @@
 import time
 import struct
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import NamedTuple, cast
-from collections.abc import Callable, Generator
+from collections.abc import Callable, Generator, Iterable, Iterator
 from enum import IntEnum
 from functools import partial
 
-from opendbc.car.carlog import carlog
+from opendbc.car.can_definitions import CanData
+from opendbc.car.can_transport import AsyncCanTransport, CanListener
+from opendbc.car.carlog import DEBUG, carlog, eventlog
 
 
 class SERVICE_TYPE(IntEnum):
@@ -172,6 +175,16 @@ class DynamicSourceDefinition(NamedTuple):
   memory_address: int
 
 
+class TransferStats(NamedTuple):
+  size: int
+  blocks: int
+  seconds: float
+
+  @property
+  def bytes_per_second(self) -> float:
+    return self.size / self.seconds if self.seconds > 0 else float('inf')
+
+
 class DTC_GROUP_TYPE(IntEnum):
   EMISSIONS = 0x000000
   ALL = 0xFFFFFF
@@ -334,10 +347,30 @@ def get_dtc_status_names(status):
   return result
 
 
+# frame lengths a CAN FD frame can have above 8 bytes, ISO-TP frames are padded up to the next one
+CANFD_FRAME_LENGTHS = (8, 12, 16, 20, 24, 32, 48, 64)
+
+
+def get_frame_len(length: int) -> int:
+  """Length of the shortest frame that holds length bytes, classic CAN frames are always padded to 8"""
+  return next(n for n in CANFD_FRAME_LENGTHS if n >= length)
+
+
+def get_separation_time(st_min: int) -> float:
+  """Decodes the STmin byte of a flow control frame to seconds, reserved values mean the maximum of 127 ms"""
+  if st_min <= 0x7F:
+    return st_min / 1000.
+  if 0xF1 <= st_min <= 0xF9:
+    return (st_min - 0xF0) / 10000.
+  return 0.127
+
+
 class CanClient:
   def __init__(self, can_send: Callable[[int, bytes, int], None], can_recv: Callable[[], list[tuple[int, bytes, int]]],
-               tx_addr: int, rx_addr: int, bus: int, sub_addr: int | None = None, rx_sub_addr: int | None = None):
+               tx_addr: int, rx_addr: int, bus: int, sub_addr: int | None = None, rx_sub_addr: int | None = None,
+               can_send_many: Callable[[list[tuple[int, bytes, int]]], None] | None = None):
     self.tx = can_send
+    self.tx_many = can_send_many
     self.rx = can_recv
     self.tx_addr = tx_addr
     self.rx_addr = rx_addr
@@ -351,14 +384,16 @@ class CanClient:
     if self.tx_addr == 0x7DF:
       is_response = addr >= 0x7E8 and addr <= 0x7EF
       if is_response:
-        carlog.debug(f"switch to physical addr {hex(addr)}")
+        if eventlog.debug:
+          eventlog.event(DEBUG, "can", "switch_to_physical", addr=addr)
         self.tx_addr = addr - 8
         self.rx_addr = addr
       return is_response
     if self.tx_addr == 0x18DB33F1:
       is_response = addr >= 0x18DAF100 and addr <= 0x18DAF1FF
       if is_response:
-        carlog.debug(f"switch to physical addr {hex(addr)}")
+        if eventlog.debug:
+          eventlog.event(DEBUG, "can", "switch_to_physical", addr=addr)
         self.tx_addr = 0x18DA00F1 + (addr << 8 & 0xFF00)
         self.rx_addr = addr
     return bus == self.bus and addr == self.rx_addr
@@ -367,14 +402,16 @@ class CanClient:
     while True:
       msgs = self.rx()
       if drain:
-        carlog.debug(f"CAN-RX: drain - {len(msgs)}")
+        if eventlog.debug:
+          eventlog.event(DEBUG, "can", "rx_drain", count=len(msgs))
         self.rx_buff.clear()
       else:
         for rx_addr, rx_data, rx_bus in msgs or []:
           if self._recv_filter(rx_bus, rx_addr) and len(rx_data) > 0:
             rx_data = bytes(rx_data)  # convert bytearray to bytes
 
-            carlog.debug(f"CAN-RX: {hex(rx_addr)} - 0x{bytes.hex(rx_data)}")
+            if eventlog.debug:
+              eventlog.event(DEBUG, "can", "rx", addr=rx_addr, dat=rx_data)
 
             # Cut off sub addr in first byte
             if self.rx_sub_addr is not None:
@@ -398,29 +435,50 @@ class CanClient:
       pass  # empty
 
   def send(self, msgs: list[bytes], delay: float = 0) -> None:
+    if self.sub_addr is not None:
+      msgs = [bytes([self.sub_addr]) + msg for msg in msgs]
+    for msg in msgs:
+      if eventlog.debug:
+        eventlog.event(DEBUG, "can", "tx", addr=self.tx_addr, dat=msg)
+      assert len(msg) <= 8 or len(msg) in CANFD_FRAME_LENGTHS
+
+    if delay == 0 and self.tx_many is not None:
+      # without a separation time, every 10 frames go out in one call
+      for i in range(0, len(msgs), 10):
+        self.tx_many([(self.tx_addr, msg, self.bus) for msg in msgs[i:i + 10]])
+        if i + 10 < len(msgs):
+          self._recv_buffer()
+      return
+
+    last_tx = 0.
     for i, msg in enumerate(msgs):
       if delay and i != 0:
-        carlog.debug(f"CAN-TX: delay - {delay}")
-        time.sleep(delay)
-
-      if self.sub_addr is not None:
-        msg = bytes([self.sub_addr]) + msg
-
-      carlog.debug(f"CAN-TX: {hex(self.tx_addr)} - 0x{bytes.hex(msg)}")
-      assert len(msg) <= 8
+        # the separation time counts from the previous frame, time spent sending and receiving is part of it
+        wait = last_tx + delay - time.monotonic()
+        if wait > 0:
+          if eventlog.debug:
+            eventlog.event(DEBUG, "can", "tx_delay", wait=wait)
+          time.sleep(wait)
 
       self.tx(self.tx_addr, msg, self.bus)
+      last_tx = time.monotonic()
       # prevent rx buffer from overflowing on large tx
       if i % 10 == 9:
         self._recv_buffer()
 
 
 class IsoTpMessage:
-  def __init__(self, can_client: CanClient, timeout: float = 1, single_frame_mode: bool = False, separation_time: float = 0):
+  def __init__(self, can_client: CanClient, timeout: float = 1, single_frame_mode: bool = False, separation_time: float = 0, tx_dl: int = 8):
     self._can_client = can_client
     self.timeout = timeout
     self.single_frame_mode = single_frame_mode
-    self.max_len = 8 if self._can_client.sub_addr is None else 7
+
+    # tx_dl is the length of the frames we send, more than 8 for CAN FD. Frames from the ECU can be up to 64 bytes either way
+    if tx_dl not in CANFD_FRAME_LENGTHS:
+      raise ValueError(f"invalid tx_dl: {tx_dl}")
+    self._sub_addr_len = 0 if self._can_client.sub_addr is None else 1
+    self.max_len = tx_dl - self._sub_addr_len
+    self.classic_max_len = 8 - self._sub_addr_len
 
     # <= 127, separation time in milliseconds
     # 0xF1 to 0xF9 UF, 100 to 900 microseconds
@@ -436,7 +494,7 @@ class IsoTpMessage:
       0x30,  # flow control
       0x01 if self.single_frame_mode else 0x00,  # block size
       separation_time,
-    ]).ljust(self.max_len, b"\x00")
+    ]).ljust(self.classic_max_len, b"\x00")
 
   def send(self, dat: bytes, setup_only: bool = False) -> None:
     # throw away any stale data
@@ -445,6 +503,7 @@ class IsoTpMessage:
     self.tx_dat = dat
     self.tx_len = len(dat)
     self.tx_idx = 0
+    self.tx_first_len = 0
     self.tx_done = False
 
     self.rx_dat = b""
@@ -452,22 +511,38 @@ class IsoTpMessage:
     self.rx_idx = 0
     self.rx_done = False
 
-    if not setup_only:
-      carlog.debug(f"ISO-TP: REQUEST - {hex(self._can_client.tx_addr)} 0x{bytes.hex(self.tx_dat)}")
+    if not setup_only and eventlog.debug:
+      eventlog.event(DEBUG, "isotp", "request", tx_addr=self._can_client.tx_addr, dat=self.tx_dat)
     self._tx_first_frame(setup_only=setup_only)
 
+  def _pad(self, msg: bytes) -> bytes:
+    # CAN FD frames are only padded up to the next valid frame length
+    return msg.ljust(get_frame_len(len(msg) + self._sub_addr_len) - self._sub_addr_len, b"\x00")
+
   def _tx_first_frame(self, setup_only: bool = False) -> None:
-    if self.tx_len < self.max_len:
+    if self.tx_len < self.classic_max_len:
       # single frame (send all bytes)
-      if not setup_only:
-        carlog.debug(f"ISO-TP: TX - single frame - {hex(self._can_client.tx_addr)}")
-      msg = (bytes([self.tx_len]) + self.tx_dat).ljust(self.max_len, b"\x00")
+      if not setup_only and eventlog.debug:
+        eventlog.event(DEBUG, "isotp", "tx_single_frame", tx_addr=self._can_client.tx_addr)
+      msg = self._pad(bytes([self.tx_len]) + self.tx_dat)
+      self.tx_done = True
+    elif self.tx_len <= self.max_len - 2:
+      # CAN FD single frame, the length follows a zero length
+      if not setup_only and eventlog.debug:
+        eventlog.event(DEBUG, "isotp", "tx_single_frame", tx_addr=self._can_client.tx_addr)
+      msg = self._pad(bytes([0x00, self.tx_len]) + self.tx_dat)
       self.tx_done = True
     else:
-      # first frame (send first 6 bytes)
-      if not setup_only:
-        carlog.debug(f"ISO-TP: TX - first frame - {hex(self._can_client.tx_addr)}")
-      msg = (struct.pack("!H", 0x1000 | self.tx_len) + self.tx_dat[:self.max_len - 2]).ljust(self.max_len - 2, b"\x00")
+      # first frame (send first 6 bytes, or as many as fit in a CAN FD frame)
+      if not setup_only and eventlog.debug:
+        eventlog.event(DEBUG, "isotp", "tx_first_frame", tx_addr=self._can_client.tx_addr)
+      if self.tx_len <= 0xFFF:
+        header = struct.pack("!H", 0x1000 | self.tx_len)
+      else:
+        # escape sequence, the length follows a zero length
+        header = struct.pack("!HI", 0x1000, self.tx_len)
+      self.tx_first_len = self.max_len - len(header)
+      msg = header + self.tx_dat[:self.tx_first_len]
     if not setup_only:
       self._can_client.send([msg])
 
@@ -490,10 +565,11 @@ class IsoTpMessage:
         if timeout == 0:
           return None, rx_in_progress
         if time.monotonic() - start_time > timeout:
+          eventlog.count("isotp", "timeout")
           raise MessageTimeoutError("timeout waiting for response")
     finally:
-      if self.rx_dat:
-        carlog.debug(f"ISO-TP: RESPONSE - {hex(self._can_client.rx_addr)} 0x{bytes.hex(self.rx_dat)}")
+      if self.rx_dat and eventlog.debug:
+        eventlog.event(DEBUG, "isotp", "response", rx_addr=self._can_client.rx_addr, dat=self.rx_dat)
 
   def _isotp_rx_next(self, rx_data: bytes) -> ISOTP_FRAME_TYPE:
     # TODO: Handle CAN frame data optimization, which is allowed with some frame types
@@ -508,32 +584,36 @@ class IsoTpMessage:
       if rx_data[0] & 0x0F == 0 and len(rx_data) > 8:
         self.rx_len = rx_data[1]
         offset = 2
-        # TODO: update self.max_len for CAN FD
-        max_len = 62 if self._can_client.sub_addr is None else 61
-        assert self.rx_len <= max_len, f"isotp - rx: invalid single frame length: {self.rx_len}"
       else:
         self.rx_len = rx_data[0] & 0x0F
         offset = 1
-        assert self.rx_len < self.max_len, f"isotp - rx: invalid single frame length: {self.rx_len}"
+      assert self.rx_len <= len(rx_data) - offset, f"isotp - rx: invalid single frame length: {self.rx_len}"
 
       self.rx_dat = rx_data[offset:offset + self.rx_len]
       self.rx_idx = 0
       self.rx_done = True
-      carlog.debug(f"ISO-TP: RX - single frame - {hex(self._can_client.rx_addr)} idx={self.rx_idx} done={self.rx_done}")
+      if eventlog.debug:
+        eventlog.event(DEBUG, "isotp", "rx_single_frame", rx_addr=self._can_client.rx_addr, idx=self.rx_idx, done=self.rx_done)
       return ISOTP_FRAME_TYPE.SINGLE
 
     elif rx_data[0] >> 4 == ISOTP_FRAME_TYPE.FIRST:
-      # TODO: support CAN FD first frames
       # Once a first frame is received, further frames must be consecutive
       assert self.rx_dat == b"" or self.rx_done, "isotp - rx: first frame with active frame"
       self.rx_len = ((rx_data[0] & 0x0F) << 8) + rx_data[1]
-      assert self.rx_len >= self.max_len, f"isotp - rx: invalid first frame length: {self.rx_len}"
-      assert len(rx_data) == self.max_len, f"isotp - rx: invalid CAN frame length: {len(rx_data)}"
-      self.rx_dat = rx_data[2:]
+      offset = 2
+      if self.rx_len == 0:
+        # escape sequence for messages longer than 4095 bytes
+        self.rx_len = struct.unpack("!I", rx_data[2:6])[0]
+        offset = 6
+      # first frames fill the whole frame, which is 8 bytes or longer with CAN FD
+      assert len(rx_data) >= self.classic_max_len, f"isotp - rx: invalid CAN frame length: {len(rx_data)}"
+      assert self.rx_len > len(rx_data) - offset, f"isotp - rx: invalid first frame length: {self.rx_len}"
+      self.rx_dat = rx_data[offset:]
       self.rx_idx = 0
       self.rx_done = False
-      carlog.debug(f"ISO-TP: RX - first frame - {hex(self._can_client.rx_addr)} idx={self.rx_idx} done={self.rx_done}")
-      carlog.debug(f"ISO-TP: TX - flow control continue - {hex(self._can_client.tx_addr)}")
+      if eventlog.debug:
+        eventlog.event(DEBUG, "isotp", "rx_first_frame", rx_addr=self._can_client.rx_addr, idx=self.rx_idx, done=self.rx_done)
+        eventlog.event(DEBUG, "isotp", "tx_flow_control_continue", tx_addr=self._can_client.tx_addr)
       # send flow control message
       self._can_client.send([self.flow_control_msg])
       return ISOTP_FRAME_TYPE.FIRST
@@ -549,7 +629,8 @@ class IsoTpMessage:
       elif self.single_frame_mode:
         # notify ECU to send next frame
         self._can_client.send([self.flow_control_msg])
-      carlog.debug(f"ISO-TP: RX - consecutive frame - {hex(self._can_client.rx_addr)} idx={self.rx_idx} done={self.rx_done}")
+      if eventlog.debug:
+        eventlog.event(DEBUG, "isotp", "rx_consecutive_frame", rx_addr=self._can_client.rx_addr, idx=self.rx_idx, done=self.rx_done)
       return ISOTP_FRAME_TYPE.CONSECUTIVE
 
     elif rx_data[0] >> 4 == ISOTP_FRAME_TYPE.FLOW:
@@ -557,31 +638,32 @@ class IsoTpMessage:
       assert rx_data[0] != 0x32, "isotp - rx: flow-control overflow/abort"
       assert rx_data[0] == 0x30 or rx_data[0] == 0x31, "isotp - rx: flow-control transfer state indicator invalid"
       if rx_data[0] == 0x30:
-        carlog.debug(f"ISO-TP: RX - flow control continue - {hex(self._can_client.tx_addr)}")
-        delay_ts = rx_data[2] & 0x7F
-        # scale is 1 milliseconds if first bit == 0, 100 micro seconds if first bit == 1
-        delay_div = 1000. if rx_data[2] & 0x80 == 0 else 10000.
-        delay_sec = delay_ts / delay_div
+        if eventlog.debug:
+          eventlog.event(DEBUG, "isotp", "rx_flow_control_continue", tx_addr=self._can_client.tx_addr)
+        delay_sec = get_separation_time(rx_data[2])
 
-        # first frame = 6 bytes, each consecutive frame = 7 bytes
+        # first frame = 6 bytes, each consecutive frame = 7 bytes (more with CAN FD)
         num_bytes = self.max_len - 1
-        start = self.max_len - 2 + self.tx_idx * num_bytes
+        start = self.tx_first_len + self.tx_idx * num_bytes
+        # the block size of the ECU, 0 means the rest of the message
         count = rx_data[1]
-        end = start + count * num_bytes if count > 0 else self.tx_len
+        end = min(start + count * num_bytes, self.tx_len) if count > 0 else self.tx_len
         tx_msgs = []
         for i in range(start, end, num_bytes):
           self.tx_idx += 1
           # consecutive tx messages
-          msg = (bytes([0x20 | (self.tx_idx & 0xF)]) + self.tx_dat[i:i + num_bytes]).ljust(self.max_len, b"\x00")
+          msg = self._pad(bytes([0x20 | (self.tx_idx & 0xF)]) + self.tx_dat[i:i + num_bytes])
           tx_msgs.append(msg)
         # send consecutive tx messages
         self._can_client.send(tx_msgs, delay=delay_sec)
         if end >= self.tx_len:
           self.tx_done = True
-        carlog.debug(f"ISO-TP: TX - consecutive frame - {hex(self._can_client.tx_addr)} idx={self.tx_idx} done={self.tx_done}")
+        if eventlog.debug:
+          eventlog.event(DEBUG, "isotp", "tx_consecutive_frame", tx_addr=self._can_client.tx_addr, idx=self.tx_idx, done=self.tx_done)
       elif rx_data[0] == 0x31:
         # wait (do nothing until next flow control message)
-        carlog.debug(f"ISO-TP: TX - flow control wait - {hex(self._can_client.tx_addr)}")
+        if eventlog.debug:
+          eventlog.event(DEBUG, "isotp", "tx_flow_control_wait", tx_addr=self._can_client.tx_addr)
       return ISOTP_FRAME_TYPE.FLOW
 
     # 4-15 - reserved
@@ -592,6 +674,28 @@ class IsoTpMessage:
 FUNCTIONAL_ADDRS = [0x7DF, 0x18DB33F1]
 
 
+class AsyncIsoTpMessage(IsoTpMessage):
+  """IsoTpMessage fed by a listener of an AsyncCanTransport, awaiting frames instead of polling for them.
+  The CAN client has to receive from the listener"""
+
+  def __init__(self, can_client: CanClient, listener: CanListener, timeout: float = 1, single_frame_mode: bool = False,
+               separation_time: float = 0, tx_dl: int = 8):
+    super().__init__(can_client, timeout, single_frame_mode, separation_time, tx_dl)
+    self._listener = listener
+
+  async def recv_async(self, timeout: float | None = None) -> bytes:
+    if timeout is None:
+      timeout = self.timeout
+
+    while True:
+      dat, _ = self.recv(timeout=0)
+      if dat is not None:
+        return dat
+      # like recv, the timeout restarts with every frame
+      if not await self._listener.wait(timeout):
+        eventlog.count("isotp", "timeout")
+        raise MessageTimeoutError("timeout waiting for response")
+
 def get_rx_addr_for_tx_addr(tx_addr, rx_offset=0x8):
   if tx_addr in FUNCTIONAL_ADDRS:
     return None
@@ -612,27 +716,24 @@ def get_rx_addr_for_tx_addr(tx_addr, rx_offset=0x8):
 
 class UdsClient:
   def __init__(self, panda, tx_addr: int, rx_addr: int | None = None, bus: int = 0, sub_addr: int | None = None, rx_sub_addr: int | None = None,
-               timeout: float = 1, tx_timeout: float = 1, response_pending_timeout: float = 10):
+               timeout: float = 1, tx_timeout: float = 1, response_pending_timeout: float = 10, tx_dl: int = 8):
     self.bus = bus
     self.tx_addr = tx_addr
     self.rx_addr = rx_addr if rx_addr is not None else get_rx_addr_for_tx_addr(tx_addr)
     self.sub_addr = sub_addr
     self.timeout = timeout
     can_send_with_timeout = partial(panda.can_send, timeout=int(tx_timeout*1000))
-    self._can_client = CanClient(can_send_with_timeout, panda.can_recv, self.tx_addr, self.rx_addr, self.bus, self.sub_addr, rx_sub_addr)
+    can_send_many = partial(panda.can_send_many, timeout=int(tx_timeout*1000)) if hasattr(panda, "can_send_many") else None
+    self._can_client = CanClient(can_send_with_timeout, panda.can_recv, self.tx_addr, self.rx_addr, self.bus, self.sub_addr, rx_sub_addr,
+                                 can_send_many=can_send_many)
     self.response_pending_timeout = response_pending_timeout
+    self.tx_dl = tx_dl
 
   # generic uds request
   def _uds_request(self, service_type: SERVICE_TYPE, subfunction: int | None = None, data: bytes | None = None) -> bytes:
-    req = bytes([service_type])
-    if subfunction is not None:
-      req += bytes([subfunction])
-    if data is not None:
-      req += data
-
     # send request, wait for response
-    isotp_msg = IsoTpMessage(self._can_client, timeout=self.timeout)
-    isotp_msg.send(req)
+    isotp_msg = IsoTpMessage(self._can_client, timeout=self.timeout, tx_dl=self.tx_dl)
+    isotp_msg.send(_uds_request_data(service_type, subfunction, data))
     response_pending = False
     while True:
       timeout = self.response_pending_timeout if response_pending else self.timeout
@@ -641,41 +742,11 @@ class UdsClient:
       if resp is None:
         continue
 
-      response_pending = False
-      resp_sid = resp[0] if len(resp) > 0 else None
-
-      # negative response
-      if resp_sid == 0x7F:
-        service_id = resp[1] if len(resp) > 1 else -1
-        try:
-          service_desc = SERVICE_TYPE(service_id).name
-        except BaseException:
-          service_desc = 'NON_STANDARD_SERVICE'
-        error_code = resp[2] if len(resp) > 2 else -1
-        try:
-          error_desc = _negative_response_codes[error_code]
-        except BaseException:
-          error_desc = resp[3:].hex()
-        # wait for another message if response pending
-        if error_code == 0x78:
-          response_pending = True
-          carlog.debug("UDS-RX: response pending")
-          continue
-        raise NegativeResponseError(f'{service_desc} - {error_desc}', service_id, error_code)
-
-      # positive response
-      if service_type + 0x40 != resp_sid:
-        resp_sid_hex = hex(resp_sid) if resp_sid is not None else None
-        raise InvalidServiceIdError(f'invalid response service id: {resp_sid_hex}')
-
-      if subfunction is not None:
-        resp_sfn = resp[1] if len(resp) > 1 else None
-        if subfunction != resp_sfn:
-          resp_sfn_hex = hex(resp_sfn) if resp_sfn is not None else None
-          raise InvalidSubFunctionError(f'invalid response subfunction: {resp_sfn_hex}')
-
-      # return data (exclude service id and sub-function id)
-      return resp[(1 if subfunction is None else 2):]
+      resp_data = _uds_response_data(resp, service_type, subfunction)
+      # wait for another message if response pending
+      response_pending = resp_data is None
+      if resp_data is not None:
+        return resp_data
 
   # services
   def diagnostic_session_control(self, session_type: SESSION_TYPE):
@@ -973,3 +1044,230 @@ class UdsClient:
 
   def request_transfer_exit(self):
     self._uds_request(SERVICE_TYPE.REQUEST_TRANSFER_EXIT, subfunction=None)
+
+  def transfer_data_stream(self, blocks: Iterable[bytes], block_sequence_count: int = 1) -> TransferStats:
+    # the next block is taken from the iterable in the background while the current one is sent,
+    # so a slow source (reading or decompressing an image) overlaps with the bus
+    start_time = time.monotonic()
+    size = 0
+    count = 0
+    with ThreadPoolExecutor(max_workers=1) as pool:
+      it = iter(blocks)
+      next_block = pool.submit(next, it, None)
+      while (block := next_block.result()) is not None:
+        next_block = pool.submit(next, it, None)
+        self.transfer_data(block_sequence_count, block)
+        size += len(block)
+        count += 1
+        # 1, 2, ..., 0xFF, 0, 1, ...
+        block_sequence_count = (block_sequence_count + 1) & 0xFF
+
+    stats = TransferStats(size, count, time.monotonic() - start_time)
+    carlog.debug(f"UDS: transferred {size} bytes in {count} blocks, {stats.bytes_per_second:.0f} bytes/s")
+    return stats
+
+  def download_data(self, memory_address: int, data: bytes | Iterable[bytes], memory_size: int | None = None,
+                    memory_address_bytes: int = 4, memory_size_bytes: int = 4, data_format: int = 0x00) -> TransferStats:
+    """Request download, transfer data in blocks of the maximum length the ECU accepts, and request transfer exit.
+    data can also be an iterable of chunks of any size, memory_size is needed then. If the chunks don't add up to
+    memory_size, nothing past it is sent and the transfer is still exited before raising."""
+    if isinstance(data, (bytes, bytearray)):
+      if memory_size is not None and memory_size != len(data):
+        raise ValueError(f'memory_size {memory_size} does not match {len(data)} bytes of data')
+      memory_size = len(data)
+    elif memory_size is None:
+      raise ValueError('memory_size is missing')
+
+    max_num_bytes = self.request_download(memory_address, memory_size, memory_address_bytes, memory_size_bytes, data_format)
+    try:
+      stats = self.transfer_data_stream(_blocks(data, _transfer_block_len(max_num_bytes), memory_size))
+      if stats.size != memory_size:
+        raise ValueError(f'transferred {stats.size} bytes, expected {memory_size}')
+    except ValueError:
+      # the ECU may reject exiting an incomplete transfer, the size mismatch is the error worth raising
+      try:
+        self.request_transfer_exit()
+      except NegativeResponseError:
+        pass
+      raise
+    self.request_transfer_exit()
+    return stats
+
+  def upload_data(self, memory_address: int, memory_size: int, memory_address_bytes: int = 4, memory_size_bytes: int = 4,
+                  data_format: int = 0x00) -> tuple[bytes, TransferStats]:
+    """Request upload, transfer data until memory_size bytes arrived, and request transfer exit"""
+    self.request_upload(memory_address, memory_size, memory_address_bytes, memory_size_bytes, data_format)
+
+    start_time = time.monotonic()
+    dat = bytearray()
+    block_sequence_count = 1
+    count = 0
+    while len(dat) < memory_size:
+      block = self.transfer_data(block_sequence_count)
+      if len(block) == 0:
+        raise ValueError('empty transfer data response')
+      dat += block
+      count += 1
+      block_sequence_count = (block_sequence_count + 1) & 0xFF
+    stats = TransferStats(len(dat), count, time.monotonic() - start_time)
+    carlog.debug(f"UDS: transferred {len(dat)} bytes in {count} blocks, {stats.bytes_per_second:.0f} bytes/s")
+
+    self.request_transfer_exit()
+    return bytes(dat[:memory_size]), stats
+
+  def read_memory(self, memory_address: int, memory_size: int, block_len: int = 0xFFE, memory_address_bytes: int = 4,
+                  memory_size_bytes: int = 2) -> tuple[bytes, TransferStats]:
+    """Reads memory_size bytes in read memory by address requests of up to block_len bytes,
+    the default is the most that fits in one ISO-TP response"""
+    block_len = min(block_len, 0xFFE, (1 << (memory_size_bytes * 8)) - 1)
+    start_time = time.monotonic()
+    dat = bytearray()
+    for addr in range(memory_address, memory_address + memory_size, block_len):
+      dat += self.read_memory_by_address(addr, min(block_len, memory_address + memory_size - addr), memory_address_bytes, memory_size_bytes)
+    stats = TransferStats(len(dat), -(-memory_size // block_len), time.monotonic() - start_time)
+    carlog.debug(f"UDS: read {len(dat)} bytes in {stats.blocks} blocks, {stats.bytes_per_second:.0f} bytes/s")
+    return bytes(dat), stats
+
+
+class AsyncUdsClient:
+  """UdsClient over an AsyncCanTransport, so requests to several ECUs can run on one event loop.
+  Has the services used while starting up, request() sends any other"""
+
+  def __init__(self, transport: AsyncCanTransport, tx_addr: int, rx_addr: int | None = None, bus: int = 0, sub_addr: int | None = None,
+               rx_sub_addr: int | None = None, timeout: float = 1, response_pending_timeout: float = 10, tx_dl: int = 8):
+    self.transport = transport
+    self.bus = bus
+    self.tx_addr = tx_addr
+    self.rx_addr = rx_addr if rx_addr is not None else get_rx_addr_for_tx_addr(tx_addr)
+    self.sub_addr = sub_addr
+    self.timeout = timeout
+    self._can_client = CanClient(self._can_send, list, self.tx_addr, self.rx_addr, self.bus, self.sub_addr, rx_sub_addr,
+                                 can_send_many=self._can_send_many)
+    self.response_pending_timeout = response_pending_timeout
+    self.tx_dl = tx_dl
+
+  def _can_send(self, addr: int, dat: bytes, bus: int) -> None:
+    self.transport.send([CanData(addr, dat, bus)])
+
+  def _can_send_many(self, msgs: list[tuple[int, bytes, int]]) -> None:
+    self.transport.send([CanData(addr, dat, bus) for addr, dat, bus in msgs])
+
+  def _accept(self, msg: CanData) -> bool:
+    # any response to a functional address, the CAN client switches to the first ECU to answer
+    return msg.src == self.bus and (msg.address == self._can_client.rx_addr or self._can_client.tx_addr in FUNCTIONAL_ADDRS)
+
+  async def request(self, service_type: SERVICE_TYPE, subfunction: int | None = None, data: bytes | None = None) -> bytes:
+    with self.transport.listen(self._accept) as listener:
+      self._can_client.rx = listener.get
+      isotp_msg = AsyncIsoTpMessage(self._can_client, listener, timeout=self.timeout, tx_dl=self.tx_dl)
+      isotp_msg.send(_uds_request_data(service_type, subfunction, data))
+      timeout = self.timeout
+      while (resp_data := _uds_response_data(await isotp_msg.recv_async(timeout), service_type, subfunction)) is None:
+        # wait for another message if response pending
+        timeout = self.response_pending_timeout
+      return resp_data
+
+  # services
+  async def diagnostic_session_control(self, session_type: SESSION_TYPE):
+    await self.request(SERVICE_TYPE.DIAGNOSTIC_SESSION_CONTROL, subfunction=session_type)
+
+  async def ecu_reset(self, reset_type: RESET_TYPE):
+    resp = await self.request(SERVICE_TYPE.ECU_RESET, subfunction=reset_type)
+    if reset_type == RESET_TYPE.ENABLE_RAPID_POWER_SHUTDOWN:
+      return resp[0]
+
+  async def tester_present(self):
+    await self.request(SERVICE_TYPE.TESTER_PRESENT, subfunction=0x00)
+
+  async def read_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE):
+    data = struct.pack('!H', data_identifier_type)
+    resp = await self.request(SERVICE_TYPE.READ_DATA_BY_IDENTIFIER, subfunction=None, data=data)
+    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
+    if resp_id != data_identifier_type:
+      raise ValueError(f'invalid response data identifier: {hex(resp_id)} expected: {hex(data_identifier_type)}')
+    return resp[2:]
+
+  async def write_data_by_identifier(self, data_identifier_type: DATA_IDENTIFIER_TYPE, data_record: bytes):
+    data = struct.pack('!H', data_identifier_type) + data_record
+    resp = await self.request(SERVICE_TYPE.WRITE_DATA_BY_IDENTIFIER, subfunction=None, data=data)
+    resp_id = struct.unpack('!H', resp[0:2])[0] if len(resp) >= 2 else None
+    if resp_id != data_identifier_type:
+      raise ValueError(f'invalid response data identifier: {hex(resp_id)}')
+
+def _uds_request_data(service_type: SERVICE_TYPE, subfunction: int | None = None, data: bytes | None = None) -> bytes:
+  req = bytes([service_type])
+  if subfunction is not None:
+    req += bytes([subfunction])
+  if data is not None:
+    req += data
+  return req
+
+
+def _uds_response_data(resp: bytes, service_type: SERVICE_TYPE, subfunction: int | None = None) -> bytes | None:
+  """Data of a positive response, None if the ECU asks to wait for it (response pending)"""
+  resp_sid = resp[0] if len(resp) > 0 else None
+
+  # negative response
+  if resp_sid == 0x7F:
+    service_id = resp[1] if len(resp) > 1 else -1
+    try:
+      service_desc = SERVICE_TYPE(service_id).name
+    except BaseException:
+      service_desc = 'NON_STANDARD_SERVICE'
+    error_code = resp[2] if len(resp) > 2 else -1
+    try:
+      error_desc = _negative_response_codes[error_code]
+    except BaseException:
+      error_desc = resp[3:].hex()
+    if error_code == 0x78:
+      carlog.debug("UDS-RX: response pending")
+      return None
+    raise NegativeResponseError(f'{service_desc} - {error_desc}', service_id, error_code)
+
+  # positive response
+  if service_type + 0x40 != resp_sid:
+    resp_sid_hex = hex(resp_sid) if resp_sid is not None else None
+    raise InvalidServiceIdError(f'invalid response service id: {resp_sid_hex}')
+
+  if subfunction is not None:
+    resp_sfn = resp[1] if len(resp) > 1 else None
+    if subfunction != resp_sfn:
+      resp_sfn_hex = hex(resp_sfn) if resp_sfn is not None else None
+      raise InvalidSubFunctionError(f'invalid response subfunction: {resp_sfn_hex}')
+
+  # return data (exclude service id and sub-function id)
+  return resp[(1 if subfunction is None else 2):]
+
+
+def _transfer_block_len(max_num_bytes: int) -> int:
+  # the max number of bytes includes the service id and block sequence counter, and the request must fit in one ISO-TP message
+  block_len = min(max_num_bytes, 0xFFF) - 2
+  if block_len < 1:
+    raise ValueError(f'invalid max_num_bytes: {max_num_bytes}')
+  return block_len
+
+
+def _blocks(data: bytes | Iterable[bytes], block_len: int, size: int | None = None) -> Iterator[bytes]:
+  if isinstance(data, (bytes, bytearray)):
+    for i in range(0, len(data), block_len):
+      yield bytes(data[i:i + block_len])
+    return
+
+  # with more data than size, the blocks stop at size and raise after the last one
+  total = 0
+  buf = bytearray()
+  for chunk in data:
+    surplus = size is not None and total + len(chunk) > size
+    if surplus:
+      chunk = chunk[:size - total]
+    total += len(chunk)
+    buf += chunk
+    while len(buf) >= block_len:
+      yield bytes(buf[:block_len])
+      del buf[:block_len]
+    if surplus:
+      if buf:
+        yield bytes(buf)
+      raise ValueError(f'data is longer than memory_size {size}')
+  if buf:
+    yield bytes(buf)
@@ -14,7 +14,6 @@ A depends on longitudinal speed, u [m/s], and vehicle parameters CP
 """
 
 import numpy as np
-from numpy.linalg import solve
 
 from opendbc.car.structs import CarParams
 from opendbc.car import ACCELERATION_DUE_TO_GRAVITY
@@ -44,6 +43,11 @@ class VehicleModel:
     self.cR: float = stiffness_factor * self.cR_orig
     self.sR: float = steer_ratio
 
+    # cache terms that only depend on the parameters above, these are invalidated here
+    self.sf: float = calc_slip_factor(self)
+    self._roll_comp: bool = abs(self.sf) >= 1e-6
+    self._inv_sf: float = 1 / self.sf if self._roll_comp else 0.
+
   def steady_state_sol(self, sa: float, u: float, roll: float) -> np.ndarray:
     """Returns the steady state solution.
 
@@ -63,6 +67,25 @@ class VehicleModel:
     else:
       return kin_ss_sol(sa, u, self)
 
+  def steady_state_sol_batch(self, sa: np.ndarray, u: np.ndarray, roll: np.ndarray) -> np.ndarray:
+    """Vectorized steady_state_sol over arrays of inputs, see steady_state_sol.
+
+    Args:
+      sa: Steering wheel angles [rad]
+      u: Speeds [m/s]
+      roll: Road Rolls [rad]
+
+    Returns:
+      2xN matrix with steady state solutions (lateral speed, rotational speed)
+    """
+    sa, u, roll = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in (sa, u, roll)))
+    dyn = u > 0.1
+    # avoid dividing by zero in the discarded dynamic branch
+    u_dyn = np.where(dyn, u, 1.)
+    v_dyn, r_dyn = _dyn_ss_sol(sa, u_dyn, roll, self)
+    v_kin, r_kin = _kin_ss_sol(sa, u, self)
+    return np.stack((np.where(dyn, v_dyn, v_kin), np.where(dyn, r_dyn, r_kin)))
+
   def calc_curvature(self, sa: float, u: float, roll: float) -> float:
     """Returns the curvature. Multiplied by the speed this will give the yaw rate.
 
@@ -86,8 +109,7 @@ class VehicleModel:
     Returns:
       Curvature factor [1/m]
     """
-    sf = calc_slip_factor(self)
-    return (1. - self.chi) / (1. - sf * u**2) / self.l
+    return (1. - self.chi) / (1. - self.sf * u**2) / self.l
 
   def get_steer_from_curvature(self, curv: float, u: float, roll: float) -> float:
     """Calculates the required steering wheel angle for a given curvature
@@ -113,12 +135,10 @@ class VehicleModel:
     Returns:
       Roll compensation curvature [1/m]
     """
-    sf = calc_slip_factor(self)
-
-    if abs(sf) < 1e-6:
+    if not self._roll_comp:
       return 0
     else:
-      return (ACCELERATION_DUE_TO_GRAVITY * roll) / ((1 / sf) - u**2)
+      return (ACCELERATION_DUE_TO_GRAVITY * roll) / (self._inv_sf - u**2)
 
   def get_steer_from_yaw_rate(self, yaw_rate: float, u: float, roll: float) -> float:
     """Calculates the required steering wheel angle for a given yaw_rate
@@ -147,6 +167,35 @@ class VehicleModel:
     """
     return self.calc_curvature(sa, u, roll) * u
 
+  def calc_curvature_batch(self, sa: np.ndarray, u: np.ndarray, roll: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Vectorized calc_curvature and yaw_rate over arrays of inputs.
+
+    Args:
+      sa: Steering wheel angles [rad]
+      u: Speeds [m/s]
+      roll: Road Rolls [rad]
+
+    Returns:
+      Tuple of curvatures [1/m] and yaw rates [rad/s]
+    """
+    sa, u, roll = (np.asarray(x, dtype=np.float64) for x in (sa, u, roll))
+    curvature = (self.curvature_factor(u) * sa / self.sR) + self.roll_compensation(roll, u)
+    return curvature, curvature * u
+
+  def get_steer_from_curvature_batch(self, curv: np.ndarray, u: np.ndarray, roll: np.ndarray) -> np.ndarray:
+    """Vectorized get_steer_from_curvature over arrays of inputs.
+
+    Args:
+      curv: Desired curvatures [1/m]
+      u: Speeds [m/s]
+      roll: Road Rolls [rad]
+
+    Returns:
+      Steering wheel angles [rad]
+    """
+    curv, u, roll = (np.asarray(x, dtype=np.float64) for x in (curv, u, roll))
+    return self.get_steer_from_curvature(curv, u, roll)
+
 
 def kin_ss_sol(sa: float, u: float, VM: VehicleModel) -> np.ndarray:
   """Calculate the steady state solution at low speeds
@@ -161,10 +210,12 @@ def kin_ss_sol(sa: float, u: float, VM: VehicleModel) -> np.ndarray:
   Returns:
     2x1 matrix with steady state solution
   """
-  K = np.zeros((2, 1))
-  K[0, 0] = VM.aR / VM.sR / VM.l * u
-  K[1, 0] = 1. / VM.sR / VM.l * u
-  return K * sa
+  v, r = _kin_ss_sol(sa, u, VM)
+  return np.array([[v], [r]])
+
+
+def _kin_ss_sol(sa, u, VM: VehicleModel):
+  return VM.aR / VM.sR / VM.l * u * sa, 1. / VM.sR / VM.l * u * sa
 
 
 def create_dyn_state_matrices(u: float, VM: VehicleModel) -> tuple[np.ndarray, np.ndarray]:
@@ -217,9 +268,23 @@ def dyn_ss_sol(sa: float, u: float, roll: float, VM: VehicleModel) -> np.ndarray
   Returns:
     2x1 matrix with steady state solution
   """
-  A, B = create_dyn_state_matrices(u, VM)
-  inp = np.array([[sa], [roll]])
-  return -solve(A, B) @ inp
+  v, r = _dyn_ss_sol(sa, u, roll, VM)
+  return np.array([[v], [r]])
+
+
+def _dyn_ss_sol(sa, u, roll, VM: VehicleModel):
+  """Closed form of -A^{-1} B u for the 2x2 system from create_dyn_state_matrices,
+  works on scalars and element-wise on arrays."""
+  a11 = - (VM.cF + VM.cR) / (VM.m * u)
+  a12 = - (VM.cF * VM.aF - VM.cR * VM.aR) / (VM.m * u) - u
+  a21 = - (VM.cF * VM.aF - VM.cR * VM.aR) / (VM.j * u)
+  a22 = - (VM.cF * VM.aF**2 + VM.cR * VM.aR**2) / (VM.j * u)
+
+  b1 = (VM.cF + VM.chi * VM.cR) / VM.m / VM.sR * sa - ACCELERATION_DUE_TO_GRAVITY * roll
+  b2 = (VM.cF * VM.aF - VM.chi * VM.cR * VM.aR) / VM.j / VM.sR * sa
+
+  det = a11 * a22 - a12 * a21
+  return (a12 * b2 - a22 * b1) / det, (a21 * b1 - a11 * b2) / det
 
 
 def calc_slip_factor(VM: VehicleModel) -> float:
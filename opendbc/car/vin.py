@@ -2,8 +2,9 @@ import re
 from dataclasses import dataclass, field
 
 from opendbc.car import uds
+from opendbc.car.can_transport import AsyncCanTransport
 from opendbc.car.carlog import carlog
-from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
+from opendbc.car.isotp_parallel_query import QueryGenerator, QueryParams, run_queries, run_queries_async
 from opendbc.car.fw_query_definitions import STANDARD_VIN_ADDRS, StdQueries
 
 VIN_UNKNOWN = "0" * 17
@@ -30,6 +31,18 @@ def is_valid_vin(vin: str):
 
 
 def get_vin(can_recv, can_send, buses, timeout=0.1, retry=2):
+  found: list[tuple[int, int, str]] = []
+  run_queries(_vin_queries(found, buses, retry), can_send, can_recv, timeout)
+  return found[0] if found else (-1, -1, VIN_UNKNOWN)
+
+
+async def get_vin_async(transport: AsyncCanTransport, buses, timeout=0.1, retry=2):
+  found: list[tuple[int, int, str]] = []
+  await run_queries_async(_vin_queries(found, buses, retry), transport, timeout)
+  return found[0] if found else (-1, -1, VIN_UNKNOWN)
+
+
+def _vin_queries(found: list[tuple[int, int, str]], buses, retry) -> QueryGenerator:
   for i in range(retry):
     for bus in buses:
       for request, response, valid_buses, vin_addrs, functional_addrs, rx_offset in (
@@ -50,9 +63,7 @@ def get_vin(can_recv, can_send, buses, timeout=0.1, retry=2):
           tx_addrs = [a for a in range(0x700, 0x800) if a != 0x7DF] + list(range(0x18DA00F1, 0x18DB00F1, 0x100))
 
         try:
-          query = IsoTpParallelQuery(can_send, can_recv, bus, tx_addrs, [request, ], [response, ], response_offset=rx_offset,
-                                     functional_addrs=functional_addrs)
-          results = query.get_data(timeout)
+          results = yield QueryParams(bus, tx_addrs, [request, ], [response, ], response_offset=rx_offset, functional_addrs=functional_addrs)
 
           for addr in vin_addrs:
             vin = results.get((addr, None))
@@ -66,10 +77,9 @@ def get_vin(can_recv, can_send, buses, timeout=0.1, retry=2):
                 vin = vin[1:18]
 
               carlog.error(f"got vin with {request=}, {bus=}")
-              return uds.get_rx_addr_for_tx_addr(addr, rx_offset=rx_offset), bus, vin.decode()
+              found.append((uds.get_rx_addr_for_tx_addr(addr, rx_offset=rx_offset), bus, vin.decode()))
+              return
         except Exception:
           carlog.exception("VIN query exception")
 
     carlog.error(f"vin query retry ({i+1}) ...")
-
-  return -1, -1, VIN_UNKNOWN
@@ -19,6 +19,7 @@ PSD_TYPE_CURV_SPEED = 2
 PSD_CURV_SPEED_DECAY = 4
 PSD_UNIT_KPH = 0
 PSD_UNIT_MPH = 1
+SPEED_BUCKET_MS = 0.25 # predicative search is only rerun for changed segments or when ego speed leaves its bucket
 
 
 class SpeedLimitManager:
@@ -37,6 +38,10 @@ class SpeedLimitManager:
     self.predicative_speed_limit = predicative_speed_limit
     self.predicative_curve = predicative_curve
     self.predicative_segments = {}
+    self.predicative_segment_children = {} # parent ID -> child IDs, kept in sync with "ID_Prev" of predicative_segments
+    self.predicative_segments_version = 0 # bumped on any segment change relevant for the predicative search
+    self.predicative_path_cache = (None, [])
+    self.predicative_search_cache = (None, None)
     self.current_predicative_segment = {"ID": NOT_SET, "Length": NOT_SET, "Speed": NOT_SET, "StreetType": NOT_SET, "OnRampExit": NOT_SET}
     self.v_limit_psd_next_last_timestamp = 0
     self.v_limit_psd_next_last = NOT_SET
@@ -85,7 +90,7 @@ class SpeedLimitManager:
       self._receive_speed_limit_psd_legal(psd_06)
       self._get_speed_limit_psd()
       if self.predicative:
-        self._get_speed_limit_psd_next(current_speed_ms) # this is very cpu heavy
+        self._get_speed_limit_psd_next(current_speed_ms)
 
   def get_speed_limit_predicative(self):
     v_limit_output = self.v_limit_psd_next if self.predicative and self.v_limit_psd_next != NOT_SET and self.v_limit_psd_next < self.v_limit_output_last else NOT_SET
@@ -214,43 +219,46 @@ class SpeedLimitManager:
         psd_04["PSD_Segment_ID"] != NOT_SET):
 
       segment_id = psd_04["PSD_Segment_ID"]
+      curvature_begin = self._get_segment_curvature_psd(psd_04["PSD_Anfangskruemmung"], psd_04["PSD_Anfangskruemmung_Vorz"])
+      curvature_end = self._get_segment_curvature_psd(psd_04["PSD_Endkruemmung"], psd_04["PSD_Endkruemmung_Vorz"])
+      seg_data = {
+        "Length": psd_04["PSD_Segmentlaenge"],
+        "Curvature_Begin": curvature_begin,
+        "Curvature_End": curvature_end,
+        "StreetType": self._get_street_type(psd_04["PSD_Strassenkategorie"], psd_04["PSD_Bebauung"]),
+        "OnRampExit": psd_04["PSD_Rampe"] in (1, 2),
+        "ID_Prev": psd_04["PSD_Vorgaenger_Segment_ID"],
+        "Curve_Speed_Begin": self._calculate_curve_speed(curvature_begin),
+        "Curve_Speed_End": self._calculate_curve_speed(curvature_end),
+      }
+
       seg = self.predicative_segments.get(segment_id)
       if seg:
-        seg["Length"] = psd_04["PSD_Segmentlaenge"]
-        seg["Curvature_Begin"] = self._get_segment_curvature_psd(psd_04["PSD_Anfangskruemmung"], psd_04["PSD_Anfangskruemmung_Vorz"])
-        seg["Curvature_End"] = self._get_segment_curvature_psd(psd_04["PSD_Endkruemmung"], psd_04["PSD_Endkruemmung_Vorz"])
-        seg["StreetType"] = self._get_street_type(psd_04["PSD_Strassenkategorie"], psd_04["PSD_Bebauung"])
-        seg["OnRampExit"] = psd_04["PSD_Rampe"] in (1, 2)
-        seg["ID_Prev"] = psd_04["PSD_Vorgaenger_Segment_ID"]
-        seg["Curve_Speed_Begin"] = self._calculate_curve_speed(seg["Curvature_Begin"])
-        seg["Curve_Speed_End"] = self._calculate_curve_speed(seg["Curvature_End"])
+        # the same segment is received repeatedly, only invalidate the search when its data changed
+        if any(seg[key] != value for key, value in seg_data.items()):
+          self._link_segment_psd(segment_id, seg["ID_Prev"], seg_data["ID_Prev"])
+          seg.update(seg_data)
+          self.predicative_segments_version += 1
         seg["Timestamp"] = now
       else:
         self.predicative_segments[segment_id] = {
           "ID": segment_id,
-          "Length": psd_04["PSD_Segmentlaenge"],
-          "Curvature_Begin": self._get_segment_curvature_psd(psd_04["PSD_Anfangskruemmung"], psd_04["PSD_Anfangskruemmung_Vorz"]),
-          "Curvature_End": self._get_segment_curvature_psd(psd_04["PSD_Endkruemmung"], psd_04["PSD_Endkruemmung_Vorz"]),
-          "StreetType": self._get_street_type(psd_04["PSD_Strassenkategorie"], psd_04["PSD_Bebauung"]),
-          "OnRampExit": psd_04["PSD_Rampe"] in (1, 2),
-          "ID_Prev": psd_04["PSD_Vorgaenger_Segment_ID"],
+          **seg_data,
           "Speed": NOT_SET,
-          "Curve_Speed_Begin": NOT_SET,
-          "Curve_Speed_End": NOT_SET,
           "QualityFlag": False,
           "Timestamp": now
         }
-        seg = self.predicative_segments.get(segment_id)
-        seg["Curve_Speed_Begin"] = self._calculate_curve_speed(seg["Curvature_Begin"])
-        seg["Curve_Speed_End"] = self._calculate_curve_speed(seg["Curvature_End"])
+        self._link_segment_psd(segment_id, NOT_SET, seg_data["ID_Prev"])
+        self.predicative_segments_version += 1
 
     # Schritt 2: Alte Segmente bereinigen
     current_id = self.current_predicative_segment["ID"]
     if current_id != NOT_SET:
-      self.predicative_segments = {
-        sid: seg for sid, seg in self.predicative_segments.items()
-        if now - seg.get("Timestamp", 0) <= SEGMENT_DECAY
-      }
+      expired = [sid for sid, seg in self.predicative_segments.items() if now - seg.get("Timestamp", 0) > SEGMENT_DECAY]
+      for sid in expired:
+        self._link_segment_psd(sid, self.predicative_segments.pop(sid)["ID_Prev"], NOT_SET)
+      if expired:
+        self.predicative_segments_version += 1
 
     # Geschwindigkeit setzen (speed limits seen for changed limits only)
     if (psd_06["PSD_06_Mux"] == 2 and
@@ -261,11 +269,26 @@ class SpeedLimitManager:
       raw_speed = psd_06["PSD_Ges_Geschwindigkeit"] if self._speed_limit_is_valid_now_psd(psd_06, raining, time_car) else NOT_SET
       segment_id = psd_06["PSD_Ges_Segment_ID"]
 
-      if segment_id in self.predicative_segments:
-        speed = self._convert_raw_speed_psd(raw_speed, self.predicative_segments[segment_id]["StreetType"])
-        self.predicative_segments[segment_id]["Speed"] = speed
-        self.predicative_segments[segment_id]["Speed_Type"] = PSD_TYPE_SPEED_LIMIT
-        self.predicative_segments[segment_id]["QualityFlag"] = True
+      seg = self.predicative_segments.get(segment_id)
+      if seg:
+        speed = self._convert_raw_speed_psd(raw_speed, seg["StreetType"])
+        if (seg["Speed"], seg.get("Speed_Type"), seg["QualityFlag"]) != (speed, PSD_TYPE_SPEED_LIMIT, True):
+          seg["Speed"] = speed
+          seg["Speed_Type"] = PSD_TYPE_SPEED_LIMIT
+          seg["QualityFlag"] = True
+          self.predicative_segments_version += 1
+
+  def _link_segment_psd(self, segment_id, parent_old, parent_new):
+    # keep the parent -> children index in sync, instead of scanning all segments for children
+    if parent_old not in (None, NOT_SET):
+      children = self.predicative_segment_children.get(parent_old)
+      if children is not None:
+        children.discard(segment_id)
+        if not children:
+          del self.predicative_segment_children[parent_old]
+
+    if parent_new not in (None, NOT_SET):
+      self.predicative_segment_children.setdefault(parent_new, set()).add(segment_id)
 
   def _get_time_from_vw_datetime(self, time_car):
     if time_car:
@@ -389,15 +412,7 @@ class SpeedLimitManager:
     v_req_ms = v_b + r * s_hit
     return float(s_hit), (v_req_ms * CV.MS_TO_KPH)
 
-  def _dfs(self, seg_id, total_dist, visited, current_speed_ms, best_result, path):
-    if seg_id in visited or seg_id not in path:
-      return
-    visited.add(seg_id)
-  
-    seg = self.predicative_segments.get(seg_id)
-    if not seg:
-      return
-      
+  def _check_segment_psd(self, seg, total_dist, current_speed_ms, best_result):
     candidates = []
 
     length = seg.get("Length", NOT_SET)
@@ -458,39 +473,45 @@ class SpeedLimitManager:
           best_result["dist"] = dist_to_activation # represents distance to limit
           best_result["length"] = length - activation_offset # represents remaining distance with limit for curves
 
-    children = [sid for sid, s in self.predicative_segments.items() if s.get("ID_Prev") == seg_id]
-    if len(children) > 1:
-      return  # Split detected, can not decide unique limit on current path
-  
-    for next_id in children:
+  def _search_path_psd(self, path, current_speed_ms):
+    best_result = {"limit": float('inf'), "type": NOT_SET, "dist": float('inf'), "length": float('inf')}
+
+    # the path ends at a split, so every segment on it has a unique successor
+    total_dist = 0
+    for seg_id in path:
+      seg = self.predicative_segments.get(seg_id)
+      if not seg:
+        break
+
+      self._check_segment_psd(seg, total_dist, current_speed_ms, best_result)
+
       if seg_id == self.current_predicative_segment.get("ID"):
-        next_length = self.current_predicative_segment.get("Length", 0)
+        total_dist += self.current_predicative_segment.get("Length", 0)
       else:
-        next_length = seg.get("Length", 0)
-        
-      self._dfs(next_id, total_dist + next_length, visited.copy(), current_speed_ms, best_result, path)
+        total_dist += seg.get("Length", 0)
+
+    return best_result
 
   def _build_path_psd(self, start_seg_id):
+    cache_key = (self.predicative_segments_version, start_seg_id)
+    if self.predicative_path_cache[0] == cache_key:
+      return self.predicative_path_cache[1]
+
     path = []
     current_id = start_seg_id
     visited = set()
 
-    segment_children_map = {}
-    for sid, seg in self.predicative_segments.items():
-      parent = seg.get("ID_Prev")
-      if parent not in (None, NOT_SET):
-        segment_children_map.setdefault(parent, []).append(sid)
-
     while current_id != NOT_SET:
       if current_id in visited:
         break
       visited.add(current_id)
       path.append(current_id)
-      children = segment_children_map.get(current_id, [])
+      children = self.predicative_segment_children.get(current_id, ())
       if len(children) != 1:
-        break 
-      current_id = children[0]
+        break # Split detected, can not decide unique limit on current path
+      current_id = next(iter(children))
 
+    self.predicative_path_cache = (cache_key, path)
     return path
 
   def _get_speed_limit_psd_next(self, current_speed_ms):      
@@ -505,8 +526,12 @@ class SpeedLimitManager:
     if len(path) <= 1:
       return
 
-    best_result = {"limit": float('inf'), "type": NOT_SET, "dist": float('inf'), "length": float('inf')}
-    self._dfs(current_id, 0, set(), current_speed_ms, best_result, path)
+    # the search result only depends on the segments, the current position and the ego speed bucket
+    cache_key = (self.predicative_segments_version, tuple(self.current_predicative_segment.values()), int(current_speed_ms // SPEED_BUCKET_MS),
+                 self.v_limit_output_last, self.predicative_speed_limit, self.predicative_curve)
+    if self.predicative_search_cache[0] != cache_key:
+      self.predicative_search_cache = (cache_key, self._search_path_psd(path, current_speed_ms))
+    best_result = self.predicative_search_cache[1]
 
     now = time.time()
     if best_result["limit"] != float('inf'):
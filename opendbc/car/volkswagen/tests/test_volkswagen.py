@@ -7,6 +7,7 @@ from opendbc.car.structs import CarParams
 from opendbc.car.volkswagen.carcontroller import HCAMitigation
 from opendbc.car.volkswagen.values import CAR, CarControllerParams as CCP, FW_QUERY_CONFIG, WMI
 from opendbc.car.volkswagen.fingerprints import FW_VERSIONS
+from opendbc.car.volkswagen.speed_limit_manager import SpeedLimitManager, PSD_TYPE_SPEED_LIMIT
 
 Ecu = CarParams.Ecu
 
@@ -29,6 +30,79 @@ class TestVolkswagenHCAMitigation(unittest.TestCase):
         expected_torque = actuator_value - (1, -1)[actuator_value < 0] if should_nudge else actuator_value
         assert hca_mitigation.update(actuator_value, actuator_value) == expected_torque, f"{frame=}"
 
+class TestVolkswagenSpeedLimitManager(unittest.TestCase):
+  @staticmethod
+  def _psd_04(segment_id, prev_id, length=200):
+    return {"PSD_ADAS_Qualitaet": 1, "PSD_wahrscheinlichster_Pfad": 1, "PSD_Segment_ID": segment_id, "PSD_Segmentlaenge": length,
+            "PSD_Anfangskruemmung": 0, "PSD_Anfangskruemmung_Vorz": 0, "PSD_Endkruemmung": 0, "PSD_Endkruemmung_Vorz": 0,
+            "PSD_Strassenkategorie": 3, "PSD_Bebauung": 0, "PSD_Rampe": 0, "PSD_Vorgaenger_Segment_ID": prev_id}
+
+  @staticmethod
+  def _psd_05(segment_id, length=20):
+    return {"PSD_Pos_Standort_Eindeutig": 1, "PSD_Pos_Segment_ID": segment_id, "PSD_Pos_Segmentlaenge": length}
+
+  @staticmethod
+  def _psd_06(segment_id=0, raw_speed=0):
+    return {"PSD_06_Mux": 2 if segment_id else 0, "PSD_Sys_Segment_ID": 0, "PSD_Sys_Geschwindigkeit_Einheit": 0, "PSD_Ges_Typ": 1,
+            "PSD_Ges_Gesetzlich_Kategorie": 0, "PSD_Ges_Segment_ID": segment_id, "PSD_Ges_Geschwindigkeit": raw_speed,
+            "PSD_Ges_Geschwindigkeit_Tag_Anf": 0, "PSD_Ges_Geschwindigkeit_Tag_Ende": 0, "PSD_Ges_Geschwindigkeit_Std_Anf": 25,
+            "PSD_Ges_Geschwindigkeit_Std_Ende": 25, "PSD_Ges_Geschwindigkeit_Witter": 0}
+
+  def _setup_path(self, segments):
+    CP = CarParams()
+    slm = SpeedLimitManager(CP, speed_limit_max_kph=130, predicative=True, predicative_speed_limit=True, predicative_curve=True)
+    slm.v_limit_output_last = 100
+    for segment_id, prev_id in segments:
+      slm.update(0, self._psd_04(segment_id, prev_id), self._psd_05(1), self._psd_06(), None, False, None)
+    return slm
+
+  def test_predicative_speed_limit(self):
+    slm = self._setup_path([(1, 0), (2, 1), (3, 2)])
+    self.assertEqual(slm.predicative_segment_children, {1: {2}, 2: {3}})
+
+    # 50 kph limit on the third segment, 20 m + 200 m ahead
+    slm.update(27, self._psd_04(3, 2), self._psd_05(1), self._psd_06(3, 11), None, False, None)
+    self.assertEqual(slm.v_limit_psd_next, 50)
+    self.assertEqual(slm.get_speed_limit_predicative_type(), PSD_TYPE_SPEED_LIMIT)
+
+    # split after the first segment, no unique path
+    slm.update(27, self._psd_04(4, 1), self._psd_05(1), self._psd_06(), None, False, None)
+    self.assertEqual(slm.predicative_segment_children, {1: {2, 4}, 2: {3}})
+    self.assertEqual(slm.v_limit_psd_next, 0)
+
+    # re-linking a segment updates the index
+    slm.update(27, self._psd_04(4, 3), self._psd_05(1), self._psd_06(), None, False, None)
+    self.assertEqual(slm.predicative_segment_children, {1: {2}, 2: {3}, 3: {4}})
+    self.assertEqual(slm.v_limit_psd_next, 50)
+
+  def test_search_cache(self):
+    slm = self._setup_path([(1, 0), (2, 1), (3, 2)])
+    slm.update(27, self._psd_04(3, 2), self._psd_05(1), self._psd_06(3, 11), None, False, None)
+
+    searches = 0
+    search_path_psd = slm._search_path_psd
+
+    def count_search(*args):
+      nonlocal searches
+      searches += 1
+      return search_path_psd(*args)
+    slm._search_path_psd = count_search
+
+    # repeated segment data and a speed within the same bucket reuse the result
+    for _ in range(10):
+      slm.update(27.01, self._psd_04(3, 2), self._psd_05(1), self._psd_06(3, 11), None, False, None)
+    self.assertEqual(searches, 0)
+    self.assertEqual(slm.v_limit_psd_next, 50)
+
+    # moving along the current segment reruns the search
+    slm.update(27.01, self._psd_04(3, 2), self._psd_05(1, 40), self._psd_06(3, 11), None, False, None)
+    self.assertEqual(searches, 1)
+
+    # as does a changed segment
+    slm.update(27.01, self._psd_04(2, 1, 100), self._psd_05(1, 40), self._psd_06(3, 11), None, False, None)
+    self.assertEqual(searches, 2)
+
+
 class TestVolkswagenPlatformConfigs(unittest.TestCase):
   def test_spare_part_fw_pattern(self):
     # Relied on for determining if a FW is likely VW
@@ -1,7 +1,12 @@
-import sys
 import time
 import struct
+from collections import deque
+from collections.abc import Callable
 from enum import IntEnum
+from typing import NamedTuple
+
+from opendbc.car.can_definitions import CanRecvCallable, CanSendCallable
+from opendbc.car.can_transport import CanTransport, panda_can_recv, panda_can_send
 
 
 class COMMAND_CODE(IntEnum):
@@ -99,6 +104,34 @@ class GET_ID_REQUEST_TYPE(IntEnum):
   # 128-255 user defined
 
 
+class START_STOP_MODE(IntEnum):
+  STOP = 0x00
+  START = 0x01
+  SELECT = 0x02
+
+
+class START_STOP_SYNCH_MODE(IntEnum):
+  STOP_ALL = 0x00
+  START_SELECTED = 0x01
+  STOP_SELECTED = 0x02
+
+
+class DaqEntry(NamedTuple):
+  addr: int
+  size: int
+  addr_ext: int = 0
+
+
+# called with the DAQ list number and the data of each of its entries, once all of its ODTs of a sample arrived
+DaqCallback = Callable[[int, list[bytes]], None]
+
+# packet identifiers of the responses, anything below is a DAQ packet with an absolute ODT number
+PID_RES = 0xFF
+PID_ERR = 0xFE
+PID_EV = 0xFD
+PID_SERV = 0xFC
+
+
 class CommandTimeoutError(Exception):
   pass
 
@@ -118,65 +151,101 @@ class CommandResponseError(Exception):
 
 
 class XcpClient:
-  def __init__(self, panda, tx_addr: int, rx_addr: int, bus: int=0, timeout: float=0.1, debug=False, pad=True):
+  def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, tx_addr: int, rx_addr: int, bus: int=0, timeout: float=0.1,
+               debug=False, pad=True):
     self.tx_addr = tx_addr
     self.rx_addr = rx_addr
     self.can_bus = bus
     self.timeout = timeout
     self.debug = debug
-    self._panda = panda
+    self._transport = CanTransport(can_send, can_recv, tx_addr, [rx_addr], bus, debug)
     self._byte_order = ">"
     self._max_cto = 8
     self._max_dto = 8
+    self._address_granularity = 1
+    self._slave_block_mode = False
+    # from GET_COMM_MODE_INFO, a queue size of 0 means no interleaved mode
+    self._master_block_mode = False
+    self._max_bs = 0
+    self._min_st = 0
+    self._queue_size = 0
     self.pad = pad
+    # set when a command timed out, its response may still arrive and is dropped before the next command
+    self._resync = False
 
-  def _send_cto(self, cmd: int, dat: bytes = b"") -> None:
+    # absolute ODT number -> (DAQ list, ODT), and the byte layout of the configured DAQ lists
+    self._daq_odts: dict[int, tuple[int, int]] = {}
+    self._daq_odt_sizes: list[list[int]] = []
+    self._daq_entry_sizes: list[list[int]] = []
+    self._daq_samples: dict[int, list[bytes]] = {}
+    self._daq_callback: DaqCallback | None = None
+
+  @classmethod
+  def from_panda(cls, panda, tx_addr: int, rx_addr: int, bus: int=0, **kwargs) -> 'XcpClient':
+    return cls(panda_can_send(panda), panda_can_recv(panda), tx_addr, rx_addr, bus, **kwargs)
+
+  def _cto(self, cmd: int, dat: bytes = b"") -> bytes:
     tx_data = (bytes([cmd]) + dat)
 
     # Some ECUs don't respond if the packets are not padded to 8 bytes
     if self.pad:
       tx_data = tx_data.ljust(8, b"\x00")
+    return tx_data
 
-    if self.debug:
-      print("CAN-CLEAR: TX")
-    self._panda.can_clear(self.can_bus)
-    if self.debug:
-      print("CAN-CLEAR: RX")
-    self._panda.can_clear(0xFFFF)
-    if self.debug:
-      print(f"CAN-TX: {hex(self.tx_addr)} - 0x{bytes.hex(tx_data)}")
-    self._panda.can_send(self.tx_addr, tx_data, self.can_bus)
+  def _send_ctos(self, ctos: list[bytes], separation_time: float = 0) -> None:
+    if self._resync:
+      self._transport.drain()
+      self._resync = False
 
-  def _recv_dto(self, timeout: float) -> bytes:
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-      msgs = self._panda.can_recv() or []
-      if len(msgs) >= 256:
-        print("CAN RX buffer overflow!!!", file=sys.stderr)
-      for rx_addr, rx_data, rx_bus in msgs:
-        if rx_bus == self.can_bus and rx_addr == self.rx_addr:
-          rx_data = bytes(rx_data)  # convert bytearray to bytes
-          if self.debug:
-            print(f"CAN-RX: {hex(rx_addr)} - 0x{bytes.hex(rx_data)}")
-
-          pid = rx_data[0]
-          if pid == 0xFE:
-            err = rx_data[1]
-            err_desc = ERROR_CODES.get(err, "unknown error")
-            dat = rx_data[2:]
-            raise CommandResponseError(f"{hex(err)} - {err_desc} {dat}", err)
-
-          return bytes(rx_data[1:])
-      time.sleep(0.001)
+    if separation_time == 0:
+      self._transport.send(ctos)
+      return
+    for i, cto in enumerate(ctos):
+      if i > 0:
+        time.sleep(separation_time)
+      self._transport.send([cto])
+
+  def _send_cto(self, cmd: int, dat: bytes = b"") -> None:
+    self._send_ctos([self._cto(cmd, dat)])
 
+  def _recv_dto(self, timeout: float) -> bytes:
+    deadline = time.monotonic() + timeout
+    while (msg := self._transport.recv(deadline - time.monotonic())) is not None:
+      rx_data = msg.dat
+      pid = rx_data[0]
+      if pid == PID_RES:
+        return rx_data[1:]
+      if pid == PID_ERR:
+        err = rx_data[1]
+        err_desc = ERROR_CODES.get(err, "unknown error")
+        dat = rx_data[2:]
+        raise CommandResponseError(f"{hex(err)} - {err_desc} {dat}", err)
+      if pid < PID_SERV:
+        self._handle_daq(rx_data)
+      elif self.debug:
+        print(f"XCP-{'EV' if pid == PID_EV else 'SERV'}: 0x{bytes.hex(rx_data)}")
+
+    self._resync = True
     raise CommandTimeoutError("timeout waiting for response")
 
+  def _recv_upload(self, size: int) -> bytes:
+    # in slave block mode, every packet of the block is a response with the data aligned to the address granularity
+    ag = self._address_granularity
+    resp = b""
+    while len(resp) < size * ag:
+      resp += self._recv_dto(self.timeout)[ag - 1:]
+    return resp[:size * ag] # trim off bytes with undefined values
+
   # commands
   def connect(self, connect_mode: CONNECT_MODE=CONNECT_MODE.NORMAL) -> dict:
+    # anything the slave sent before is stale
+    self._transport.drain()
+    self._resync = False
     self._send_cto(COMMAND_CODE.CONNECT, bytes([connect_mode]))
     resp = self._recv_dto(self.timeout)
     assert len(resp) == 7, f"incorrect data length: {len(resp)}"
     self._byte_order = ">" if resp[1] & 0x01 else "<"
+    self._address_granularity = 2**((resp[1] & 0x06) >> 1)
     self._slave_block_mode = resp[1] & 0x40 != 0
     self._max_cto = resp[2]
     self._max_dto = struct.unpack(f"{self._byte_order}H", resp[3:5])[0]
@@ -186,7 +255,7 @@ class XcpClient:
       "stim_support": resp[0] & 0x08 != 0,
       "pgm_support": resp[0] & 0x10 != 0,
       "byte_order": self._byte_order,
-      "address_granularity": 2**((resp[1] & 0x06) >> 1),
+      "address_granularity": self._address_granularity,
       "slave_block_mode": self._slave_block_mode,
       "optional": resp[1] & 0x80 != 0,
       "max_cto": self._max_cto,
@@ -200,6 +269,24 @@ class XcpClient:
     resp = self._recv_dto(self.timeout)
     assert len(resp) == 0, f"incorrect data length: {len(resp)}"
 
+  def get_comm_mode_info(self) -> dict:
+    self._send_cto(COMMAND_CODE.GET_COMM_MODE_INFO)
+    resp = self._recv_dto(self.timeout)
+    assert len(resp) >= 6, f"incorrect data length: {len(resp)}"
+    self._master_block_mode = resp[1] & 0x01 != 0
+    interleaved_mode = resp[1] & 0x02 != 0
+    self._max_bs = resp[3] if self._master_block_mode else 0
+    self._min_st = resp[4]
+    self._queue_size = resp[5] if interleaved_mode else 0
+    return {
+      "master_block_mode": self._master_block_mode,
+      "interleaved_mode": interleaved_mode,
+      "max_bs": resp[3],
+      "min_st": resp[4],
+      "queue_size": resp[5],
+      "driver_version": resp[6] if len(resp) > 6 else None,
+    }
+
   def get_id(self, req_id_type: GET_ID_REQUEST_TYPE = GET_ID_REQUEST_TYPE.ASCII) -> dict:
     if req_id_type > 255:
       raise ValueError("request id type must be less than 255")
@@ -238,14 +325,11 @@ class XcpClient:
   def upload(self, size: int) -> bytes:
     if size > 255:
       raise ValueError("size must be less than 256")
-    if not self._slave_block_mode and size > self._max_dto - 1:
+    if not self._slave_block_mode and size * self._address_granularity > self._max_dto - self._address_granularity:
       raise ValueError("block mode not supported")
 
     self._send_cto(COMMAND_CODE.UPLOAD, bytes([size]))
-    resp = b""
-    while len(resp) < size:
-      resp += self._recv_dto(self.timeout)[:size - len(resp) + 1]
-    return resp[:size] # trim off bytes with undefined values
+    return self._recv_upload(size)
 
   def short_upload(self, size: int, addr_ext: int, addr: int) -> bytes:
     if size > 6:
@@ -256,11 +340,216 @@ class XcpClient:
     return self._recv_dto(self.timeout)[:size] # trim off bytes with undefined values
 
   def download(self, data: bytes) -> bytes:
-    size = len(data)
+    """Writes data at the MTA. Data that doesn't fit in one packet is sent as a master block of DOWNLOAD_NEXT packets,
+    which needs get_comm_mode_info to have reported master block mode."""
+    ag = self._address_granularity
+    if len(data) % ag:
+      raise ValueError("data size must be a multiple of the address granularity")
+    size = len(data) // ag
     if size > 255:
       raise ValueError("size must be less than 256")
-    if not self._slave_block_mode and size > self._max_dto - 2:
-      raise ValueError("block mode not supported")
 
-    self._send_cto(COMMAND_CODE.DOWNLOAD, bytes([size]) + data)
+    align = (-2) % ag
+    packet_size = (self._max_cto - 2 - align) // ag * ag
+    packets = -(-len(data) // packet_size)
+    if packets > 1 and not self._master_block_mode:
+      raise ValueError("block mode not supported")
+    if packets > 1 and packets > self._max_bs:
+      raise ValueError(f"block of {packets} packets exceeds MAX_BS {self._max_bs}")
+
+    ctos = []
+    for i in range(0, len(data), packet_size):
+      cmd = COMMAND_CODE.DOWNLOAD if i == 0 else COMMAND_CODE.DOWNLOAD_NEXT
+      # the number of elements left, including this packet's
+      ctos.append(self._cto(cmd, bytes([(len(data) - i) // ag]) + bytes(align) + data[i:i + packet_size]))
+    # MIN_ST is in units of 100 us
+    self._send_ctos(ctos, self._min_st * 1e-4)
     return self._recv_dto(self.timeout)[:size]
+
+  def read_memory(self, addr: int, length: int, addr_ext: int = 0) -> bytes:
+    """Reads length bytes starting at addr. Uploads are as large as the slave block mode allows, and up to QUEUE_SIZE
+    of them are kept in flight if get_comm_mode_info reported interleaved mode."""
+    ag = self._address_granularity
+    if length % ag:
+      raise ValueError("length must be a multiple of the address granularity")
+    self.set_mta(addr, addr_ext)
+
+    max_size = 255 if self._slave_block_mode else (self._max_dto - ag) // ag
+    elements = length // ag
+    sizes = [min(max_size, elements - i) for i in range(0, elements, max_size)]
+
+    # the MTA moves on after every upload, so the responses come back in order
+    dat = bytearray()
+    in_flight: deque[int] = deque()
+    for size in sizes:
+      if len(in_flight) == max(self._queue_size, 1):
+        dat += self._recv_upload(in_flight.popleft())
+      self._send_cto(COMMAND_CODE.UPLOAD, bytes([size]))
+      in_flight.append(size)
+    while in_flight:
+      dat += self._recv_upload(in_flight.popleft())
+    return bytes(dat)
+
+  def write_memory(self, addr: int, data: bytes, addr_ext: int = 0) -> None:
+    """Writes data starting at addr, in master blocks if the slave supports them"""
+    ag = self._address_granularity
+    if len(data) % ag:
+      raise ValueError("data size must be a multiple of the address granularity")
+    self.set_mta(addr, addr_ext)
+
+    packet_size = (self._max_cto - 2 - (-2) % ag) // ag * ag
+    block_size = min(packet_size * max(self._max_bs, 1), 255 * ag) // ag * ag
+    for i in range(0, len(data), block_size):
+      self.download(data[i:i + block_size])
+
+  # DAQ
+  def free_daq(self) -> None:
+    self._send_cto(COMMAND_CODE.FREE_DAQ)
+    self._recv_dto(self.timeout)
+    self._daq_odts = {}
+
+  def alloc_daq(self, daq_count: int) -> None:
+    if daq_count > 65535:
+      raise ValueError("DAQ count must be less than 65536")
+    self._send_cto(COMMAND_CODE.ALLOC_DAQ, struct.pack(f"{self._byte_order}xH", daq_count))
+    self._recv_dto(self.timeout)
+
+  def alloc_odt(self, daq_list: int, odt_count: int) -> None:
+    if odt_count > 255:
+      raise ValueError("ODT count must be less than 256")
+    self._send_cto(COMMAND_CODE.ALLOC_ODT, struct.pack(f"{self._byte_order}xHB", daq_list, odt_count))
+    self._recv_dto(self.timeout)
+
+  def alloc_odt_entry(self, daq_list: int, odt: int, entry_count: int) -> None:
+    if odt > 255:
+      raise ValueError("ODT number must be less than 256")
+    if entry_count > 255:
+      raise ValueError("ODT entry count must be less than 256")
+    self._send_cto(COMMAND_CODE.ALLOC_ODT_ENTRY, struct.pack(f"{self._byte_order}xHBB", daq_list, odt, entry_count))
+    self._recv_dto(self.timeout)
+
+  def set_daq_ptr(self, daq_list: int, odt: int, entry: int) -> None:
+    if odt > 255:
+      raise ValueError("ODT number must be less than 256")
+    if entry > 255:
+      raise ValueError("ODT entry number must be less than 256")
+    self._send_cto(COMMAND_CODE.SET_DAQ_PTR, struct.pack(f"{self._byte_order}xHBB", daq_list, odt, entry))
+    self._recv_dto(self.timeout)
+
+  def write_daq(self, size: int, addr: int, addr_ext: int = 0, bit_offset: int = 0xFF) -> None:
+    if size > 255:
+      raise ValueError("size must be less than 256")
+    if addr_ext > 255:
+      raise ValueError("address extension must be less than 256")
+    self._send_cto(COMMAND_CODE.WRITE_DAQ, bytes([bit_offset, size, addr_ext]) + struct.pack(f"{self._byte_order}I", addr))
+    self._recv_dto(self.timeout)
+
+  def set_daq_list_mode(self, daq_list: int, event_channel: int, prescaler: int = 1, priority: int = 0, mode: int = 0) -> None:
+    if prescaler > 255:
+      raise ValueError("prescaler must be less than 256")
+    self._send_cto(COMMAND_CODE.SET_DAQ_LIST_MODE, bytes([mode]) + struct.pack(f"{self._byte_order}HHBB", daq_list, event_channel, prescaler, priority))
+    self._recv_dto(self.timeout)
+
+  def start_stop_daq_list(self, mode: START_STOP_MODE, daq_list: int) -> int:
+    self._send_cto(COMMAND_CODE.START_STOP_DAQ_LIST, bytes([mode]) + struct.pack(f"{self._byte_order}H", daq_list))
+    return self._recv_dto(self.timeout)[0]
+
+  def start_stop_synch(self, mode: START_STOP_SYNCH_MODE) -> None:
+    self._send_cto(COMMAND_CODE.START_STOP_SYNCH, bytes([mode]))
+    self._recv_dto(self.timeout)
+
+  @staticmethod
+  def _daq_layout(entries: list[DaqEntry], odt_size: int) -> list[list[DaqEntry]]:
+    # fills the ODTs in order, splitting entries that cross an ODT boundary
+    odts: list[list[DaqEntry]] = [[]]
+    used = 0
+    for entry in entries:
+      if entry.size <= 0:
+        raise ValueError("DAQ entry size must be positive")
+      offset = 0
+      while offset < entry.size:
+        if used == odt_size:
+          odts.append([])
+          used = 0
+        size = min(entry.size - offset, odt_size - used)
+        odts[-1].append(DaqEntry(entry.addr + offset, size, entry.addr_ext))
+        offset += size
+        used += size
+    return odts
+
+  def configure_daq(self, daq_lists: list[list[DaqEntry]], callback: DaqCallback, event_channel: int = 0, prescaler: int = 1) -> None:
+    """Sets up a dynamic DAQ list for each list of entries and selects them for start_daq.
+    The callback gets the data of each entry of a list, once all of the list's ODTs of a sample arrived."""
+    if self._address_granularity != 1:
+      raise ValueError("DAQ lists need a byte address granularity")
+    layouts = [self._daq_layout(entries, self._max_dto - 1) for entries in daq_lists]
+
+    self.free_daq()
+    self.alloc_daq(len(layouts))
+    for daq_list, odts in enumerate(layouts):
+      self.alloc_odt(daq_list, len(odts))
+    for daq_list, odts in enumerate(layouts):
+      for odt, odt_entries in enumerate(odts):
+        self.alloc_odt_entry(daq_list, odt, len(odt_entries))
+    for daq_list, odts in enumerate(layouts):
+      for odt, odt_entries in enumerate(odts):
+        # the DAQ pointer moves on to the next entry after every WRITE_DAQ
+        self.set_daq_ptr(daq_list, odt, 0)
+        for entry in odt_entries:
+          self.write_daq(entry.size, entry.addr, entry.addr_ext)
+
+    daq_odts = {}
+    for daq_list, odts in enumerate(layouts):
+      self.set_daq_list_mode(daq_list, event_channel, prescaler)
+      first_pid = self.start_stop_daq_list(START_STOP_MODE.SELECT, daq_list)
+      daq_odts.update({first_pid + odt: (daq_list, odt) for odt in range(len(odts))})
+
+    self._daq_odts = daq_odts
+    self._daq_odt_sizes = [[sum(e.size for e in odt_entries) for odt_entries in odts] for odts in layouts]
+    self._daq_entry_sizes = [[e.size for e in entries] for entries in daq_lists]
+    self._daq_samples = {}
+    self._daq_callback = callback
+
+  def start_daq(self) -> None:
+    self.start_stop_synch(START_STOP_SYNCH_MODE.START_SELECTED)
+
+  def stop_daq(self) -> None:
+    self.start_stop_synch(START_STOP_SYNCH_MODE.STOP_ALL)
+
+  def poll_daq(self, timeout: float) -> None:
+    """Passes the DAQ packets received within timeout to the callback"""
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+      msg = self._transport.recv(remaining)
+      if msg is None:
+        break
+      if msg.dat[0] < PID_SERV:
+        self._handle_daq(msg.dat)
+
+  def _handle_daq(self, dat: bytes) -> None:
+    if dat[0] not in self._daq_odts:
+      if self.debug:
+        print(f"XCP-DAQ: unknown ODT {dat[0]}")
+      return
+
+    daq_list, odt = self._daq_odts[dat[0]]
+    sample = self._daq_samples.setdefault(daq_list, [])
+    if odt == 0:
+      sample.clear()
+    elif odt != len(sample):
+      # an ODT of this sample was lost, wait for the next one
+      sample.clear()
+      return
+
+    odt_sizes = self._daq_odt_sizes[daq_list]
+    sample.append(dat[1:1 + odt_sizes[odt]])
+    if len(sample) == len(odt_sizes):
+      data = b"".join(sample)
+      sample.clear()
+      values = []
+      offset = 0
+      for size in self._daq_entry_sizes[daq_list]:
+        values.append(data[offset:offset + size])
+        offset += size
+      if self._daq_callback is not None:
+        self._daq_callback(daq_list, values)
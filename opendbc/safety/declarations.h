@@ -63,6 +63,9 @@ uint32_t GET_BYTES(const CANPacket_t *msg, int start, int len);
 
 extern const int MAX_WRONG_COUNTERS;
 #define MAX_ADDR_CHECK_MSGS 3U
+// capacity of the (addr, bus, len) lookup tables built from the safety config
+#define MAX_RX_LOOKUP_ENTRIES 32
+#define MAX_TX_LOOKUP_ENTRIES 32
 #define MAX_SAMPLE_VALS 6
 // used to represent floating point vehicle speed in a sample_t
 #define VEHICLE_SPEED_FACTOR 1000.0
@@ -213,6 +216,13 @@ typedef struct {
   bool disable_forwarding;
 } safety_config;
 
+// entry of the rx check and tx msg lookup tables, which are sorted by key for binary search
+typedef struct {
+  uint64_t key;                      // addr, bus and len, see addr_lookup_key
+  int index;                         // index into rx_checks or tx_msgs
+  int msg_index;                     // index into the rx check's msg array, 0 for tx msgs
+} AddrLookupEntry;
+
 typedef uint32_t (*get_checksum_t)(const CANPacket_t *msg);
 typedef uint32_t (*compute_checksum_t)(const CANPacket_t *msg);
 typedef uint8_t (*get_counter_t)(const CANPacket_t *msg);
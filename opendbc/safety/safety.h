@@ -111,31 +111,78 @@ static bool is_msg_valid(RxCheck addr_list[], int index) {
   return valid;
 }
 
-static int get_addr_check_index(const CANPacket_t *msg, RxCheck addr_list[], const int len) {
-  int addr = msg->addr;
-  int length = GET_LEN(msg);
+// rx checks and tx msgs of the current safety config, sorted by (addr, bus, len)
+static AddrLookupEntry rx_lookup[MAX_RX_LOOKUP_ENTRIES];
+static int rx_lookup_len = 0;
+static AddrLookupEntry tx_lookup[MAX_TX_LOOKUP_ENTRIES];
+static int tx_lookup_len = 0;
+
+static uint64_t addr_lookup_key(int addr, unsigned int bus, int len) {
+  return ((uint64_t)(uint32_t)addr << 16) | ((uint64_t)bus << 8) | (uint64_t)(uint32_t)len;
+}
+
+// insertion keeps entries with equal keys in the order they are added
+static int addr_lookup_insert(AddrLookupEntry table[], int table_len, int max_len, uint64_t key, int index, int msg_index) {
+  int new_len = table_len;
+  if (table_len < max_len) {
+    int i = table_len;
+    while ((i > 0) && (table[i - 1].key > key)) {
+      table[i] = table[i - 1];
+      i--;
+    }
+    table[i] = (AddrLookupEntry){key, index, msg_index};
+    new_len++;
+  }
+  return new_len;
+}
+
+// index of the first entry with a key not less than key
+static int addr_lookup_find(const AddrLookupEntry table[], int table_len, uint64_t key) {
+  int lo = 0;
+  int hi = table_len;
+  while (lo < hi) {
+    int mid = lo + ((hi - lo) / 2);
+    if (table[mid].key < key) {
+      lo = mid + 1;
+    } else {
+      hi = mid;
+    }
+  }
+  return lo;
+}
 
+static void build_addr_lookup(const safety_config *cfg) {
+  rx_lookup_len = 0;
+  for (int i = 0; i < cfg->rx_checks_len; i++) {
+    for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (cfg->rx_checks[i].msg[j].addr != 0); j++) {
+      const CanMsgCheck *m = &cfg->rx_checks[i].msg[j];
+      rx_lookup_len = addr_lookup_insert(rx_lookup, rx_lookup_len, MAX_RX_LOOKUP_ENTRIES, addr_lookup_key(m->addr, m->bus, m->len), i, j);
+    }
+  }
+
+  tx_lookup_len = 0;
+  for (int i = 0; i < cfg->tx_msgs_len; i++) {
+    const CanMsg *m = &cfg->tx_msgs[i];
+    tx_lookup_len = addr_lookup_insert(tx_lookup, tx_lookup_len, MAX_TX_LOOKUP_ENTRIES, addr_lookup_key(m->addr, m->bus, m->len), i, 0);
+  }
+}
+
+static int get_addr_check_index(const CANPacket_t *msg, RxCheck addr_list[]) {
+  uint64_t key = addr_lookup_key(msg->addr, msg->bus, GET_LEN(msg));
+
+  // entries with the same key are ordered by rx check, then by msg
   int index = -1;
-  for (int i = 0; i < len; i++) {
+  for (int i = addr_lookup_find(rx_lookup, rx_lookup_len, key); (i < rx_lookup_len) && (rx_lookup[i].key == key); i++) {
+    RxStatus *status = &addr_list[rx_lookup[i].index].status;
     // if multiple msgs are allowed, determine which one is present on the bus
-    if (!addr_list[i].status.msg_seen) {
-      for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (addr_list[i].msg[j].addr != 0); j++) {
-        if ((addr == addr_list[i].msg[j].addr) && (msg->bus == addr_list[i].msg[j].bus) &&
-              (length == addr_list[i].msg[j].len)) {
-          addr_list[i].status.index = j;
-          addr_list[i].status.msg_seen = true;
-          break;
-        }
-      }
+    if (!status->msg_seen) {
+      status->index = rx_lookup[i].msg_index;
+      status->msg_seen = true;
     }
 
-    if (addr_list[i].status.msg_seen) {
-      int idx = addr_list[i].status.index;
-      if ((addr == addr_list[i].msg[idx].addr) && (msg->bus == addr_list[i].msg[idx].bus) &&
-          (length == addr_list[i].msg[idx].len)) {
-        index = i;
-        break;
-      }
+    if (status->index == rx_lookup[i].msg_index) {
+      index = rx_lookup[i].index;
+      break;
     }
   }
   return index;
@@ -159,9 +206,9 @@ static void update_counter(RxCheck addr_list[], int index, uint8_t counter) {
 
 static bool rx_msg_safety_check(const CANPacket_t *msg,
                                 const safety_config *cfg,
-                                const safety_hooks *safety_hooks) {
+                                const safety_hooks *safety_hooks,
+                                int index) {
 
-  int index = get_addr_check_index(msg, cfg->rx_checks, cfg->rx_checks_len);
   update_addr_timestamp(cfg->rx_checks, index);
 
   if (index != -1) {
@@ -195,8 +242,9 @@ static bool rx_msg_safety_check(const CANPacket_t *msg,
 bool safety_rx_hook(const CANPacket_t *msg) {
   bool controls_allowed_prev = controls_allowed;
 
-  bool valid = rx_msg_safety_check(msg, &current_safety_config, current_hooks);
-  bool whitelisted = get_addr_check_index(msg, current_safety_config.rx_checks, current_safety_config.rx_checks_len) != -1;
+  int index = get_addr_check_index(msg, current_safety_config.rx_checks);
+  bool valid = rx_msg_safety_check(msg, &current_safety_config, current_hooks, index);
+  bool whitelisted = index != -1;
   if (valid && whitelisted) {
     current_hooks->rx(msg);
   }
@@ -223,22 +271,14 @@ bool safety_rx_hook(const CANPacket_t *msg) {
   return valid;
 }
 
-static bool tx_msg_safety_check(const CANPacket_t *msg, const CanMsg msg_list[], int len) {
-  int addr = msg->addr;
-  int length = GET_LEN(msg);
-
-  bool whitelisted = false;
-  for (int i = 0; i < len; i++) {
-    if ((addr == msg_list[i].addr) && (msg->bus == msg_list[i].bus) && (length == msg_list[i].len)) {
-      whitelisted = true;
-      break;
-    }
-  }
-  return whitelisted;
+static bool tx_msg_safety_check(const CANPacket_t *msg) {
+  uint64_t key = addr_lookup_key(msg->addr, msg->bus, GET_LEN(msg));
+  int i = addr_lookup_find(tx_lookup, tx_lookup_len, key);
+  return (i < tx_lookup_len) && (tx_lookup[i].key == key);
 }
 
 bool safety_tx_hook(CANPacket_t *msg) {
-  bool whitelisted = tx_msg_safety_check(msg, current_safety_config.tx_msgs, current_safety_config.tx_msgs_len);
+  bool whitelisted = tx_msg_safety_check(msg);
   if ((current_safety_mode == SAFETY_ALLOUTPUT) || (current_safety_mode == SAFETY_ELM327)) {
     whitelisted = true;
   }
@@ -505,6 +545,7 @@ int set_safety_hooks(uint16_t mode, uint16_t param) {
       current_safety_config.rx_checks[j].status = (RxStatus){0};
     }
   }
+  build_addr_lookup(&current_safety_config);
   return set_status;
 }
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from opendbc.safety.tests.fuzz_safety import FuzzTarget, discover_targets
+from opendbc.safety.tests.libsafety import libsafety_py
+
+# the modes with the largest rx check and tx msg tables
+DEFAULT_TARGETS = "HyundaiCanfd|Ford|VolkswagenMeb|Honda"
+
+
+def cpu_hz() -> float | None:
+  """Nominal CPU clock, used to convert hook times to cycles"""
+  try:
+    return int(Path("/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq").read_text()) * 1e3
+  except (OSError, ValueError):
+    pass
+  try:
+    for line in Path("/proc/cpuinfo").read_text().splitlines():
+      if line.startswith("cpu MHz"):
+        return float(line.split(":")[1]) * 1e6
+  except (OSError, ValueError):
+    pass
+  return None
+
+
+def time_frames(target: FuzzTarget, frames, repeats: int) -> float:
+  """Best time of a replay of the frames, in ns per frame"""
+  timers, *rest = frames
+  best = float('inf')
+  for _ in range(repeats):
+    target.reset(0)
+    t = time.perf_counter_ns()
+    libsafety_py.replay_frames(target.safety, timers, *rest, states=False)
+    best = min(best, time.perf_counter_ns() - t)
+  return best / len(timers)
+
+
+def benchmark_target(test_cls, n: int, repeats: int, seed: int) -> tuple[float, float, float] | None:
+  """ns per rx hook and per tx hook call, and the batch overhead per frame"""
+  try:
+    target = FuzzTarget(test_cls)
+  except unittest.SkipTest:
+    return None
+  inp = target.generate(random.Random(seed), n)
+  inp.flags &= libsafety_py.REPLAY_FRAME_TX
+
+  tx = (inp.flags & libsafety_py.REPLAY_FRAME_TX) != 0
+  rx_frames = inp.take(~tx).frames()
+  tx_frames = inp.take(tx).frames()
+  # the same frames without the hook calls
+  empty = inp.take(~tx)
+  empty.flags = np.full(len(empty), libsafety_py.REPLAY_FRAME_NO_MSG, dtype=np.uint8)
+
+  overhead = time_frames(target, empty.frames(), repeats)
+  return time_frames(target, rx_frames, repeats) - overhead, time_frames(target, tx_frames, repeats) - overhead, overhead
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Per-hook cost of the safety modes, on frames packed from their DBCs",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("targets", nargs="?", default=DEFAULT_TARGETS, help="regex for the safety test classes to benchmark")
+  parser.add_argument("-n", type=int, default=20000, help="frames per target")
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--profile", default="fast", choices=libsafety_py.BUILD_PROFILES, help="libsafety build profile")
+  args = parser.parse_args()
+
+  libsafety_py.load(libsafety_py._build_libsafety(profile=args.profile))
+  hz = cpu_hz()
+
+  print(f"{'target':<48} {'rx ns':>8} {'tx ns':>8} {'rx cycles':>10} {'tx cycles':>10}")
+  for name, test_cls in discover_targets(args.targets).items():
+    result = benchmark_target(test_cls, args.n, args.repeats, args.seed)
+    if result is None:
+      continue
+    rx_ns, tx_ns, _ = result
+    cycles = (f"{rx_ns * hz / 1e9:>10.0f} {tx_ns * hz / 1e9:>10.0f}") if hz else f"{'-':>10} {'-':>10}"
+    print(f"{name:<48} {rx_ns:>8.1f} {tx_ns:>8.1f} {cycles}")
+  if hz is None:
+    print("\ncycles are not shown, the CPU clock is unknown")
+
+
+if __name__ == "__main__":
+  main()
@@ -7,6 +7,7 @@ import numpy as np
 from collections.abc import Callable
 
 from opendbc.can import CANPacker
+from opendbc.can.dbc import Msg, SignalType
 from opendbc.safety import ALTERNATIVE_EXPERIENCE
 from opendbc.safety.tests.libsafety import libsafety_py
 from opendbc.car.lateral import MAX_LATERAL_ACCEL, MAX_LATERAL_JERK
@@ -43,7 +44,77 @@ def make_msg(bus, addr, length=8, dat=None):
   return libsafety_py.make_CANPacket(addr, bus, dat)
 
 
+class MessageEncoder:
+  """CANPacker.pack for a single message, with the byte layout of each signal worked out once"""
+
+  def __init__(self, msg: Msg):
+    self.address = msg.address
+    self.size = msg.size
+    # signal -> (factor, offset, size, (byte, shift, mask, value shift) per byte), in the order set_value writes them
+    self.sigs: dict[str, tuple[float, float, int, tuple[tuple[int, int, int, int], ...]]] = {}
+    for sig in msg.sigs.values():
+      pieces = []
+      i = sig.lsb // 8
+      bits = sig.size
+      while 0 <= i < msg.size and bits > 0:
+        shift = sig.lsb % 8 if (sig.lsb // 8) == i else 0
+        size = min(bits, 8 - shift)
+        pieces.append((i, shift, (1 << size) - 1, sig.size - bits))
+        bits -= size
+        i = i + 1 if sig.is_little_endian else i - 1
+      self.sigs[sig.name] = (sig.factor, sig.offset, sig.size, tuple(pieces))
+
+    counters = [s for s in msg.sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"]
+    self.counter_names = frozenset(s.name for s in counters)
+    self.counter = counters[0] if counters else None
+    self.checksum = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
+    if self.checksum is not None and not self.checksum.calc_checksum:
+      self.checksum = None
+
+  def set_raw(self, dat: bytearray, name: str, ival: int) -> None:
+    _, _, size, pieces = self.sigs[name]
+    ival &= (1 << size) - 1
+    for i, shift, mask, value_shift in pieces:
+      dat[i] = (dat[i] & ~(mask << shift)) | (((ival >> value_shift) & mask) << shift)
+
+  def encode(self, values: dict[str, float], counters: dict[int, int]) -> bytearray:
+    dat = bytearray(self.size)
+    for name, value in values.items():
+      factor, offset, size, pieces = self.sigs[name]
+      ival = int(math.floor((value - offset) / factor + 0.5)) & ((1 << size) - 1)
+      for i, shift, mask, value_shift in pieces:
+        dat[i] = (dat[i] & ~(mask << shift)) | (((ival >> value_shift) & mask) << shift)
+
+    if self.counter is not None:
+      counter_values = [v for name, v in values.items() if name in self.counter_names]
+      if counter_values:
+        counters[self.address] = int(counter_values[-1])
+      else:
+        counter = counters.get(self.address, 0)
+        self.set_raw(dat, self.counter.name, counter)
+        counters[self.address] = (counter + 1) % (1 << self.counter.size)
+    if self.checksum is not None:
+      self.set_raw(dat, self.checksum.name, self.checksum.calc_checksum(self.address, self.checksum, dat))
+    return dat
+
+
 class CANPackerSafety(CANPacker):
+  def __init__(self, dbc_name: str):
+    super().__init__(dbc_name)
+    self.encoders: dict[int, MessageEncoder] = {}
+
+  def pack(self, address: int, values: dict[str, float]) -> bytearray:
+    encoder = self.encoders.get(address)
+    if encoder is None:
+      msg = self.dbc.addr_to_msg.get(address)
+      if msg is None:
+        return super().pack(address, values)
+      encoder = self.encoders[address] = MessageEncoder(msg)
+    if not encoder.sigs.keys() >= values.keys():
+      # logs the unknown signals
+      return super().pack(address, values)
+    return encoder.encode(values, self.counters)
+
   def make_can_msg_safety(self, name_or_addr, bus, values, fix_checksum=None):
     msg = self.make_can_msg(name_or_addr, bus, values)
     if fix_checksum is not None:
@@ -51,6 +122,17 @@ class CANPackerSafety(CANPacker):
     addr, dat, bus = msg
     return libsafety_py.make_CANPacket(addr, bus, dat)
 
+  def make_can_frames_safety(self, name_or_addr, bus, values: list[dict[str, float]]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """A sweep of one message as the addrs, buses, lens and data arrays of libsafety_py.replay_frames"""
+    data = np.zeros((len(values), 64), dtype=np.uint8)
+    addr, length = 0, 0
+    for i, v in enumerate(values):
+      addr, dat, _ = self.make_can_msg(name_or_addr, bus, v)
+      length = len(dat)
+      data[i, :length] = np.frombuffer(dat, dtype=np.uint8)
+    n = len(values)
+    return np.full(n, addr, dtype=np.uint32), np.full(n, bus, dtype=np.uint8), np.full(n, length, dtype=np.uint8), data
+
 
 def add_regen_tests(cls):
   """Dynamically adds regen tests for all user brake tests."""
@@ -93,6 +175,15 @@ class SafetyTestBase(unittest.TestCase):
   def _tx(self, msg):
     return self.safety.safety_tx_hook(msg)
 
+  def _tx_frames(self, addrs, buses, lens, data) -> tuple[np.ndarray, np.ndarray]:
+    """Sends a batch of messages through the tx hook in one call, at the current timer.
+    Returns whether each one was allowed, and the REPLAY_STATE_* bits after each one"""
+    n = len(addrs)
+    timers = np.full(n, self.safety.microsecond_timer_get(), dtype=np.uint32)
+    flags = np.full(n, libsafety_py.REPLAY_FRAME_TX, dtype=np.uint8)
+    results, states = libsafety_py.replay_frames(self.safety, timers, flags, addrs, buses, lens, data)
+    return (results & libsafety_py.REPLAY_RESULT_ALLOWED) != 0, states
+
   @staticmethod
   def _boundary_values(boundaries, min_val, max_val, step=1, width=5, sparse_count=100):
     """Generate test values dense around boundaries and sparse across the full range."""
@@ -125,10 +216,22 @@ class SafetyTestBase(unittest.TestCase):
                                         min_possible_value, max_possible_value, test_delta)
 
     for controls_allowed in [False, True]:
+      if additional_setup is None:
+        # nothing to set up between values, so the whole sweep goes through the tx hook in one call
+        self.safety.set_controls_allowed(controls_allowed)
+        sent, states = self._tx_frames(*libsafety_py.packets_to_frames([msg_function(v) for v in test_values]))
+        # controls_allowed is only set once for the sweep, a tx hook changing it would skew the values after
+        changed = np.flatnonzero(((states & libsafety_py.REPLAY_STATE_CONTROLS_ALLOWED) != 0) != controls_allowed)
+        self.assertEqual(len(changed), 0, f"controls_allowed changed by the tx hook after sending {test_values[changed[0]] if len(changed) else None}")
+        for v, tx in zip(test_values, sent, strict=True):
+          should_tx = controls_allowed and min_allowed_value <= v <= max_allowed_value
+          should_tx = (should_tx or v == inactive_value) and msg_allowed
+          self.assertEqual(tx, should_tx, (controls_allowed, should_tx, v))
+        continue
+
       for v in test_values:
         self.safety.set_controls_allowed(controls_allowed)
-        if additional_setup is not None:
-          additional_setup(v)
+        additional_setup(v)
         should_tx = controls_allowed and min_allowed_value <= v <= max_allowed_value
         should_tx = (should_tx or v == inactive_value) and msg_allowed
         self.assertEqual(self._tx(msg_function(v)), should_tx, (controls_allowed, should_tx, v))
@@ -968,6 +1071,10 @@ class SafetyTest(SafetyTestBase):
     for msg in self.TX_MSGS:
       self.assertTrue(msg[0] in self.SCANNED_ADDRS, f"{msg[0]=:#x}")
 
+  def test_addr_lookup_capacity(self):
+    # rx checks and tx msgs that don't fit MAX_RX_LOOKUP_ENTRIES or MAX_TX_LOOKUP_ENTRIES are never matched
+    self.assertTrue(self.safety.addr_lookup_complete())
+
   def test_fwd_hook(self):
     # some safety modes don't forward anything, while others blacklist msgs
     for bus in range(3):
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+import argparse
+import multiprocessing
+import os
+import random
+import re
+import time
+import unittest
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from opendbc.can.dbc import SignalType
+from opendbc.can.packer import CANPacker
+from opendbc.safety.tests.libsafety import libsafety_py
+
+
+ROOT = Path(__file__).resolve().parents[3]
+SAFETY_TESTS_DIR = ROOT / "opendbc" / "safety" / "tests"
+
+MAX_FRAMES = 256
+# frame timer deltas in us: CAN rates, and jumps past the rx check timeouts
+FRAME_DTS = (0, 1000, 10000, 20000, 100000, 1000000)
+
+INIT_CONTROLS_ALLOWED = 1
+INIT_CONTROLS_ALLOWED_LATERAL = 2
+
+# AFL style hit count buckets, edges are compared per bucket
+HIT_COUNT_BUCKETS = np.array([0, 1, 2, 4, 8, 8, 8, 8] + [16] * 8 + [32] * 16 + [64] * 96 + [128] * 128, dtype=np.uint8)
+
+
+@dataclass
+class FuzzInput:
+  init: int  # INIT_* bits, safety state before the first frame
+  flags: np.ndarray
+  addrs: np.ndarray
+  buses: np.ndarray
+  lens: np.ndarray
+  data: np.ndarray
+  dts: np.ndarray
+
+  def __len__(self):
+    return len(self.flags)
+
+  def take(self, idx) -> 'FuzzInput':
+    return FuzzInput(self.init, self.flags[idx], self.addrs[idx], self.buses[idx], self.lens[idx], self.data[idx], self.dts[idx])
+
+  @staticmethod
+  def concat(init, parts) -> 'FuzzInput':
+    return FuzzInput(init, *(np.concatenate([getattr(p, f) for p in parts]) for f in ('flags', 'addrs', 'buses', 'lens', 'data', 'dts')))
+
+  def frames(self):
+    timers = (np.cumsum(self.dts, dtype=np.uint64) % (1 << 32)).astype(np.uint32)
+    return timers, self.flags, self.addrs, self.buses, self.lens, self.data
+
+
+@dataclass
+class Violation:
+  invariant: str
+  target: str
+  addr: int
+  bus: int
+  frame: int
+  fuzz_input: FuzzInput
+
+
+@dataclass
+class FuzzStats:
+  target: str
+  execs: int = 0
+  frames: int = 0
+  seconds: float = 0.
+  edges: int = 0
+  corpus: int = 0
+  violations: list[Violation] = field(default_factory=list)
+
+
+class _SetupRecorder:
+  """Stands in for libsafety during a test's setUp, and records the calls that configure the safety mode"""
+  def __init__(self, safety):
+    self.safety = safety
+    self.calls = []
+
+  def __getattr__(self, name):
+    func = getattr(self.safety, name)
+
+    def record(*args):
+      self.calls.append((name, args))
+      return func(*args)
+    return record
+
+
+class FuzzTarget:
+  """A safety mode configuration taken from a safety test class, with the CAN messages of its DBCs"""
+
+  def __init__(self, test_cls):
+    self.name = test_cls.__name__
+    self.safety = libsafety_py.libsafety
+
+    recorder = _SetupRecorder(self.safety)
+    libsafety_py.libsafety = recorder
+    try:
+      test_cls.setUpClass()
+      test = test_cls()
+      test.setUp()
+    finally:
+      libsafety_py.libsafety = self.safety
+    self.setup_calls = recorder.calls
+
+    self.tx_msgs = {(addr, bus) for addr, bus in test_cls.TX_MSGS}
+    self.packers = [p for p in vars(test).values() if isinstance(p, CANPacker)]
+
+    # (packer, addr, bus, tx), rx messages are sent on every bus the tests use
+    self.msgs = []
+    for packer in self.packers:
+      for addr in packer.dbc.addr_to_msg:
+        self.msgs += [(packer, addr, bus, False) for bus in (0, 1, 2)]
+    for addr, bus in sorted(self.tx_msgs):
+      packer = next((p for p in self.packers if addr in p.dbc.addr_to_msg), None)
+      self.msgs.append((packer, addr, bus, True))
+    self.last_values = {}
+    self.frame_pool: FuzzInput | None = None
+
+  def reset(self, init: int) -> None:
+    for name, args in self.setup_calls:
+      getattr(self.safety, name)(*args)
+    self.safety.set_controls_allowed(bool(init & INIT_CONTROLS_ALLOWED))
+    self.safety.set_controls_allowed_lateral(bool(init & INIT_CONTROLS_ALLOWED_LATERAL))
+
+  def _signal_values(self, rng, packer, addr):
+    """Random values, sticking close to the last values of the message so rate limits and edges get exercised"""
+    values = dict(self.last_values.get((id(packer), addr), {}))
+    sigs = [s for s in packer.dbc.addr_to_msg[addr].sigs.values() if s.type == SignalType.DEFAULT and s.name != "COUNTER"]
+    for sig in rng.sample(sigs, min(len(sigs), rng.choice((1, 1, 2, 3, len(sigs))))):
+      lo, hi = (-(1 << (sig.size - 1)), (1 << (sig.size - 1)) - 1) if sig.is_signed else (0, (1 << sig.size) - 1)
+      last = round((values.get(sig.name, sig.offset) - sig.offset) / sig.factor)
+      raw = rng.choice((0, 1, lo, hi, rng.randint(lo, hi), last + rng.randint(-8, 8)))
+      values[sig.name] = min(max(raw, lo), hi) * sig.factor + sig.offset
+    self.last_values[(id(packer), addr)] = values
+    return values
+
+  def generate(self, rng, n) -> FuzzInput:
+    flags, addrs, buses, lens, dts = [], [], [], [], []
+    data = np.zeros((n, 64), dtype=np.uint8)
+    for i in range(n):
+      packer, addr, bus, tx = rng.choice(self.msgs)
+      if packer is None:
+        dat = rng.randbytes(8)
+      else:
+        values = self._signal_values(rng, packer, addr)
+        counter = next((s for s in packer.dbc.addr_to_msg[addr].sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"), None)
+        if counter is not None and rng.random() < 0.05:
+          # counter errors
+          values[counter.name] = rng.randrange(1 << counter.size)
+        dat = bytes(packer.pack(addr, values))
+      flags.append(libsafety_py.REPLAY_FRAME_TX if tx else 0)
+      addrs.append(addr)
+      buses.append(bus)
+      lens.append(len(dat))
+      data[i, :len(dat)] = np.frombuffer(dat, dtype=np.uint8)
+      dts.append(rng.choice(FRAME_DTS[1:4]) if rng.random() < 0.95 else rng.choice(FRAME_DTS))
+    flags = np.array(flags, dtype=np.uint8)
+    flags[np.array([rng.random() < 0.1 for _ in range(n)], dtype=bool)] |= libsafety_py.REPLAY_FRAME_TICK
+    return FuzzInput(rng.randrange(4), flags, np.array(addrs, dtype=np.uint32), np.array(buses, dtype=np.uint8),
+                     np.array(lens, dtype=np.uint8), data, np.array(dts, dtype=np.uint32))
+
+  def sample(self, rng, n) -> FuzzInput:
+    """New frames, mostly drawn from a pool of packed frames since packing is the slow part"""
+    if self.frame_pool is None:
+      self.frame_pool = self.generate(rng, 1024)
+    if rng.random() < 0.2:
+      frames = self.generate(rng, n)
+      idx = np.array([rng.randrange(len(self.frame_pool)) for _ in range(n)])
+      for f in ('flags', 'addrs', 'buses', 'lens', 'data', 'dts'):
+        getattr(self.frame_pool, f)[idx] = getattr(frames, f)
+      return frames
+    return self.frame_pool.take(np.array([rng.randrange(len(self.frame_pool)) for _ in range(n)]))
+
+  def mutate(self, rng, inp: FuzzInput, corpus: list[FuzzInput]) -> FuzzInput:
+    n = len(inp)
+    op = rng.randrange(7)
+    if op == 0:
+      # insert new frames
+      i = rng.randint(0, n)
+      out = FuzzInput.concat(inp.init, [inp.take(slice(0, i)), self.sample(rng, rng.randint(1, 16)), inp.take(slice(i, n))])
+    elif op == 1 and n > 1:
+      # delete a range
+      i = rng.randrange(n)
+      out = FuzzInput.concat(inp.init, [inp.take(slice(0, i)), inp.take(slice(i + rng.randint(1, 16), n))])
+    elif op == 2:
+      # splice with another input
+      other = rng.choice(corpus)
+      out = FuzzInput.concat(inp.init, [inp.take(slice(0, rng.randint(0, n))), other.take(slice(rng.randint(0, len(other)), len(other)))])
+    elif op == 3:
+      # repeat a range
+      i = rng.randrange(n)
+      part = inp.take(slice(i, i + rng.randint(1, 8)))
+      out = FuzzInput.concat(inp.init, [inp.take(slice(0, i)), *([part] * rng.randint(2, 16)), inp.take(slice(i, n))])
+    elif op == 4:
+      # byte and bit flips, mostly breaking checksums
+      out = inp.take(slice(None))
+      out.data = out.data.copy()
+      for _ in range(rng.randint(1, 4)):
+        i = rng.randrange(n)
+        if out.lens[i]:
+          out.data[i, rng.randrange(out.lens[i])] ^= (1 << rng.randrange(8)) if rng.random() < 0.5 else rng.randrange(1, 256)
+    elif op == 5:
+      # timing
+      out = inp.take(slice(None))
+      out.dts = out.dts.copy()
+      out.flags = out.flags.copy()
+      for _ in range(rng.randint(1, 4)):
+        i = rng.randrange(n)
+        out.dts[i] = rng.choice(FRAME_DTS)
+        out.flags[i] ^= libsafety_py.REPLAY_FRAME_TICK
+    else:
+      out = inp.take(slice(None))
+      out.init = rng.randrange(4)
+    return out.take(slice(0, MAX_FRAMES)) if len(out) > MAX_FRAMES else out
+
+
+class Fuzzer:
+  def __init__(self, target: FuzzTarget, seed: int):
+    self.target = target
+    self.rng = random.Random(seed)
+    self.coverage = np.frombuffer(libsafety_py.ffi.buffer(target.safety.fuzz_coverage_map), dtype=np.uint8)
+    self.seen = np.zeros_like(self.coverage)
+    self.corpus: list[FuzzInput] = []
+    self.checked_allowed = set()
+    self.stats = FuzzStats(target.name)
+    self.violation_keys = set()
+
+  def execute(self, inp: FuzzInput):
+    self.target.reset(inp.init)
+    init_state = ((libsafety_py.REPLAY_STATE_CONTROLS_ALLOWED if self.target.safety.get_controls_allowed() else 0) |
+                  (libsafety_py.REPLAY_STATE_CONTROLS_ALLOWED_LATERAL if self.target.safety.get_controls_allowed_lateral() else 0))
+    self.coverage[:] = 0
+    results, states = libsafety_py.replay_frames(self.target.safety, *inp.frames())
+    self.stats.execs += 1
+    self.stats.frames += len(inp)
+    return results, np.concatenate(([init_state], states[:-1])).astype(np.uint8), states
+
+  def new_coverage(self) -> bool:
+    # scan 8 edges at a time, most of the map is empty
+    words = np.flatnonzero(self.coverage.view(np.uint64))
+    edges = (words[:, None] * 8 + np.arange(8)).ravel()
+    edges = edges[self.coverage[edges] != 0]
+    hits = HIT_COUNT_BUCKETS[self.coverage[edges]]
+    new = (hits & ~self.seen[edges]) != 0
+    if not new.any():
+      return False
+    self.seen[edges] |= hits
+    return True
+
+  def _violation(self, invariant, inp, i):
+    key = (invariant, int(inp.addrs[i]), int(inp.buses[i]))
+    if key not in self.violation_keys:
+      self.violation_keys.add(key)
+      self.stats.violations.append(Violation(invariant, self.target.name, int(inp.addrs[i]), int(inp.buses[i]), i, inp.take(slice(0, i + 1))))
+
+  def check_invariants(self, inp, results, prev_states, states):
+    controls = libsafety_py.REPLAY_STATE_CONTROLS_ALLOWED | libsafety_py.REPLAY_STATE_CONTROLS_ALLOWED_LATERAL
+    tx = (inp.flags & libsafety_py.REPLAY_FRAME_TX) != 0
+    allowed = tx & ((results & libsafety_py.REPLAY_RESULT_ALLOWED) != 0)
+
+    # only whitelisted messages are sent
+    for i in np.flatnonzero(allowed):
+      if (int(inp.addrs[i]), int(inp.buses[i])) not in self.target.tx_msgs:
+        self._violation("tx allowed outside of TX_MSGS", inp, i)
+
+    # the tx hook never allows controls
+    for i in np.flatnonzero(tx & ((states & ~prev_states & controls) != 0)):
+      self._violation("tx hook allowed controls", inp, i)
+
+    # no tx is allowed while controls are not allowed, unless it is also allowed without the tx messages before it.
+    # inactive values, such as zero torque or an angle that matches the measured angle, only depend on rx messages
+    for i in np.flatnonzero(allowed & ((prev_states & controls) == 0)):
+      key = (int(inp.addrs[i]), int(inp.buses[i]), inp.data[i, :inp.lens[i]].tobytes())
+      if key in self.checked_allowed:
+        continue
+      self.checked_allowed.add(key)
+
+      rx_only = inp.take(slice(0, i + 1))
+      rx_only.flags = rx_only.flags.copy()
+      # keep the timers and safety ticks of the dropped frames
+      rx_only.flags[:i][tx[:i]] = (rx_only.flags[:i][tx[:i]] & libsafety_py.REPLAY_FRAME_TICK) | libsafety_py.REPLAY_FRAME_NO_MSG
+      timers, *frames = rx_only.frames()
+
+      self.target.reset(inp.init)
+      rx_results, rx_states = libsafety_py.replay_frames(self.target.safety, timers, *frames)
+      rx_prev_state = rx_states[i - 1] if i > 0 else prev_states[0]
+      if (rx_prev_state & controls) != 0 or rx_results[i] & libsafety_py.REPLAY_RESULT_ALLOWED:
+        continue
+
+      # only report messages that need controls, not ones blocked for other reasons such as a relay malfunction
+      self.target.reset(inp.init)
+      libsafety_py.replay_frames(self.target.safety, timers[:i], *(f[:i] for f in frames), states=False)
+      self.target.safety.set_controls_allowed(True)
+      self.target.safety.set_controls_allowed_lateral(True)
+      with_controls, _ = libsafety_py.replay_frames(self.target.safety, timers[i:], *(f[i:] for f in frames), states=False)
+      if with_controls[0] & libsafety_py.REPLAY_RESULT_ALLOWED:
+        self._violation("tx allowed while controls are not allowed", inp, i)
+
+  def run(self, seconds: float, max_execs: int = 0) -> FuzzStats:
+    start = time.monotonic()
+    while time.monotonic() - start < seconds and (max_execs == 0 or self.stats.execs < max_execs):
+      if not self.corpus or self.rng.random() < 0.05:
+        inp = self.target.sample(self.rng, self.rng.randint(1, 64))
+      else:
+        inp = self.target.mutate(self.rng, self.rng.choice(self.corpus), self.corpus)
+      if len(inp) == 0:
+        continue
+
+      results, prev_states, states = self.execute(inp)
+      if self.new_coverage():
+        self.corpus.append(inp)
+      self.check_invariants(inp, results, prev_states, states)
+
+    self.stats.seconds = time.monotonic() - start
+    self.stats.edges = int((self.seen != 0).sum())
+    self.stats.corpus = len(self.corpus)
+    return self.stats
+
+
+def discover_targets(pattern: str) -> dict[str, type]:
+  from opendbc.safety.tests.common import SafetyTest
+
+  loader = unittest.TestLoader()
+  targets = {}
+  for test_file in sorted(SAFETY_TESTS_DIR.glob("test_*.py")):
+    module = loader.loadTestsFromName(".".join(test_file.relative_to(ROOT).with_suffix("").parts))
+    for suite in module:
+      for test in suite:
+        cls = type(test)
+        if issubclass(cls, SafetyTest) and cls.__name__.startswith("Test") and cls.TX_MSGS and re.search(pattern, cls.__name__):
+          targets[cls.__name__] = cls
+        break
+  return dict(sorted(targets.items()))
+
+
+def save_violation(out_dir: Path, violation: Violation) -> Path:
+  invariant = re.sub(r'\W+', '_', violation.invariant)
+  path = out_dir / f"{violation.target}-{violation.addr:x}-{violation.bus}-{invariant}.npz"
+  inp = violation.fuzz_input
+  np.savez(path, target=violation.target, invariant=violation.invariant, init=inp.init, flags=inp.flags, addrs=inp.addrs, buses=inp.buses,
+           lens=inp.lens, data=inp.data, dts=inp.dts)
+  return path
+
+
+def fuzz_target(args) -> FuzzStats:
+  test_cls, seconds, max_execs, seed = args
+  try:
+    target = FuzzTarget(test_cls)
+  except unittest.SkipTest:
+    return FuzzStats(test_cls.__name__)
+  return Fuzzer(target, seed).run(seconds, max_execs)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Coverage guided fuzzing of the safety modes, with messages from their DBCs",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("targets", nargs="?", default="", help="regex for the safety test classes to fuzz")
+  parser.add_argument("-j", type=int, default=os.cpu_count(), help="targets to fuzz in parallel")
+  parser.add_argument("--seconds", type=float, default=10., help="time to fuzz each target")
+  parser.add_argument("--max-execs", type=int, default=0, help="optional exec limit per target (0 means none)")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--out", type=Path, default=Path("fuzz-out"), help="directory for the inputs that violate an invariant")
+  args = parser.parse_args()
+
+  libsafety_py.load(libsafety_py._build_libsafety(profile="fuzz"))
+  targets = discover_targets(args.targets)
+  print(f"Fuzzing {len(targets)} targets for {args.seconds:.0f}s each with {args.j} workers", flush=True)
+
+  jobs = [(cls, args.seconds, args.max_execs, args.seed) for cls in targets.values()]
+  with multiprocessing.get_context("fork").Pool(args.j) as pool:
+    stats = [s for s in pool.imap(fuzz_target, jobs) if s.execs > 0]
+
+  violations = [v for s in stats for v in s.violations]
+  if violations:
+    args.out.mkdir(parents=True, exist_ok=True)
+
+  print(f"\n{'target':<48} {'execs':>9} {'exec/s':>9} {'frames/s':>10} {'edges':>6} {'corpus':>6} {'violations':>10}")
+  for s in stats:
+    print(f"{s.target:<48} {s.execs:>9} {s.execs / s.seconds:>9.0f} {s.frames / s.seconds:>10.0f} {s.edges:>6} {s.corpus:>6} {len(s.violations):>10}")
+  total_execs = sum(s.execs for s in stats)
+  total_seconds = sum(s.seconds for s in stats)
+  print(f"\ntotal: {total_execs} execs, {total_execs / total_seconds:.0f} exec/s per worker, {len(violations)} violations")
+
+  for v in violations:
+    print(f"- {v.target}: {v.invariant}, addr {hex(v.addr)} bus {v.bus} at frame {v.frame} -> {save_violation(args.out, v)}")
+  return 1 if violations else 0
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
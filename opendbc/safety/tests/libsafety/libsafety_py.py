@@ -1,41 +1,86 @@
+import fcntl
+import hashlib
 import os
+import re
 import subprocess
 import tempfile
 from pathlib import Path
 
+import numpy as np
 from cffi import FFI
 
-from opendbc.safety import LEN_TO_DLC
+from opendbc.safety import DLC_TO_LEN, LEN_TO_DLC
 
 libsafety_dir = os.path.dirname(os.path.abspath(__file__))
 
 
-def _build_libsafety(release: bool = False) -> str:
-  """Compile libsafety.so to a temp file and return its path."""
+# compiler and linker flags of each build profile
+BUILD_PROFILES = {
+  # the default, for the unit tests and the line coverage check
+  'coverage': (['-g', '-O0', '-fno-omit-frame-pointer', '-fprofile-arcs', '-ftest-coverage'],
+               ['-fsanitize=undefined', '-fno-sanitize-recover=undefined', '-fprofile-arcs', '-ftest-coverage']),
+  'sanitized': (['-g', '-O0', '-fno-omit-frame-pointer'],
+                ['-fsanitize=undefined', '-fno-sanitize-recover=undefined']),
+  # for replay and fuzzing throughput
+  'fast': (['-O2'], []),
+  # fast, with edge counters in fuzz_coverage_map
+  'fuzz': (['-O2', '-fsanitize-coverage=trace-pc', '-DFUZZ_COVERAGE'], []),
+}
+DEFAULT_BUILD_PROFILE = os.environ.get('LIBSAFETY_PROFILE', 'coverage')
+
+BUILD_DIR = os.path.join(libsafety_dir, 'build')
+
+
+def _source_hash(*flags) -> str:
+  """Hash of the compiler flags and every source file libsafety is built from."""
+  safety_dir = Path(libsafety_dir).parents[1]
+  h = hashlib.sha256(repr(flags).encode())
+  for f in sorted([*safety_dir.rglob('*.h'), Path(libsafety_dir, 'safety.c')]):
+    h.update(str(f.relative_to(safety_dir)).encode())
+    h.update(f.read_bytes())
+  return h.hexdigest()[:16]
+
+
+def _build_libsafety(release: bool = False, profile: str = DEFAULT_BUILD_PROFILE) -> str:
+  """Compile libsafety.so, or reuse an identical earlier build, and return its path."""
   root = str(Path(libsafety_dir).parents[3])
   safety_c = os.path.join(libsafety_dir, "safety.c")
 
   cflags = [
     '-Wall', '-Wextra', '-Werror', '-nostdlib', '-fno-builtin',
     '-std=gnu11', '-Wfatal-errors', '-Wno-pointer-to-int-cast',
-    '-g', '-O0', '-fno-omit-frame-pointer',
   ]
-  ldflags = [
-    '-fsanitize=undefined', '-fno-sanitize-recover=undefined',
-  ]
-  if not release:
-    cflags += ['-DALLOW_DEBUG', '-fprofile-arcs', '-ftest-coverage']
-    ldflags += ['-fprofile-arcs', '-ftest-coverage']
+  profile_cflags, ldflags = BUILD_PROFILES[profile]
+  if release:
+    # no debug modes and no coverage
+    profile_cflags = [f for f in profile_cflags if f not in ('-fprofile-arcs', '-ftest-coverage')]
+    ldflags = [f for f in ldflags if f not in ('-fprofile-arcs', '-ftest-coverage')]
+  else:
+    cflags.append('-DALLOW_DEBUG')
+  cflags += profile_cflags
 
-  fd, safety_os = tempfile.mkstemp(suffix='.os', dir=libsafety_dir)
-  os.close(fd)
-  fd, libsafety_so = tempfile.mkstemp(suffix='.so')
-  os.close(fd)
+  # the object keeps its final name, gcov derives the coverage data paths from it
+  name = f"libsafety-{profile}{'-release' if release else ''}-{_source_hash(cflags, ldflags)}"
+  safety_os = os.path.join(BUILD_DIR, f"{name}.os")
+  libsafety_so = os.path.join(BUILD_DIR, f"{name}.so")
 
-  subprocess.check_call(['cc', '-fPIC', *cflags, '-I', root, '-c', safety_c, '-o', safety_os])
-  subprocess.check_call(['cc', '-shared', safety_os, '-o', libsafety_so, *ldflags])
-  return libsafety_so
+  os.makedirs(BUILD_DIR, exist_ok=True)
+  with open(os.path.join(BUILD_DIR, f"{name}.lock"), 'w') as lock:
+    # parallel test processes and pool workers wait for a single build
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    if not os.path.exists(libsafety_so):
+      subprocess.check_call(['cc', '-fPIC', *cflags, '-I', root, '-c', safety_c, '-o', safety_os])
+      fd, tmp_so = tempfile.mkstemp(suffix='.so', dir=BUILD_DIR)
+      os.close(fd)
+      subprocess.check_call(['cc', '-shared', safety_os, '-o', tmp_so, *ldflags])
+      os.replace(tmp_so, libsafety_so)
 
+      # drop builds of this profile from older sources
+      stale = re.compile(rf"libsafety-{profile}{'-release' if release else ''}-[0-9a-f]{{16}}\.(os|so|gcno|gcda|lock)$")
+      for f in os.listdir(BUILD_DIR):
+        if stale.match(f) and not f.startswith(name):
+          os.remove(os.path.join(BUILD_DIR, f))
+  return libsafety_so
 
 ffi = FFI()
 
@@ -103,9 +148,11 @@ bool get_cruise_engaged_prev(void);
 void set_cruise_engaged_prev(bool engaged);
 bool get_vehicle_moving(void);
 void set_timer(uint32_t t);
+uint32_t microsecond_timer_get(void);
 
 void safety_tick_current_safety_config();
 bool safety_config_valid();
+bool addr_lookup_complete(void);
 
 void init_tests(void);
 
@@ -146,8 +193,31 @@ void set_heartbeat_engaged_mads(bool c);
 void mads_heartbeat_engaged_check(void);
 void set_steering_disengage(bool c);
 int get_gas_interceptor_prev(void);
+
+int safety_replay_frames(int n, const uint32_t *timers, const uint8_t *flags, const uint32_t *addrs, const uint8_t *buses,
+                         const uint8_t *lens, const uint8_t *data, uint8_t *results, uint8_t *states,
+                         int record_every, int32_t *records);
+
+extern uint8_t fuzz_coverage_map[65536];
 """)
 
+# constants for safety_replay_frames, from safety.c
+REPLAY_FRAME_TX = 1
+REPLAY_FRAME_TICK = 2
+REPLAY_FRAME_NO_MSG = 4
+
+REPLAY_RESULT_ALLOWED = 1
+REPLAY_RESULT_TICK_INVALID = 2
+
+REPLAY_STATE_CONTROLS_ALLOWED = 1
+REPLAY_STATE_CONTROLS_ALLOWED_LATERAL = 2
+REPLAY_STATE_LONGITUDINAL_ALLOWED = 4
+REPLAY_STATE_MADS_ENABLED = 8
+
+# columns of the recorded state rows, in the order replay_record_state writes them
+REPLAY_RECORD_FIELDS = ('frame', 'result', 'controls_allowed', 'controls_allowed_lateral', 'longitudinal_allowed', 'disengage_reason',
+                        'desired_torque_last', 'desired_angle_last', 'desired_curvature_last', 'vehicle_speed_min', 'vehicle_speed_max')
+
 class LibSafety:
   pass
 libsafety: LibSafety
@@ -170,3 +240,51 @@ def make_CANPacket(addr: int, bus: int, dat):
   ret[0].bus = bus
   ret[0].data = bytes(dat)
   return ret
+
+def packets_to_frames(packets) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+  """The addrs, buses, lens and data arrays of replay_frames for a list of packets"""
+  n = len(packets)
+  addrs = np.array([p[0].addr for p in packets], dtype=np.uint32)
+  buses = np.array([p[0].bus for p in packets], dtype=np.uint8)
+  lens = np.array([DLC_TO_LEN[p[0].data_len_code] for p in packets], dtype=np.uint8)
+  data = np.frombuffer(b''.join(ffi.buffer(p[0].data) for p in packets), dtype=np.uint8).reshape(n, 64)
+  return addrs, buses, lens, data
+
+_VALID_LENS = np.isin(np.arange(256), DLC_TO_LEN)
+
+def _replay_frames(safety, timers, flags, addrs, buses, lens, data, states: bool, record_every: int):
+  n = len(timers)
+  timers = np.ascontiguousarray(timers, dtype=np.uint32)
+  flags = np.ascontiguousarray(flags, dtype=np.uint8)
+  addrs = np.ascontiguousarray(addrs, dtype=np.uint32)
+  buses = np.ascontiguousarray(buses, dtype=np.uint8)
+  lens = np.ascontiguousarray(lens, dtype=np.uint8)
+  data = np.ascontiguousarray(data, dtype=np.uint8)
+  assert all(len(a) == n for a in (flags, addrs, buses, lens, data))
+  assert data.shape[1:] == (64,) and _VALID_LENS[lens].all()
+
+  results = np.zeros(n, dtype=np.uint8)
+  states_out = np.zeros(n, dtype=np.uint8) if states else None
+  # every record_every-th frame, and at most every tx frame
+  max_rows = (-(-n // record_every) + int(np.count_nonzero(flags & REPLAY_FRAME_TX))) if record_every > 0 else 0
+  records = np.zeros((max_rows, len(REPLAY_RECORD_FIELDS)), dtype=np.int32)
+  rows = safety.safety_replay_frames(n, ffi.from_buffer('uint32_t[]', timers), ffi.from_buffer('uint8_t[]', flags),
+                                     ffi.from_buffer('uint32_t[]', addrs), ffi.from_buffer('uint8_t[]', buses),
+                                     ffi.from_buffer('uint8_t[]', lens), ffi.from_buffer('uint8_t[]', data),
+                                     ffi.from_buffer('uint8_t[]', results), ffi.from_buffer('uint8_t[]', states_out) if states else ffi.NULL,
+                                     record_every, ffi.from_buffer('int32_t[]', records) if max_rows else ffi.NULL)
+  return results, states_out, records[:rows]
+
+def replay_frames(safety, timers: np.ndarray, flags: np.ndarray, addrs: np.ndarray, buses: np.ndarray, lens: np.ndarray, data: np.ndarray,
+                  states: bool = True) -> tuple[np.ndarray, np.ndarray | None]:
+  """Runs a batch of frames through the hooks in a single call, see safety_replay_frames in safety.c.
+  Returns the per-frame REPLAY_RESULT_* bits, and the REPLAY_STATE_* bits after each frame if requested."""
+  results, states_out, _ = _replay_frames(safety, timers, flags, addrs, buses, lens, data, states, 0)
+  return results, states_out
+
+def replay_frames_recorded(safety, timers: np.ndarray, flags: np.ndarray, addrs: np.ndarray, buses: np.ndarray, lens: np.ndarray, data: np.ndarray,
+                           record_every: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Like replay_frames, also recording the safety state after every record_every-th frame and every blocked tx frame.
+  Returns the results, the states, and the recorded rows with REPLAY_RECORD_FIELDS columns."""
+  assert record_every > 0
+  return _replay_frames(safety, timers, flags, addrs, buses, lens, data, True, record_every)
@@ -34,6 +34,17 @@ bool safety_config_valid() {
   return true;
 }
 
+// true if every rx check msg and tx msg of the current config is in the lookup tables
+bool addr_lookup_complete(void) {
+  int rx_msgs = 0;
+  for (int i = 0; i < current_safety_config.rx_checks_len; i++) {
+    for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (current_safety_config.rx_checks[i].msg[j].addr != 0); j++) {
+      rx_msgs++;
+    }
+  }
+  return (rx_lookup_len == rx_msgs) && (tx_lookup_len == current_safety_config.tx_msgs_len);
+}
+
 void set_controls_allowed(bool c){
   controls_allowed = c;
 }
@@ -346,3 +357,122 @@ void init_tests(void){
   heartbeat_engaged_mads = false;
   heartbeat_engaged_mads_mismatches = 0U;
 }
+
+// ***** batched hooks for replay *****
+
+#define REPLAY_FRAME_TX 1U      // run the tx hook instead of the fwd + rx hooks
+#define REPLAY_FRAME_TICK 2U    // run safety_tick before the hooks
+#define REPLAY_FRAME_NO_MSG 4U  // only set the timer and tick, no CAN message
+
+#define REPLAY_RESULT_ALLOWED 1U
+#define REPLAY_RESULT_TICK_INVALID 2U
+
+#define REPLAY_STATE_CONTROLS_ALLOWED 1U
+#define REPLAY_STATE_CONTROLS_ALLOWED_LATERAL 2U
+#define REPLAY_STATE_LONGITUDINAL_ALLOWED 4U
+#define REPLAY_STATE_MADS_ENABLED 8U
+
+// columns of the state rows recorded by safety_replay_frames, see REPLAY_RECORD_FIELDS in libsafety_py.py
+#define REPLAY_RECORD_COLUMNS 11
+
+static void replay_record_state(int frame, uint8_t result, int32_t *row) {
+  row[0] = frame;
+  row[1] = result;
+  row[2] = controls_allowed ? 1 : 0;
+  row[3] = controls_allowed_lateral ? 1 : 0;
+  row[4] = get_longitudinal_allowed() ? 1 : 0;
+  row[5] = mads_get_current_disengage_reason();
+  row[6] = desired_torque_last;
+  row[7] = desired_angle_last;
+  row[8] = curvature_state.desired_last;
+  row[9] = vehicle_speed.min;
+  row[10] = vehicle_speed.max;
+}
+
+static uint8_t len_to_dlc(uint8_t len) {
+  uint8_t dlc = 0U;
+  while ((dlc < 15U) && (dlc_to_len[dlc] < len)) {
+    dlc++;
+  }
+  return dlc;
+}
+
+// runs n frames through the hooks in one call, frames are passed as contiguous arrays with
+// CANPACKET_DATA_SIZE_MAX data bytes per frame. states may be NULL to skip the state snapshots.
+// with record_every > 0, a row of REPLAY_RECORD_COLUMNS is written to records after every
+// record_every-th frame and after every blocked tx frame. returns the number of rows written
+int safety_replay_frames(int n, const uint32_t *timers, const uint8_t *flags, const uint32_t *addrs, const uint8_t *buses,
+                         const uint8_t *lens, const uint8_t *data, uint8_t *results, uint8_t *states,
+                         int record_every, int32_t *records) {
+  int rows = 0;
+  for (int i = 0; i < n; i++) {
+    uint8_t result = 0U;
+    set_timer(timers[i]);
+
+    if ((flags[i] & REPLAY_FRAME_TICK) != 0U) {
+      safety_tick_current_safety_config();
+      if (!safety_config_valid()) {
+        result |= REPLAY_RESULT_TICK_INVALID;
+      }
+    }
+
+    if ((flags[i] & REPLAY_FRAME_NO_MSG) == 0U) {
+      CANPacket_t msg = {0};
+      msg.extended = (addrs[i] >= 0x800U) ? 1U : 0U;
+      msg.addr = addrs[i];
+      msg.bus = buses[i];
+      msg.data_len_code = len_to_dlc(lens[i]);
+      for (int j = 0; j < lens[i]; j++) {
+        msg.data[j] = data[(i * CANPACKET_DATA_SIZE_MAX) + j];
+      }
+
+      bool allowed;
+      if ((flags[i] & REPLAY_FRAME_TX) != 0U) {
+        allowed = safety_tx_hook(&msg);
+      } else {
+        (void)safety_fwd_hook(msg.bus, msg.addr);
+        allowed = safety_rx_hook(&msg);
+      }
+      if (allowed) {
+        result |= REPLAY_RESULT_ALLOWED;
+      }
+    }
+    results[i] = result;
+
+    if (states != NULL) {
+      uint8_t state = 0U;
+      state |= controls_allowed ? REPLAY_STATE_CONTROLS_ALLOWED : 0U;
+      state |= controls_allowed_lateral ? REPLAY_STATE_CONTROLS_ALLOWED_LATERAL : 0U;
+      state |= get_longitudinal_allowed() ? REPLAY_STATE_LONGITUDINAL_ALLOWED : 0U;
+      state |= get_enable_mads() ? REPLAY_STATE_MADS_ENABLED : 0U;
+      states[i] = state;
+    }
+
+    if (record_every > 0) {
+      bool tx_blocked = ((flags[i] & (REPLAY_FRAME_TX | REPLAY_FRAME_NO_MSG)) == REPLAY_FRAME_TX) && ((result & REPLAY_RESULT_ALLOWED) == 0U);
+      if (((i % record_every) == 0) || tx_blocked) {
+        replay_record_state(i, result, &records[rows * REPLAY_RECORD_COLUMNS]);
+        rows++;
+      }
+    }
+  }
+  return rows;
+}
+
+// ***** edge coverage for fuzzing *****
+
+#define FUZZ_COVERAGE_MAP_SIZE 65536U
+uint8_t fuzz_coverage_map[FUZZ_COVERAGE_MAP_SIZE];
+
+#ifdef FUZZ_COVERAGE
+static uintptr_t fuzz_prev_loc = 0U;
+
+// called on every basic block with -fsanitize-coverage=trace-pc, hashes the previous and current
+// block into an edge hit counter like AFL does
+__attribute__((no_sanitize_coverage)) void __sanitizer_cov_trace_pc(void) {
+  uintptr_t loc = (uintptr_t)__builtin_return_address(0);
+  loc = (loc >> 4) ^ (loc << 8);
+  fuzz_coverage_map[(loc ^ fuzz_prev_loc) % FUZZ_COVERAGE_MAP_SIZE]++;
+  fuzz_prev_loc = loc >> 1;
+}
+#endif
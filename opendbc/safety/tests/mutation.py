@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import io
+import json
 import os
 import re
 import subprocess
@@ -21,6 +23,7 @@ ROOT = Path(__file__).resolve().parents[3]
 SAFETY_DIR = ROOT / "opendbc" / "safety"
 SAFETY_TESTS_DIR = ROOT / "opendbc" / "safety" / "tests"
 SAFETY_C_REL = Path("opendbc/safety/tests/libsafety/safety.c")
+MUTATION_CACHE_PATH = SAFETY_TESTS_DIR / "libsafety" / "build" / "mutation_cache.json"
 
 ANSI_RESET = "\033[0m"
 ANSI_BOLD = "\033[1m"
@@ -476,6 +479,88 @@ def compile_mutated_library(preprocessed_source, sites, output_so):
   ], cwd=ROOT, check=True)
 
 
+def _hash_files(paths):
+  h = hashlib.sha256()
+  for path in sorted(paths):
+    h.update(str(path.relative_to(ROOT)).encode())
+    h.update(path.read_bytes())
+  return h.hexdigest()
+
+
+def _is_mode_file(path):
+  return path.parent == SAFETY_DIR / "modes"
+
+
+def _mode_deps(path):
+  """The mode file and the mode headers it includes, e.g. hyundai.h and hyundai_common.h"""
+  deps = set()
+  todo = [path]
+  while todo:
+    f = todo.pop()
+    if f in deps:
+      continue
+    deps.add(f)
+    for inc in re.findall(r'^\s*#\s*include\s+"([^"]+)"', f.read_text(), flags=re.MULTILINE):
+      inc_path = ROOT / inc
+      if _is_mode_file(inc_path) and inc_path.is_file():
+        todo.append(inc_path)
+  return deps
+
+
+class MutationCache:
+  """Persistent mutant outcomes, keyed on the mutation site and the code and tests it depends on.
+
+  A site depends on its own file, the mode headers it includes and every non-mode safety file, so editing one
+  safety mode only re-runs the sites in that mode and the modes including it. Its tests depend on the test modules it runs and the shared test helpers.
+  """
+
+  def __init__(self, path, sites, site_targets, preprocessed_source):
+    self.path = path
+    try:
+      self.entries = json.loads(path.read_text())
+    except (OSError, ValueError):
+      self.entries = {}
+
+    safety_files = [*SAFETY_DIR.rglob("*.h"), ROOT / SAFETY_C_REL]
+    core_hash = _hash_files([f for f in safety_files if not _is_mode_file(f)])
+    test_helpers = [f for f in SAFETY_TESTS_DIR.glob("*.py") if not f.name.startswith("test_")] + [SAFETY_TESTS_DIR / "libsafety" / "libsafety_py.py"]
+
+    mode_hashes = {}
+    test_hashes = {}
+    seen = Counter()
+    self.keys = {}
+    for site in sites:
+      if _is_mode_file(site.origin_file) and site.origin_file not in mode_hashes:
+        mode_hashes[site.origin_file] = _hash_files(_mode_deps(site.origin_file))
+
+      modules = tuple(sorted({t.rsplit(".", 2)[0] for t in site_targets[site.site_id]}))
+      if modules not in test_hashes:
+        test_hashes[modules] = _hash_files(test_helpers + [ROOT / Path(*m.split(".")).with_suffix(".py") for m in modules])
+
+      expr = preprocessed_source[site.expr_start:site.expr_end]
+      site_key = (f"{site.origin_file.relative_to(ROOT)}:{site.origin_line}:{site.mutator}:{site.original_op}->{site.mutated_op}:" +
+                  hashlib.sha256(expr.encode()).hexdigest()[:16])
+      # identical mutations on one line are told apart by their order
+      seen[site_key] += 1
+      deps = hashlib.sha256(f"{core_hash}:{mode_hashes.get(site.origin_file, '')}:{test_hashes[modules]}".encode()).hexdigest()[:16]
+      self.keys[site.site_id] = f"{site_key}:{seen[site_key]}:{deps}"
+
+  def get(self, site):
+    return self.entries.get(self.keys[site.site_id])
+
+  def update(self, results, prune):
+    for res in results:
+      if res.outcome in ("killed", "survived"):
+        self.entries[self.keys[res.site.site_id]] = res.outcome
+    if prune:
+      # drop outcomes of sites that no longer exist
+      current = set(self.keys.values())
+      self.entries = {k: v for k, v in self.entries.items() if k in current}
+    self.entries = dict(sorted(self.entries.items()))
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self.path.write_text(json.dumps(self.entries, indent=0))
+
+
 def eval_mutant(site, targets, lib_path, verbose):
   try:
     t0 = time.perf_counter()
@@ -494,6 +579,8 @@ def main():
   parser.add_argument("--max-mutants", type=int, default=0, help="optional limit for debugging (0 means all)")
   parser.add_argument("--list-only", action="store_true", help="list discovered candidates and exit")
   parser.add_argument("--verbose", action="store_true", help="print extra debug output")
+  parser.add_argument("--cache", type=Path, default=MUTATION_CACHE_PATH, help="results cache, only changed sites are re-run")
+  parser.add_argument("--no-cache", action="store_true", help="run every mutant, without reading or writing the results cache")
   args = parser.parse_args()
 
   start = time.perf_counter()
@@ -527,55 +614,72 @@ def main():
       print("Failed to build mutation library: all sites were pruned as build-incompatible", flush=True)
       return 2
 
-    mutation_lib = Path(run_tmp_dir) / "libsafety_mutation.so"
-    compile_mutated_library(preprocessed_source, sites, mutation_lib)
-
     # Discover all tests by importing modules in the main process.
     # Forked workers inherit these imports, eliminating per-worker import cost.
     catalog = _discover_test_catalog()
 
-    # Baseline smoke check
-    baseline_ids = catalog.get("test_defaults.py", [])[:5]
-    baseline_failed = run_unittest(baseline_ids, mutation_lib, mutant_id=-1, verbose=args.verbose)
-    if baseline_failed is not None:
-      print("Baseline smoke failed with mutant_id=-1; aborting to avoid false kill signals.", flush=True)
-      print(f"  failed_test: {baseline_failed}", flush=True)
-      return 2
-
     # Pre-compute test targets per mutation site
     core_tests = _build_core_tests(catalog)
     site_targets = {site.site_id: build_priority_tests(site, catalog, core_tests) for site in sites}
 
     results = []
     counts = Counter()
-
-    with ProcessPoolExecutor(max_workers=args.j) as pool:
-      future_map = {
-        pool.submit(eval_mutant, site, site_targets[site.site_id], mutation_lib, args.verbose): site for site in sites
-      }
-      print_live_status(render_progress(0, len(sites), 0, 0, 0, 0.0))
-      try:
-        for fut in as_completed(future_map):
-          try:
-            res = fut.result()
-          except Exception:
-            site = future_map[fut]
-            res = MutantResult(site, "killed", 0.0, "worker process crashed")
-          results.append(res)
-          counts[res.outcome] += 1
+    cache = None if args.no_cache else MutationCache(args.cache, sites, site_targets, preprocessed_source)
+    if cache is not None:
+      for site in sites:
+        if (outcome := cache.get(site)) is not None:
+          results.append(MutantResult(site, outcome, 0.0, "cached"))
+          counts[outcome] += 1
+      print(f"Reusing {len(results)} cached results from {args.cache}", flush=True)
+    cached_ids = {r.site.site_id for r in results}
+    # only outcomes that came back from eval_mutant are cached, not the ones assumed from a crashed worker or pool
+    evaluated = []
+    pending = [s for s in sites if s.site_id not in cached_ids]
+
+    if pending:
+      # only the pending sites are compiled in
+      mutation_lib = Path(run_tmp_dir) / "libsafety_mutation.so"
+      compile_mutated_library(preprocessed_source, pending, mutation_lib)
+
+      # Baseline smoke check
+      baseline_ids = catalog.get("test_defaults.py", [])[:5]
+      baseline_failed = run_unittest(baseline_ids, mutation_lib, mutant_id=-1, verbose=args.verbose)
+      if baseline_failed is not None:
+        print("Baseline smoke failed with mutant_id=-1; aborting to avoid false kill signals.", flush=True)
+        print(f"  failed_test: {baseline_failed}", flush=True)
+        return 2
+
+      with ProcessPoolExecutor(max_workers=args.j) as pool:
+        future_map = {
+          pool.submit(eval_mutant, site, site_targets[site.site_id], mutation_lib, args.verbose): site for site in pending
+        }
+        print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"], counts["infra_error"], 0.0))
+        try:
+          for fut in as_completed(future_map):
+            try:
+              res = fut.result()
+              evaluated.append(res)
+            except Exception:
+              site = future_map[fut]
+              res = MutantResult(site, "killed", 0.0, "worker process crashed")
+            results.append(res)
+            counts[res.outcome] += 1
+            elapsed_now = time.perf_counter() - start
+            done = len(results) == len(sites)
+            print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"],
+                                              counts["infra_error"], elapsed_now), final=done)
+        except Exception:
+          # Pool broken — mark all unfinished mutants as killed (crash = behavioral change detected)
+          completed_ids = {r.site.site_id for r in results}
+          for site in pending:
+            if site.site_id not in completed_ids:
+              results.append(MutantResult(site, "killed", 0.0, "pool broken"))
+              counts["killed"] += 1
           elapsed_now = time.perf_counter() - start
-          done = len(results) == len(sites)
-          print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"],
-                                            counts["infra_error"], elapsed_now), final=done)
-      except Exception:
-        # Pool broken — mark all unfinished mutants as killed (crash = behavioral change detected)
-        completed_ids = {r.site.site_id for r in results}
-        for site in sites:
-          if site.site_id not in completed_ids:
-            results.append(MutantResult(site, "killed", 0.0, "pool broken"))
-            counts["killed"] += 1
-        elapsed_now = time.perf_counter() - start
-        print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"], counts["infra_error"], elapsed_now), final=True)
+          print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"], counts["infra_error"], elapsed_now), final=True)
+
+    if cache is not None:
+      cache.update(evaluated, prune=args.max_mutants == 0)
 
     survivors = sorted((r for r in results if r.outcome == "survived"), key=lambda r: r.site.site_id)
     if survivors:
@@ -603,6 +707,7 @@ def main():
     print(f"  discovered: {discovered_count}", flush=True)
     print(f"  pruned_build_incompatible: {pruned_compile_sites}", flush=True)
     print(f"  total: {len(sites)}", flush=True)
+    print(f"  cached: {len(cached_ids)}", flush=True)
     print(f"  killed: {colorize(str(counts['killed']), ANSI_GREEN)}", flush=True)
     print(f"  survived: {colorize(str(counts['survived']), ANSI_RED)}", flush=True)
     print(f"  infra_error: {colorize(str(counts['infra_error']), ANSI_YELLOW)}", flush=True)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from opendbc.safety.tests.libsafety import libsafety_py
+
+ROOT = Path(__file__).resolve().parents[3]
+SAFETY_TESTS_DIR = ROOT / "opendbc" / "safety" / "tests"
+
+# more chunks than workers, so workers that finish early pick up the remaining work
+CHUNKS_PER_WORKER = 4
+
+
+def discover_test_classes(pattern: str = "test_*.py") -> Counter:
+  """Number of tests in each test class, keyed by the class's dotted name.
+  Test classes imported into other test modules are only counted, and run, once."""
+  def flatten(suite):
+    for t in suite:
+      if isinstance(t, unittest.TestSuite):
+        yield from flatten(t)
+      else:
+        yield t
+
+  suite = unittest.TestLoader().discover(str(SAFETY_TESTS_DIR), pattern=pattern, top_level_dir=str(ROOT))
+  return Counter(test_id.rsplit(".", 1)[0] for test_id in {t.id() for t in flatten(suite)})
+
+
+def make_chunks(classes: Counter, n: int) -> list[list[str]]:
+  """Splits the test classes into n chunks of about the same number of tests, largest chunks first"""
+  chunks: list[tuple[int, list[str]]] = [(0, []) for _ in range(min(n, len(classes)))]
+  for name, count in sorted(classes.items(), key=lambda kv: (-kv[1], kv[0])):
+    i = min(range(len(chunks)), key=lambda i: chunks[i][0])
+    chunks[i] = (chunks[i][0] + count, chunks[i][1] + [name])
+  return [names for _, names in sorted(chunks, key=lambda c: -c[0])]
+
+
+def _gcov_env(prefix: str) -> dict[str, str]:
+  # the .gcda files go straight into the prefix directory, instead of the build directory under it
+  strip = len(Path(libsafety_py.BUILD_DIR).parts) - 1
+  return {**os.environ, "GCOV_PREFIX": prefix, "GCOV_PREFIX_STRIP": str(strip), "PYTHONPATH": str(ROOT)}
+
+
+def merge_coverage(prefixes: list[str], out_dir: str) -> None:
+  """Merges the coverage data of each worker, and any already in out_dir, into out_dir"""
+  dirs = [p for p in prefixes if any(f.endswith(".gcda") for f in os.listdir(p))]
+  if not dirs:
+    return
+
+  with tempfile.TemporaryDirectory() as tmp:
+    existing = os.path.join(tmp, "existing")
+    os.makedirs(existing)
+    for f in os.listdir(out_dir):
+      if f.endswith(".gcda"):
+        shutil.copy(os.path.join(out_dir, f), existing)
+    if os.listdir(existing):
+      dirs.append(existing)
+
+    merged = dirs[0]
+    for i, d in enumerate(dirs[1:]):
+      out = os.path.join(tmp, f"merged{i}")
+      subprocess.check_call(["gcov-tool", "merge", "-o", out, merged, d])
+      merged = out
+
+    for f in os.listdir(merged):
+      if f.endswith(".gcda"):
+        shutil.copy(os.path.join(merged, f), out_dir)
+
+
+def run_tests(classes: Counter, jobs: int, verbose: bool = False) -> bool:
+  chunks = make_chunks(classes, jobs * CHUNKS_PER_WORKER)
+  # build once, the workers reuse it
+  libsafety_py._build_libsafety()
+
+  # without gcov-tool, every worker merges into the .gcda files of the build directory, under libgcov's file lock
+  separate_coverage = shutil.which("gcov-tool") is not None
+
+  with tempfile.TemporaryDirectory() as tmp:
+    prefixes = queue.SimpleQueue()
+    prefix_dirs = [os.path.join(tmp, f"worker{i}") for i in range(jobs)]
+    for p in prefix_dirs:
+      os.makedirs(p)
+      prefixes.put(p)
+
+    def run_chunk(names):
+      prefix = prefixes.get()
+      try:
+        env = _gcov_env(prefix) if separate_coverage else {**os.environ, "PYTHONPATH": str(ROOT)}
+        cmd = [sys.executable, "-m", "unittest", *(["-v"] if verbose else []), *names]
+        t = time.monotonic()
+        proc = subprocess.run(cmd, cwd=SAFETY_TESTS_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        return names, proc.returncode, proc.stdout, time.monotonic() - t
+      finally:
+        prefixes.put(prefix)
+
+    passed = True
+    with ThreadPoolExecutor(jobs) as pool:
+      for names, returncode, output, seconds in pool.map(run_chunk, chunks):
+        tests = sum(classes[n] for n in names)
+        status = "ok" if returncode == 0 else "FAILED"
+        print(f"{status:>6}  {tests:>5} tests in {len(names):>3} classes  {seconds:>6.1f}s", flush=True)
+        if returncode != 0 or verbose:
+          print(output, flush=True)
+        passed &= returncode == 0
+
+    if separate_coverage:
+      merge_coverage(prefix_dirs, libsafety_py.BUILD_DIR)
+  return passed
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Runs the safety tests across worker processes, and merges their coverage data",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of worker processes")
+  parser.add_argument("-p", "--pattern", default="test_*.py", help="Test module pattern")
+  parser.add_argument("-v", "--verbose", action="store_true", help="Print the output of every chunk")
+  args = parser.parse_args()
+
+  t = time.monotonic()
+  classes = discover_test_classes(args.pattern)
+  print(f"Running {sum(classes.values())} tests in {len(classes)} classes with {args.jobs} workers", flush=True)
+  passed = run_tests(classes, args.jobs, args.verbose)
+  print(f"\n{'OK' if passed else 'FAILED'} in {time.monotonic() - t:.1f}s")
+  return 0 if passed else 1
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -1,3 +1,11 @@
+import math
+import os
+from functools import cache
+from typing import NamedTuple
+
+import numpy as np
+
+from opendbc.can.dbc import DBC
 from opendbc.car.ford.values import FordSafetyFlags
 from opendbc.car.hyundai.values import HyundaiSafetyFlags
 from opendbc.car.toyota.values import ToyotaSafetyFlags
@@ -5,97 +13,130 @@ from opendbc.car.structs import CarParams
 from opendbc.safety.tests.libsafety import libsafety_py
 
 
-def to_signed(d, bits):
-  ret = d
-  if d >= (1 << (bits - 1)):
-    ret = d - (1 << bits)
-  return ret
+STEER_TORQUE = "torque"
+STEER_ANGLE = "angle"
+STEER_CURVATURE = "curvature"
 
 
-def is_steering_msg(mode, param, addr):
-  ret = False
-  if mode in (CarParams.SafetyModel.hondaNidec, CarParams.SafetyModel.hondaBosch):
-    ret = (addr == 0xE4) or (addr == 0x194) or (addr == 0x33D) or (addr == 0x33DA) or (addr == 0x33DB)
-  elif mode == CarParams.SafetyModel.toyota:
-    ret = addr == (0x191 if param & ToyotaSafetyFlags.LTA else 0x2E4)
-  elif mode == CarParams.SafetyModel.gm:
-    ret = addr == 384
-  elif mode in (CarParams.SafetyModel.hyundai, CarParams.SafetyModel.hyundaiLegacy):
-    ret = addr == 832
-  elif mode == CarParams.SafetyModel.hyundaiCanfd:
-    ret = addr == (0x110 if param & HyundaiSafetyFlags.CANFD_LKA_STEER_MSG_ALT else
-                   0x50 if param & HyundaiSafetyFlags.CANFD_LKA_STEER_MSG else
-                   0x12A)
-  elif mode == CarParams.SafetyModel.chrysler:
-    ret = addr == 0x292
-  elif mode == CarParams.SafetyModel.subaru:
-    ret = addr == 0x122
-  elif mode == CarParams.SafetyModel.ford:
-    ret = addr == 0x3d6 if param & FordSafetyFlags.CANFD else addr == 0x3d3
-  elif mode == CarParams.SafetyModel.nissan:
-    ret = addr == 0x169
-  elif mode == CarParams.SafetyModel.rivian:
-    ret = addr == 0x120
-  elif mode == CarParams.SafetyModel.tesla:
-    ret = addr == 0x488
-  return ret
+class SteerCommand(NamedTuple):
+  dbc: str
+  msg: str
+  signal: str
+  kind: str  # STEER_TORQUE, STEER_ANGLE or STEER_CURVATURE
 
 
-def get_steer_value(mode, param, msg):
-  # TODO: use CANParser
-  torque, angle = 0, 0
+def get_steer_commands(mode, param) -> list[SteerCommand]:
+  """The steering command signals the safety mode checks"""
+  ret = []
   if mode in (CarParams.SafetyModel.hondaNidec, CarParams.SafetyModel.hondaBosch):
-    torque = (msg.data[0] << 8) | msg.data[1]
-    torque = to_signed(torque, 16)
+    # 0xE4 on most cars, 0x194 on the CR-V and RDX
+    ret = [SteerCommand("honda_civic_touring_2016_can_generated", "STEERING_CONTROL", "STEER_TORQUE", STEER_TORQUE),
+           SteerCommand("honda_crv_touring_2016_can_generated", "STEERING_CONTROL", "STEER_TORQUE", STEER_TORQUE)]
   elif mode == CarParams.SafetyModel.toyota:
     if param & ToyotaSafetyFlags.LTA:
-      angle = (msg.data[1] << 8) | msg.data[2]
-      angle = to_signed(angle, 16)
+      ret = [SteerCommand("toyota_nodsu_pt_generated", "STEERING_LTA", "STEER_ANGLE_CMD", STEER_ANGLE)]
     else:
-      torque = (msg.data[1] << 8) | (msg.data[2])
-      torque = to_signed(torque, 16)
+      ret = [SteerCommand("toyota_nodsu_pt_generated", "STEERING_LKA", "STEER_TORQUE_CMD", STEER_TORQUE)]
   elif mode == CarParams.SafetyModel.gm:
-    torque = ((msg.data[0] & 0x7) << 8) | msg.data[1]
-    torque = to_signed(torque, 11)
+    ret = [SteerCommand("gm_global_a_powertrain_generated", "ASCMLKASteeringCmd", "LKASteeringCmd", STEER_TORQUE)]
   elif mode in (CarParams.SafetyModel.hyundai, CarParams.SafetyModel.hyundaiLegacy):
-    torque = (((msg.data[3] & 0x7) << 8) | msg.data[2]) - 1024
+    ret = [SteerCommand("hyundai_can_generated", "LKAS11", "CR_Lkas_StrToqReq", STEER_TORQUE)]
   elif mode == CarParams.SafetyModel.hyundaiCanfd:
-    torque = ((msg.data[5] >> 1) | (msg.data[6] & 0xF) << 7) - 1024
+    msg = ("LKAS_ALT" if param & HyundaiSafetyFlags.CANFD_LKA_STEER_MSG_ALT else
+           "LKAS" if param & HyundaiSafetyFlags.CANFD_LKA_STEER_MSG else
+           "LFA")
+    ret = [SteerCommand("hyundai_canfd_generated", msg, "StrTqReqVal", STEER_TORQUE)]
   elif mode == CarParams.SafetyModel.chrysler:
-    torque = (((msg.data[0] & 0x7) << 8) | msg.data[1]) - 1024
+    ret = [SteerCommand("chrysler_pacifica_2017_hybrid_generated", "LKAS_COMMAND", "STEERING_TORQUE", STEER_TORQUE)]
   elif mode == CarParams.SafetyModel.subaru:
-    torque = ((msg.data[3] & 0x1F) << 8) | msg.data[2]
-    torque = -to_signed(torque, 13)
+    ret = [SteerCommand("subaru_global_2017_generated", "ES_LKAS", "LKAS_Output", STEER_TORQUE)]
   elif mode == CarParams.SafetyModel.ford:
-    if param & FordSafetyFlags.CANFD:
-      angle = ((msg.data[2] << 3) | (msg.data[3] >> 5)) - 1000
-    else:
-      angle = ((msg.data[0] << 3) | (msg.data[1] >> 5)) - 1000
+    msg = "LateralMotionControl2" if param & FordSafetyFlags.CANFD else "LateralMotionControl"
+    ret = [SteerCommand("ford_lincoln_base_pt", msg, "LatCtlCurv_No_Actl", STEER_CURVATURE)]
   elif mode == CarParams.SafetyModel.nissan:
-    angle = (msg.data[0] << 10) | (msg.data[1] << 2) | (msg.data[2] >> 6)
-    angle = -angle + (1310 * 100)
+    ret = [SteerCommand("nissan_x_trail_2017_generated", "LKAS", "DESIRED_ANGLE", STEER_ANGLE)]
   elif mode == CarParams.SafetyModel.rivian:
-    torque = ((msg.data[2] << 3) | (msg.data[3] >> 5)) - 1024
+    ret = [SteerCommand("rivian_primary_actuator", "ACM_lkaHbaCmd", "ACM_lkaStrToqReq", STEER_TORQUE)]
   elif mode == CarParams.SafetyModel.tesla:
-    angle = (((msg.data[0] & 0x7F) << 8) | (msg.data[1])) - 16384  # ceil(1638.35/0.1)
-  return torque, angle
+    ret = [SteerCommand("tesla_model3_party", "DAS_steeringControl", "DAS_steeringAngleRequest", STEER_ANGLE)]
+  return ret
+
+
+class SignalDecodePlan(NamedTuple):
+  address: int
+  # (byte, shift, mask, shift into the raw value) for each byte the signal spans, see get_raw_value
+  pieces: tuple[tuple[int, int, int, int], ...]
+  size: int
+  is_signed: bool
+  # raw value to the integer units the safety modes use, which drop the DBC factor
+  sign: int
+  offset: int
+
+
+@cache
+def get_decode_plan(dbc_name: str, msg_name: str, signal_name: str) -> SignalDecodePlan:
+  msg = DBC(dbc_name).name_to_msg[msg_name]
+  sig = msg.sigs[signal_name]
+
+  pieces = []
+  i = sig.msb // 8
+  bits = sig.size
+  while bits > 0:
+    lsb = sig.lsb if (sig.lsb // 8) == i else i * 8
+    msb = sig.msb if (sig.msb // 8) == i else (i + 1) * 8 - 1
+    size = msb - lsb + 1
+    pieces.append((i, lsb - (i * 8), (1 << size) - 1, bits - size))
+    bits -= size
+    i = i - 1 if sig.is_little_endian else i + 1
+
+  # the safety modes round a fractional offset down, e.g. tesla.h. The quotient is rounded first so float error
+  # can't push a whole offset below itself, e.g. -20.48 / 0.01 == -2048.0000000000002
+  offset = math.floor(round(sig.offset / abs(sig.factor), 6))
+  return SignalDecodePlan(msg.address, tuple(pieces), sig.size, sig.is_signed, -1 if sig.factor < 0 else 1, offset)
+
+
+def decode_signal(data: np.ndarray, plan: SignalDecodePlan) -> np.ndarray:
+  """Decodes a signal from every row of an (N, 64) frame data array, in safety units"""
+  raw = np.zeros(len(data), dtype=np.int64)
+  for byte, shift, mask, raw_shift in plan.pieces:
+    raw |= ((data[:, byte].astype(np.int64) >> shift) & mask) << raw_shift
+  if plan.is_signed:
+    raw -= ((raw >> (plan.size - 1)) & 1) << plan.size
+  return plan.sign * raw + plan.offset
+
+
+class SteerValues(NamedTuple):
+  # one entry per frame, the values are only set for steering command frames of their kind
+  steering: np.ndarray
+  torque: np.ndarray
+  angle: np.ndarray
+  curvature: np.ndarray
 
 
-def package_can_msg(msg):
-  return libsafety_py.make_CANPacket(msg.address, msg.src % 4, msg.dat)
+def get_steer_values(mode, param, frames) -> SteerValues:
+  """Decodes the commanded steering of every sent frame of a drive at once"""
+  n = len(frames.addrs)
+  steering = np.zeros(n, dtype=bool)
+  values = {kind: np.zeros(n, dtype=np.int64) for kind in (STEER_TORQUE, STEER_ANGLE, STEER_CURVATURE)}
 
+  tx = (frames.flags & libsafety_py.REPLAY_FRAME_TX) != 0
+  for cmd in get_steer_commands(mode, param):
+    plan = get_decode_plan(cmd.dbc, cmd.msg, cmd.signal)
+    idxs = np.flatnonzero(tx & (frames.addrs == plan.address))
+    steering[idxs] = True
+    values[cmd.kind][idxs] = decode_signal(frames.data[idxs], plan)
+  return SteerValues(steering, values[STEER_TORQUE], values[STEER_ANGLE], values[STEER_CURVATURE])
 
-def init_segment(safety, msgs, mode, param):
-  sendcan = (msg for msg in msgs if msg.which() == 'sendcan')
-  steering_msgs = (can for msg in sendcan for can in msg.sendcan if is_steering_msg(mode, param, can.address))
 
-  msg = next(steering_msgs, None)
-  if msg is None:
+def init_segment(safety, frames, steer: SteerValues):
+  steering_msgs = np.flatnonzero(steer.steering)
+  if len(steering_msgs) == 0:
     print("no steering msgs found!")
     return
 
-  msg = package_can_msg(msg)
-  torque, angle = get_steer_value(mode, param, msg)
+  i = steering_msgs[0]
+  msg = libsafety_py.make_CANPacket(int(frames.addrs[i]), int(frames.buses[i]), frames.data[i, :frames.lens[i]].tobytes())
+  torque, angle, curvature = int(steer.torque[i]), int(steer.angle[i]), int(steer.curvature[i])
   if torque != 0:
     safety.set_controls_allowed(1)
     safety.set_controls_allowed_lateral(1)
@@ -108,6 +149,119 @@ def init_segment(safety, msgs, mode, param):
     safety.set_controls_allowed_lateral(1)
     safety.set_desired_angle_last(angle)
     safety.set_angle_meas(angle, angle)
-    safety.set_desired_curvature_last(angle)
-    safety.set_curvature_meas(angle, angle)
+  elif curvature != 0:
+    safety.set_controls_allowed(1)
+    safety.set_controls_allowed_lateral(1)
+    safety.set_desired_curvature_last(curvature)
+    safety.set_curvature_meas(curvature, curvature)
   assert safety.safety_tx_hook(msg), "failed to initialize safety for segment"
+
+class ReplayFrames(NamedTuple):
+  # one entry per CAN frame, see libsafety_py.replay_frames
+  timers: np.ndarray
+  flags: np.ndarray
+  addrs: np.ndarray
+  buses: np.ndarray
+  lens: np.ndarray
+  data: np.ndarray
+  # seconds since the first CAN event, for reporting
+  t: np.ndarray
+
+
+def get_replay_frames(msgs) -> ReplayFrames:
+  """Flattens the CAN events of a drive into frames for a single batched replay call.
+  The safety tick runs with the first frame of each event, outside of the warm up/down period."""
+  can_msgs = [m for m in msgs if m.which() in ('can', 'sendcan')]
+  start_t = can_msgs[0].logMonoTime
+  end_t = can_msgs[-1].logMonoTime
+
+  timers, flags, addrs, buses, lens, t = [], [], [], [], [], []
+  data = bytearray()
+  for msg in can_msgs:
+    timer = (msg.logMonoTime // 1000) % 0xFFFFFFFF
+    # skip start and end of route, warm up/down period
+    tick = libsafety_py.REPLAY_FRAME_TICK if msg.logMonoTime - start_t > 1e9 and end_t - msg.logMonoTime > 1e9 else 0
+
+    if msg.which() == 'sendcan':
+      frames, event_flags = msg.sendcan, libsafety_py.REPLAY_FRAME_TX
+    else:
+      # ignore msgs we sent
+      frames, event_flags = [m for m in msg.can if m.src < 128], 0
+
+    if len(frames) == 0:
+      if tick:
+        frames, event_flags = [None], libsafety_py.REPLAY_FRAME_NO_MSG
+      else:
+        continue
+
+    for canmsg in frames:
+      timers.append(timer)
+      flags.append(event_flags | tick)
+      tick = 0
+      if canmsg is None:
+        addrs.append(0)
+        buses.append(0)
+        lens.append(0)
+        data += bytes(64)
+      else:
+        addrs.append(canmsg.address)
+        buses.append(canmsg.src % 4)
+        lens.append(len(canmsg.dat))
+        data += canmsg.dat.ljust(64, b'\x00')
+      t.append((msg.logMonoTime - start_t) / 1e9)
+
+  return ReplayFrames(np.array(timers, dtype=np.uint32), np.array(flags, dtype=np.uint8), np.array(addrs, dtype=np.uint32),
+                      np.array(buses, dtype=np.uint8), np.array(lens, dtype=np.uint8),
+                      np.frombuffer(bytes(data), dtype=np.uint8).reshape(-1, 64), np.array(t, dtype=np.float64))
+
+
+class ReplaySegment(NamedTuple):
+  name: str
+  safety_mode: int
+  param: int
+  alternative_experience: int
+  param_sp: int
+  frames: ReplayFrames
+
+
+def save_replay_segment(path, segment: ReplaySegment) -> None:
+  """Writes a segment in the extracted CAN format, a compressed npz of the frame arrays and the safety config"""
+  np.savez_compressed(path, safety_mode=segment.safety_mode, param=segment.param, alternative_experience=segment.alternative_experience,
+                      param_sp=segment.param_sp, **segment.frames._asdict())
+
+
+def load_replay_segment(path) -> ReplaySegment:
+  with np.load(path) as f:
+    return ReplaySegment(os.path.basename(path).removesuffix('.npz'), int(f['safety_mode']), int(f['param']), int(f['alternative_experience']),
+                         int(f['param_sp']), ReplayFrames(*(f[field] for field in ReplayFrames._fields)))
+
+
+class StateRecording(NamedTuple):
+  # one entry per recorded frame
+  t: np.ndarray
+  addrs: np.ndarray
+  buses: np.ndarray
+  tx: np.ndarray
+  # columns named by libsafety_py.REPLAY_RECORD_FIELDS, vehicle speeds are in m/s * VEHICLE_SPEED_FACTOR
+  columns: dict[str, np.ndarray]
+
+  @property
+  def blocked(self) -> np.ndarray:
+    """Rows of the blocked tx frames"""
+    return self.tx & ((self.columns['result'] & libsafety_py.REPLAY_RESULT_ALLOWED) == 0)
+
+
+def make_state_recording(records: np.ndarray, frames: ReplayFrames) -> StateRecording:
+  """Attaches the frame of each row recorded by libsafety_py.replay_frames_recorded"""
+  frame = records[:, 0]
+  return StateRecording(frames.t[frame], frames.addrs[frame], frames.buses[frame], (frames.flags[frame] & libsafety_py.REPLAY_FRAME_TX) != 0,
+                        {name: records[:, i] for i, name in enumerate(libsafety_py.REPLAY_RECORD_FIELDS)})
+
+
+def save_state_recording(path, recording: StateRecording) -> None:
+  np.savez_compressed(path, t=recording.t, addrs=recording.addrs, buses=recording.buses, tx=recording.tx, **recording.columns)
+
+
+def load_state_recording(path) -> StateRecording:
+  with np.load(path) as f:
+    return StateRecording(f['t'], f['addrs'], f['buses'], f['tx'], {name: f[name] for name in libsafety_py.REPLAY_RECORD_FIELDS})
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+from tqdm import tqdm
+
+from opendbc.safety.tests.libsafety import libsafety_py
+from opendbc.safety.tests.safety_replay.helpers import ReplaySegment, get_replay_frames, load_replay_segment, save_replay_segment
+from opendbc.safety.tests.safety_replay.replay_drive import ReplayResult, get_safety_config, replay_segment
+
+
+def extract_segment(route_or_segment_name: str, out_dir: str, mode=None, param=None, alternative_experience=None, param_sp=None) -> str:
+  """Converts a log to the extracted CAN format used by the corpus runner"""
+  from openpilot.tools.lib.logreader import LogReader
+
+  lr = LogReader(route_or_segment_name)
+  config = get_safety_config(lr, mode, param, alternative_experience, param_sp)
+  msgs = sorted(lr, key=lambda m: m.logMonoTime)
+
+  name = route_or_segment_name.replace('/', '_')
+  path = os.path.join(out_dir, f"{name}.npz")
+  save_replay_segment(path, ReplaySegment(name, *config, get_replay_frames(msgs)))
+  return path
+
+
+def _replay_worker(path: str) -> tuple[str, ReplayResult]:
+  # each worker process only replays one segment, so the libsafety globals start out clean
+  segment = load_replay_segment(path)
+  result = replay_segment(libsafety_py.libsafety, segment.frames, segment.safety_mode, segment.param, segment.alternative_experience, segment.param_sp)
+  return segment.name, result
+
+
+def replay_corpus(paths: list[str], jobs: int | None = None, profile: str = 'fast') -> dict[str, ReplayResult]:
+  """Replays extracted segments across a process pool, results are keyed and ordered by segment name"""
+  libsafety_so = libsafety_py._build_libsafety(profile=profile)
+  with multiprocessing.get_context('fork').Pool(jobs, initializer=libsafety_py.load, initargs=(libsafety_so,), maxtasksperchild=1) as pool:
+    results = dict(tqdm(pool.imap_unordered(_replay_worker, paths), total=len(paths)))
+  return dict(sorted(results.items()))
+
+
+def aggregate_results(results: dict[str, ReplayResult]) -> ReplayResult:
+  total = ReplayResult()
+  for result in results.values():
+    total.rx_tot += result.rx_tot
+    total.rx_invalid += result.rx_invalid
+    total.invalid_addrs |= result.invalid_addrs
+    total.safety_tick_rx_invalid |= result.safety_tick_rx_invalid
+    total.tx_tot += result.tx_tot
+    total.tx_blocked += result.tx_blocked
+    total.tx_controls += result.tx_controls
+    total.tx_controls_lateral += result.tx_controls_lateral
+    total.tx_controls_blocked += result.tx_controls_blocked
+    total.tx_controls_lateral_blocked += result.tx_controls_lateral_blocked
+    total.blocked_addrs += result.blocked_addrs
+    total.mads_mismatch += result.mads_mismatch
+  return total
+
+
+def print_corpus_report(results: dict[str, ReplayResult]) -> None:
+  total = aggregate_results(results)
+  failed = [name for name, result in results.items() if not result.passed]
+
+  print(f"\nsegments: {len(results)}, failed: {len(failed)}")
+  for name in failed:
+    result = results[name]
+    print(f"  {name}: rx invalid {result.rx_invalid}, safety tick rx invalid {result.safety_tick_rx_invalid}, " +
+          f"blocked with controls_allowed {result.tx_controls_blocked}, blocked with controls_allowed_lateral {result.tx_controls_lateral_blocked}, " +
+          f"mads mismatch {result.mads_mismatch}")
+
+  print("\nRX")
+  print("total rx msgs:", total.rx_tot)
+  print("invalid rx msgs:", total.rx_invalid)
+  print("invalid addrs:", sorted(total.invalid_addrs))
+  print("\nTX")
+  print("total openpilot msgs:", total.tx_tot)
+  print("total msgs with controls_allowed:", total.tx_controls)
+  print("total msgs with controls_allowed_lateral:", total.tx_controls_lateral)
+  print("blocked msgs:", total.tx_blocked)
+  print("blocked with controls_allowed:", total.tx_controls_blocked)
+  print("blocked with controls_allowed_lateral:", total.tx_controls_lateral_blocked)
+  print("blocked addrs:", dict(sorted(total.blocked_addrs.items(), key=lambda kv: (-kv[1], kv[0]))))
+  print("\nMADS")
+  print("mads mismatch (mads_enabled && controls_allowed && !controls_allowed_lateral):", total.mads_mismatch)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Replay a corpus of segments through their safety modes in parallel",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  subparsers = parser.add_subparsers(dest="command", required=True)
+
+  extract_parser = subparsers.add_parser("extract", help="Convert routes or segments to the extracted CAN format")
+  extract_parser.add_argument("route_or_segment_name", nargs='+')
+  extract_parser.add_argument("--out", default=".", help="Output directory")
+  extract_parser.add_argument("--mode", type=int, help="Override the safety mode from the log")
+  extract_parser.add_argument("--param", type=int, help="Override the safety param from the log")
+  extract_parser.add_argument("--alternative-experience", type=int, help="Override the alternative experience from the log")
+  extract_parser.add_argument("--param-sp", type=int, help="Override the sunnypilot safety param from the log")
+
+  run_parser = subparsers.add_parser("run", help="Replay extracted segments")
+  run_parser.add_argument("path", nargs='+', help="Extracted segments, or directories of them")
+  run_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of worker processes")
+  run_parser.add_argument("--profile", default="fast", choices=libsafety_py.BUILD_PROFILES, help="libsafety build profile")
+  args = parser.parse_args()
+
+  if args.command == "extract":
+    os.makedirs(args.out, exist_ok=True)
+    for name in args.route_or_segment_name:
+      print(extract_segment(name, args.out, args.mode, args.param, args.alternative_experience, args.param_sp))
+  else:
+    paths = sorted(p for path in args.path for p in (glob.glob(os.path.join(path, "*.npz")) if os.path.isdir(path) else [path]))
+    results = replay_corpus(paths, args.jobs, args.profile)
+    print_corpus_report(results)
+    sys.exit(0 if all(result.passed for result in results.values()) else 1)
@@ -2,12 +2,15 @@
 import argparse
 import os
 from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+import numpy as np
 from tqdm import tqdm
 
 from opendbc.safety import ALTERNATIVE_EXPERIENCE
 from opendbc.safety.tests.libsafety import libsafety_py
 from opendbc.car.carlog import carlog
-from opendbc.safety.tests.safety_replay.helpers import package_can_msg, init_segment
+from opendbc.safety.tests.safety_replay.helpers import ReplayFrames, StateRecording, get_replay_frames, get_steer_values, init_segment, \
+                                                     make_state_recording, save_state_recording
 
 # Define debug variables and their getter methods
 DEBUG_VARS = {
@@ -21,11 +24,87 @@ DEBUG_VARS = {
 }
 
 
-# replay a drive to check for safety violations
-def replay_drive(msgs, safety_mode, param, alternative_experience, param_sp):
-  safety = libsafety_py.libsafety
-  msgs.sort(key=lambda m: m.logMonoTime)
+def replay_frames_debug(safety, frames):
+  """Per-frame replay through the individual hooks, printing the safety state of blocked and mismatched messages"""
+  results = np.zeros(len(frames.timers), dtype=np.uint8)
+  states = np.zeros(len(frames.timers), dtype=np.uint8)
+
+  # Track last good state for each address
+  last_good_states = defaultdict(lambda: {
+    'timestamp': None,
+    **{var: None for var in DEBUG_VARS}
+  })
 
+  mads_mismatch = 0
+  for i in tqdm(range(len(frames.timers))):
+    result, state = libsafety_py.replay_frames(safety, *(a[i:i + 1] for a in frames[:-1]))
+    results[i], states[i] = result[0], state[0]
+    if not frames.flags[i] & libsafety_py.REPLAY_FRAME_TX:
+      continue
+
+    addr, bus, t = int(frames.addrs[i]), int(frames.buses[i]), frames.t[i]
+    if safety.get_enable_mads() and safety.get_controls_allowed() and not safety.get_controls_allowed_lateral():
+      mads_mismatch += 1
+      print(f"controls_allowed but not controls_allowed_lateral [{mads_mismatch}]")
+      print(f"msg:{addr} ({hex(addr)})")
+      for var, getter in DEBUG_VARS.items():
+        print(f"  {var}: {getter(safety)}")
+
+    if not results[i] & libsafety_py.REPLAY_RESULT_ALLOWED:
+      last_good = last_good_states[addr]
+      print(f"\nBlocked message at {t:.3f}s:")
+      print(f"Address: {hex(addr)} (bus {bus})")
+      print("Current state:")
+      for var, getter in DEBUG_VARS.items():
+        print(f"  {var}: {getter(safety)}")
+
+      if last_good['timestamp'] is not None:
+        print(f"\nLast good state ({last_good['timestamp']:.3f}s):")
+        for var in DEBUG_VARS:
+          print(f"  {var}: {last_good[var]}")
+      else:
+        print("\nNo previous good state found for this address")
+      print("-" * 80)
+    else:  # Update last good state if message is allowed
+      last_good_states[addr].update({
+        'timestamp': t,
+        **{var: getter(safety) for var, getter in DEBUG_VARS.items()}
+      })
+
+  return results, states
+
+
+@dataclass
+class ReplayResult:
+  rx_tot: int = 0
+  rx_invalid: int = 0
+  invalid_addrs: set[int] = field(default_factory=set)
+  safety_tick_rx_invalid: bool = False
+  tx_tot: int = 0
+  tx_blocked: int = 0
+  tx_controls: int = 0
+  tx_controls_lateral: int = 0
+  tx_controls_blocked: int = 0
+  tx_controls_lateral_blocked: int = 0
+  blocked_addrs: Counter = field(default_factory=Counter)
+  mads_mismatch: int = 0
+  # safety state at the end of the drive
+  mads_enabled: bool = False
+  controls_allowed_lateral: bool = False
+  longitudinal_allowed: bool = False
+  # safety state time series, when recording
+  recording: StateRecording | None = None
+
+  @property
+  def passed(self) -> bool:
+    return self.tx_controls_blocked == 0 and self.tx_controls_lateral_blocked == 0 and self.rx_invalid == 0 and \
+           not self.safety_tick_rx_invalid and self.mads_mismatch == 0
+
+
+def replay_segment(safety, frames: ReplayFrames, safety_mode, param, alternative_experience, param_sp, debug: bool = False,
+                   record_every: int = 0) -> ReplayResult:
+  """Replays the frames of a drive through a freshly configured safety mode.
+  With record_every, the safety state is recorded after every record_every-th frame and every blocked tx frame."""
   safety.set_current_safety_param_sp(param_sp)
   err = safety.set_safety_hooks(safety_mode, param)
   assert err == 0, "invalid safety mode: %d" % safety_mode
@@ -35,113 +114,107 @@ def replay_drive(msgs, safety_mode, param, alternative_experience, param_sp):
   _disengage_lateral_on_brake = bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_DISENGAGE_LATERAL_ON_BRAKE)
   _pause_lateral_on_brake = bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_PAUSE_LATERAL_ON_BRAKE)
   safety.set_mads_params(_enable_mads, _disengage_lateral_on_brake, _pause_lateral_on_brake)
-  print("alternative experience:")
-  print(f"  enable mads: {_enable_mads}")
-  print(f"  disengage lateral on brake: {_disengage_lateral_on_brake}")
-  print(f"  pause lateral on brake: {_pause_lateral_on_brake}")
-
-  init_segment(safety, msgs, safety_mode, param)
-
-  rx_tot, rx_invalid, tx_tot, tx_blocked, tx_controls, tx_controls_lateral, tx_controls_blocked, tx_controls_lateral_blocked = 0, 0, 0, 0, 0, 0, 0, 0
-  mads_mismatch = 0
-  safety_tick_rx_invalid = False
-  blocked_addrs = Counter()
-  invalid_addrs = set()
-
-  # Track last good state for each address
-  last_good_states = defaultdict(lambda: {
-    'timestamp': None,
-    **{var: None for var in DEBUG_VARS}
-  })
-
-  can_msgs = [m for m in msgs if m.which() in ('can', 'sendcan')]
-  start_t = can_msgs[0].logMonoTime
-  end_t = can_msgs[-1].logMonoTime
-  for msg in tqdm(can_msgs):
-    safety.set_timer((msg.logMonoTime // 1000) % 0xFFFFFFFF)
-
-    # skip start and end of route, warm up/down period
-    if msg.logMonoTime - start_t > 1e9 and end_t - msg.logMonoTime > 1e9:
-      safety.safety_tick_current_safety_config()
-      safety_tick_rx_invalid |= not safety.safety_config_valid() or safety_tick_rx_invalid
-
-    if msg.which() == 'sendcan':
-      for canmsg in msg.sendcan:
-        _msg = package_can_msg(canmsg)
-        sent = safety.safety_tx_hook(_msg)
-
-        # mismatch: with MADS enabled, stock controls_allowed went true but MADS didn't follow on lateral
-        if safety.get_enable_mads() and safety.get_controls_allowed() and not safety.get_controls_allowed_lateral():
-          mads_mismatch += 1
-          print(f"controls_allowed but not controls_allowed_lateral [{mads_mismatch}]")
-          print(f"msg:{canmsg.address} ({hex(canmsg.address)})")
-          for var, getter in DEBUG_VARS.items():
-            print(f"  {var}: {getter(safety)}")
-        if not sent:
-          tx_blocked += 1
-          tx_controls_blocked += safety.get_controls_allowed()
-          tx_controls_lateral_blocked += safety.get_controls_allowed_lateral()
-          blocked_addrs[canmsg.address] += 1
-
-          carlog.debug("blocked bus %d msg %d at %f" % (canmsg.src, canmsg.address, (msg.logMonoTime - start_t) / 1e9))
-
-          if "DEBUG" in os.environ:
-            last_good = last_good_states[canmsg.address]
-            print(f"\nBlocked message at {(msg.logMonoTime - start_t) / 1e9:.3f}s:")
-            print(f"Address: {hex(canmsg.address)} (bus {canmsg.src})")
-            print("Current state:")
-            for var, getter in DEBUG_VARS.items():
-              print(f"  {var}: {getter(safety)}")
-
-            if last_good['timestamp'] is not None:
-              print(f"\nLast good state ({last_good['timestamp']:.3f}s):")
-              for var in DEBUG_VARS:
-                print(f"  {var}: {last_good[var]}")
-            else:
-              print("\nNo previous good state found for this address")
-            print("-" * 80)
-        else:  # Update last good state if message is allowed
-          last_good_states[canmsg.address].update({
-            'timestamp': (msg.logMonoTime - start_t) / 1e9,
-            **{var: getter(safety) for var, getter in DEBUG_VARS.items()}
-          })
-
-        tx_controls += safety.get_controls_allowed()
-        tx_controls_lateral += safety.get_controls_allowed_lateral()
-        tx_tot += 1
-    elif msg.which() == 'can':
-      # ignore msgs we sent
-      for canmsg in filter(lambda m: m.src < 128, msg.can):
-        safety.safety_fwd_hook(canmsg.src, canmsg.address)
-        _msg = package_can_msg(canmsg)
-        recv = safety.safety_rx_hook(_msg)
-        if not recv:
-          rx_invalid += 1
-          invalid_addrs.add(canmsg.address)
-        rx_tot += 1
 
+  steer = get_steer_values(safety_mode, param, frames)
+  init_segment(safety, frames, steer)
+
+  recording = None
+  if debug:
+    results, states = replay_frames_debug(safety, frames)
+  elif record_every > 0:
+    results, states, records = libsafety_py.replay_frames_recorded(safety, *frames[:-1], record_every=record_every)
+    recording = make_state_recording(records, frames)
+  else:
+    results, states = libsafety_py.replay_frames(safety, *frames[:-1])
+
+  has_msg = (frames.flags & libsafety_py.REPLAY_FRAME_NO_MSG) == 0
+  tx = has_msg & ((frames.flags & libsafety_py.REPLAY_FRAME_TX) != 0)
+  rx = has_msg & ~tx
+  allowed = (results & libsafety_py.REPLAY_RESULT_ALLOWED) != 0
+  controls_allowed = (states & libsafety_py.REPLAY_STATE_CONTROLS_ALLOWED) != 0
+  controls_allowed_lateral = (states & libsafety_py.REPLAY_STATE_CONTROLS_ALLOWED_LATERAL) != 0
+  mads_enabled = (states & libsafety_py.REPLAY_STATE_MADS_ENABLED) != 0
+
+  tx_blocked = tx & ~allowed
+  for i in np.flatnonzero(tx_blocked):
+    steer_cmd = f", steer torque {steer.torque[i]} angle {steer.angle[i]} curvature {steer.curvature[i]}" if steer.steering[i] else ""
+    carlog.debug("blocked bus %d msg %d at %f%s" % (frames.buses[i], frames.addrs[i], frames.t[i], steer_cmd))
+
+  return ReplayResult(
+    rx_tot=int(rx.sum()),
+    rx_invalid=int((rx & ~allowed).sum()),
+    invalid_addrs=set(frames.addrs[rx & ~allowed].tolist()),
+    safety_tick_rx_invalid=bool((results & libsafety_py.REPLAY_RESULT_TICK_INVALID).any()),
+    tx_tot=int(tx.sum()),
+    tx_blocked=int(tx_blocked.sum()),
+    tx_controls=int((tx & controls_allowed).sum()),
+    tx_controls_lateral=int((tx & controls_allowed_lateral).sum()),
+    tx_controls_blocked=int((tx_blocked & controls_allowed).sum()),
+    tx_controls_lateral_blocked=int((tx_blocked & controls_allowed_lateral).sum()),
+    blocked_addrs=Counter(frames.addrs[tx_blocked].tolist()),
+    # mismatch: with MADS enabled, stock controls_allowed went true but MADS didn't follow on lateral
+    mads_mismatch=int((tx & mads_enabled & controls_allowed & ~controls_allowed_lateral).sum()),
+    mads_enabled=bool(safety.get_enable_mads()),
+    controls_allowed_lateral=bool(safety.get_controls_allowed_lateral()),
+    longitudinal_allowed=bool(safety.get_longitudinal_allowed()),
+    recording=recording,
+  )
+
+
+def print_replay_result(result: ReplayResult) -> None:
   print("\nRX")
-  print("total rx msgs:", rx_tot)
-  print("invalid rx msgs:", rx_invalid)
-  print("safety tick rx invalid:", safety_tick_rx_invalid)
-  print("invalid addrs:", invalid_addrs)
+  print("total rx msgs:", result.rx_tot)
+  print("invalid rx msgs:", result.rx_invalid)
+  print("safety tick rx invalid:", result.safety_tick_rx_invalid)
+  print("invalid addrs:", result.invalid_addrs)
   print("\nTX")
-  print("total openpilot msgs:", tx_tot)
-  print("total msgs with controls_allowed:", tx_controls)
-  print("total msgs with controls_allowed_lateral:", tx_controls_lateral)
-  print("blocked msgs:", tx_blocked)
-  print("blocked with controls_allowed:", tx_controls_blocked)
-  print("blocked with controls_allowed_lateral:", tx_controls_lateral_blocked)
-  print("blocked addrs:", blocked_addrs)
+  print("total openpilot msgs:", result.tx_tot)
+  print("total msgs with controls_allowed:", result.tx_controls)
+  print("total msgs with controls_allowed_lateral:", result.tx_controls_lateral)
+  print("blocked msgs:", result.tx_blocked)
+  print("blocked with controls_allowed:", result.tx_controls_blocked)
+  print("blocked with controls_allowed_lateral:", result.tx_controls_lateral_blocked)
+  print("blocked addrs:", result.blocked_addrs)
   print("\nMADS")
-  print("mads enabled:", safety.get_enable_mads())
-  print("controls_allowed_lateral (mads):", safety.get_controls_allowed_lateral())
-  print("longitudinal_tx_allowed (controls_allowed && !gas_pressed):", safety.get_longitudinal_allowed())
-  print("mads mismatch (mads_enabled && controls_allowed && !controls_allowed_lateral):", mads_mismatch)
+  print("mads enabled:", result.mads_enabled)
+  print("controls_allowed_lateral (mads):", result.controls_allowed_lateral)
+  print("longitudinal_tx_allowed (controls_allowed && !gas_pressed):", result.longitudinal_allowed)
+  print("mads mismatch (mads_enabled && controls_allowed && !controls_allowed_lateral):", result.mads_mismatch)
+
+
+def get_safety_config(lr, mode=None, param=None, alternative_experience=None, param_sp=None) -> tuple[int, int, int, int]:
+  """Safety config of a log, with optional overrides"""
+  if None in (mode, param, alternative_experience, param_sp):
+    CP = lr.first('carParams')
+    CP_SP = lr.first('carParamsSP')
+    if mode is None:
+      mode = CP.safetyConfigs[-1].safetyModel.raw
+    if param is None:
+      param = CP.safetyConfigs[-1].safetyParam
+    if alternative_experience is None:
+      alternative_experience = CP.alternativeExperience
+    if param_sp is None:
+      param_sp = CP_SP.safetyParam if hasattr(CP_SP, 'safetyParam') else 0
+  return mode, param, alternative_experience, param_sp
 
-  return tx_controls_blocked == 0 and tx_controls_lateral_blocked == 0 and rx_invalid == 0 and \
-         not safety_tick_rx_invalid and mads_mismatch == 0
 
+# replay a drive to check for safety violations
+def replay_drive(msgs, safety_mode, param, alternative_experience, param_sp, record_path=None, record_every=10):
+  safety = libsafety_py.libsafety
+  msgs.sort(key=lambda m: m.logMonoTime)
+
+  print("alternative experience:")
+  print(f"  enable mads: {bool(alternative_experience & ALTERNATIVE_EXPERIENCE.ENABLE_MADS)}")
+  print(f"  disengage lateral on brake: {bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_DISENGAGE_LATERAL_ON_BRAKE)}")
+  print(f"  pause lateral on brake: {bool(alternative_experience & ALTERNATIVE_EXPERIENCE.MADS_PAUSE_LATERAL_ON_BRAKE)}")
+
+  result = replay_segment(safety, get_replay_frames(msgs), safety_mode, param, alternative_experience, param_sp, debug="DEBUG" in os.environ,
+                          record_every=record_every if record_path is not None else 0)
+  print_replay_result(result)
+  if result.recording is not None:
+    save_state_recording(record_path, result.recording)
+    print(f"\nrecorded {len(result.recording.t)} states, {int(result.recording.blocked.sum())} blocked, to {record_path}")
+  return result.passed
 
 if __name__ == "__main__":
   from openpilot.tools.lib.logreader import LogReader
@@ -153,23 +226,14 @@ if __name__ == "__main__":
   parser.add_argument("--param", type=int, help="Override the safety param from the log")
   parser.add_argument("--alternative-experience", type=int, help="Override the alternative experience from the log")
   parser.add_argument("--param-sp", type=int, help="Override the sunnypilot safety param from the log")
+  parser.add_argument("--record", help="Record the safety state over the drive to this .npz file")
+  parser.add_argument("--record-every", type=int, default=10, help="Record the safety state every N frames, blocked tx frames are always recorded")
   args = parser.parse_args()
 
   lr = LogReader(args.route_or_segment_name[0])
-
-  if None in (args.mode, args.param, args.alternative_experience, args.param_sp):
-    CP = lr.first('carParams')
-    CP_SP = lr.first('carParamsSP')
-    if args.mode is None:
-      args.mode = CP.safetyConfigs[-1].safetyModel.raw
-    if args.param is None:
-      args.param = CP.safetyConfigs[-1].safetyParam
-    if args.alternative_experience is None:
-      args.alternative_experience = CP.alternativeExperience
-    if args.param_sp is None:
-      _param_sp = CP_SP.safetyParam if hasattr(CP_SP, 'safetyParam') else 0
-      args.param_sp = _param_sp
+  args.mode, args.param, args.alternative_experience, args.param_sp = get_safety_config(lr, args.mode, args.param, args.alternative_experience,
+                                                                                        args.param_sp)
 
   print(f"replaying {args.route_or_segment_name[0]} with safety mode {args.mode}, param {args.param}, alternative experience {args.alternative_experience}, " +
         f"param_sp {args.param_sp}")
-  replay_drive(list(lr), args.mode, args.param, args.alternative_experience, args.param_sp)
+  replay_drive(list(lr), args.mode, args.param, args.alternative_experience, args.param_sp, args.record, args.record_every)
@@ -7,10 +7,10 @@ cd $DIR
 source ../../../setup.sh
 
 # reset coverage data
-rm -f ./libsafety/*.gcda
+rm -f ./libsafety/build/*.gcda
 
-# run safety tests and generate coverage data
-python -m unittest discover -s .
+# run safety tests across all cores and merge their coverage data
+python run_tests.py
 
 # NOTE: we accept that these tools will have slight differences,
 # and in return, we get to use the stock toolchain instead of
@@ -6,6 +6,7 @@ See the LICENSE.md file in the root directory for more details.
 """
 import json
 import numpy as np
+from functools import cache
 from typing import NamedTuple
 from collections.abc import Callable
 
@@ -43,36 +44,81 @@ class CarInterfaceBaseSP:
     return self.torque_from_lateral_accel_linear_in_torque_space
 
 
+@cache
+def _load_nano_ff_weights(weights_loc: str) -> dict[str, dict[str, np.ndarray]]:
+  # parsed once per process and shared by every NanoFFModel instance, so the arrays are read-only
+  with open(weights_loc) as fob:
+    platforms = json.load(fob)
+
+  weights = {}
+  for platform, platform_weights in platforms.items():
+    weights[platform] = {k: np.array(v) for k, v in platform_weights.items()}
+    for v in weights[platform].values():
+      v.setflags(write=False)
+  return weights
+
+
 class NanoFFModel:
+  N_LAYERS = 4
+
   def __init__(self, weights_loc: str, platform: str):
     self.weights_loc = weights_loc
     self.platform = platform
     self.load_weights(platform)
 
   def load_weights(self, platform: str):
-    with open(self.weights_loc) as fob:
-      self.weights = {k: np.array(v) for k, v in json.load(fob)[platform].items()}
+    self.weights = _load_nano_ff_weights(self.weights_loc)[platform]
+
+    input_norm_mat = self.weights['input_norm_mat']
+    self.input_offset = input_norm_mat[:, 0]
+    self.input_range = input_norm_mat[:, 1] - input_norm_mat[:, 0]
+    self.output_offset = self.weights['output_norm_mat'][0]
+    self.output_range = self.weights['output_norm_mat'][1] - self.weights['output_norm_mat'][0]
+    self.layers = [(self.weights[f'w_{i}'], self.weights[f'b_{i}']) for i in range(1, self.N_LAYERS + 1)]
+
+    # intermediate buffers, grown to the largest batch seen
+    self._alloc_buffers(1)
+
+  def _alloc_buffers(self, n: int):
+    self._buffers: list[np.ndarray] = [np.empty((n, len(self.input_offset)))] + [np.empty((n, len(b))) for _, b in self.layers[:-1]]
 
   def relu(self, x: np.ndarray):
     return np.maximum(0.0, x)
 
   def forward(self, x: np.ndarray):
-    assert x.ndim == 1
-    x = (x - self.weights['input_norm_mat'][:, 0]) / (self.weights['input_norm_mat'][:, 1] - self.weights['input_norm_mat'][:, 0])
-    x = self.relu(np.dot(x, self.weights['w_1']) + self.weights['b_1'])
-    x = self.relu(np.dot(x, self.weights['w_2']) + self.weights['b_2'])
-    x = self.relu(np.dot(x, self.weights['w_3']) + self.weights['b_3'])
-    x = np.dot(x, self.weights['w_4']) + self.weights['b_4']
-    return x
-
-  def predict(self, x: list[float], do_sample: bool = False):
-    x = self.forward(np.array(x))
+    """Runs the model on a single sample of shape (features,) or a batch of shape (N, features)"""
+    assert x.ndim in (1, 2)
+    n = 1 if x.ndim == 1 else len(x)
+    if n > len(self._buffers[0]):
+      self._alloc_buffers(n)
+
+    buf = self._buffers[0][:n] if x.ndim == 2 else self._buffers[0][0]
+    np.subtract(x, self.input_offset, out=buf)
+    np.divide(buf, self.input_range, out=buf)
+    for (w, b), out in zip(self.layers[:-1], self._buffers[1:], strict=True):
+      out = out[:n] if x.ndim == 2 else out[0]
+      np.dot(buf, w, out=out)
+      np.add(out, b, out=out)
+      buf = np.maximum(out, 0.0, out=out)
+
+    w, b = self.layers[-1]
+    return np.dot(buf, w) + b
+
+  def _denormalize(self, x: np.ndarray, do_sample: bool):
     if do_sample:
-      pred = np.random.laplace(x[0], np.exp(x[1]) / self.weights['temperature'])
+      pred = np.random.laplace(x[..., 0], np.exp(x[..., 1]) / self.weights['temperature'])
     else:
-      pred = x[0]
-    pred = pred * (self.weights['output_norm_mat'][1] - self.weights['output_norm_mat'][0]) + self.weights['output_norm_mat'][0]
-    return pred
+      pred = x[..., 0]
+    return pred * self.output_range + self.output_offset
+
+  def predict(self, x: list[float], do_sample: bool = False):
+    return self._denormalize(self.forward(np.asarray(x, dtype=np.float64)), do_sample)
+
+  def predict_batch(self, x: np.ndarray, do_sample: bool = False) -> np.ndarray:
+    """Vectorized predict over an (N, features) array of samples, returns N predictions"""
+    x = np.asarray(x, dtype=np.float64)
+    assert x.ndim == 2
+    return self._denormalize(self.forward(x), do_sample)
 
 
 def setup_interfaces(CI, CP: structs.CarParams, CP_SP: structs.CarParamsSP,
@@ -0,0 +1,55 @@
+import json
+import os
+import unittest
+
+import numpy as np
+
+from opendbc.car.common.basedir import BASEDIR
+from opendbc.car.gm.values import CAR
+from opendbc.sunnypilot.car.interfaces import NanoFFModel
+
+NEURAL_PARAMS_PATH = os.path.join(BASEDIR, '../sunnypilot/car/torque_data/neural_ff_weights.json')
+
+
+def reference_predict(weights: dict[str, np.ndarray], x: list[float]) -> float:
+  # straightforward single sample implementation to check against
+  x = np.array(x)
+  x = (x - weights['input_norm_mat'][:, 0]) / (weights['input_norm_mat'][:, 1] - weights['input_norm_mat'][:, 0])
+  x = np.maximum(0.0, np.dot(x, weights['w_1']) + weights['b_1'])
+  x = np.maximum(0.0, np.dot(x, weights['w_2']) + weights['b_2'])
+  x = np.maximum(0.0, np.dot(x, weights['w_3']) + weights['b_3'])
+  x = np.dot(x, weights['w_4']) + weights['b_4']
+  return x[0] * (weights['output_norm_mat'][1] - weights['output_norm_mat'][0]) + weights['output_norm_mat'][0]
+
+
+class TestNanoFFModel(unittest.TestCase):
+  platform = CAR.CHEVROLET_BOLT_EUV
+
+  def setUp(self):
+    with open(NEURAL_PARAMS_PATH) as f:
+      self.weights = {k: np.array(v) for k, v in json.load(f)[self.platform].items()}
+    self.model = NanoFFModel(NEURAL_PARAMS_PATH, self.platform)
+
+    rng = np.random.default_rng(0)
+    self.inputs = np.column_stack([rng.uniform(-3, 3, 500), rng.uniform(-0.5, 0.5, 500), rng.uniform(0, 40, 500), rng.uniform(-3, 2, 500)])
+
+  def test_predict(self):
+    for x in self.inputs:
+      self.assertEqual(self.model.predict(x.tolist()), reference_predict(self.weights, x.tolist()))
+
+  def test_predict_batch(self):
+    expected = [reference_predict(self.weights, x.tolist()) for x in self.inputs]
+    np.testing.assert_allclose(self.model.predict_batch(self.inputs), expected, rtol=1e-12, atol=1e-12)
+
+    # smaller batches reuse the grown buffers
+    np.testing.assert_allclose(self.model.predict_batch(self.inputs[:10]), expected[:10], rtol=1e-12, atol=1e-12)
+    self.assertEqual(self.model.predict(self.inputs[0].tolist()), expected[0])
+
+  def test_shared_weights(self):
+    other = NanoFFModel(NEURAL_PARAMS_PATH, self.platform)
+    self.assertIs(other.weights, self.model.weights)
+    self.assertFalse(other.weights['w_1'].flags.writeable)
+
+
+if __name__ == "__main__":
+  unittest.main()